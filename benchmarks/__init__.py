@@ -0,0 +1,12 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+"""
@@ -0,0 +1,128 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Plugin files and catalogues of plugin records for benchmarks.
+
+"""
+
+import io
+import os
+import zipfile
+from datetime import datetime, timezone
+
+from src.plugin import storage
+from src.plugin.metadata_model import MetadataModel, format_item_version, hash_token
+
+TOKEN = "benchmark"
+
+
+def plugin_zip(plugin_id, version="1.0.0", payload_size=1024, files=1, about="A plugin for benchmarking"):
+    """
+    Build a valid plugin file
+    :param plugin_id: plugin id (the zip's root directory)
+    :type plugin_id: str
+    :param version: plugin version
+    :type version: str
+    :param payload_size: bytes of incompressible content per file
+    :type payload_size: int
+    :param files: number of python files
+    :type files: int
+    :param about: metadata.txt about
+    :type about: str
+    :returns: plugin file
+    :rtype: bytes
+    """
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(
+            f"{plugin_id}/metadata.txt",
+            f"[general]\nname={plugin_id}\nemail=benchmark@linz.govt.nz\nauthor=Benchmark\n"
+            f"description=Plugin {plugin_id}\nversion={version}\nabout={about}\n"
+            f"repository=https://github.com/linz/{plugin_id}\nqgisMinimumVersion=3.0\nqgisMaximumVersion=3.99\n",
+        )
+        for index in range(files):
+            archive.writestr(f"{plugin_id}/module_{index}.py", os.urandom(payload_size))
+    return buffer.getvalue()
+
+
+def version_zero(plugin_id, plugin_stage="", revisions=1, item_version=None, **attributes):
+    """
+    Build a plugin's version zero record (or, given an item_version, a revision)
+    """
+
+    now = datetime.now(timezone.utc)
+    defaults = {
+        "stage": plugin_stage or None,
+        "revisions": revisions,
+        "created_at": now,
+        "updated_at": now,
+        "name": plugin_id,
+        "qgis_minimum_version": "3.0",
+        "qgis_maximum_version": "3.99",
+        "description": f"Plugin {plugin_id}",
+        "about": "A plugin for benchmarking",
+        "version": "1.0.0",
+        "author_name": "Benchmark",
+        "email": "benchmark@linz.govt.nz",
+        "repository": f"https://github.com/linz/{plugin_id}",
+        "file_name": f"{plugin_id}.zip",
+    }
+    return MetadataModel(
+        id=plugin_id, item_version=item_version or format_item_version(plugin_stage), **{**defaults, **attributes}
+    )
+
+
+def token_record(plugin_id, plugin_stage="", token=TOKEN):
+    """
+    Build the record holding a plugin's secret
+    """
+
+    return MetadataModel(id=plugin_id, item_version=format_item_version(plugin_stage, "metadata"), secret=hash_token(token))
+
+
+def batch_put(records):
+    """
+    Write records to the configured metadata store (in batches of 25 to
+    DynamoDB). Records are written as is so may omit attributes
+    (e.g. token records) as records created by new_plugin_record.sh do
+    :param records: records to write
+    :type records: iterable
+    :returns: number of records written
+    :rtype: int
+    """
+
+    return storage.get_metadata_store().put_records(records)
+
+
+def seed(plugins, plugin_stage=""):
+    """
+    Write version zero, first revision and token records for a number of plugins
+    :param plugins: number of plugins
+    :type plugins: int
+    :param plugin_stage: plugins' stage
+    :type plugin_stage: str
+    :returns: plugin ids
+    :rtype: list
+    """
+
+    plugin_ids = [f"plugin_{index:06d}" for index in range(plugins)]
+    batch_put(
+        record
+        for plugin_id in plugin_ids
+        for record in (
+            version_zero(plugin_id, plugin_stage),
+            version_zero(plugin_id, plugin_stage, item_version=format_item_version(plugin_stage, "1")),
+            token_record(plugin_id, plugin_stage),
+        )
+    )
+    return plugin_ids
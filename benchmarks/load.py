@@ -0,0 +1,276 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Local concurrent load test harness.
+
+    Drives the API, in process via the flask test client or over HTTP via a
+    local threaded WSGI server, backed by local stand-ins for DynamoDB and S3
+    seeded with a synthetic repository. Requests follow a configurable mix
+    of routes and are started at a target rate (open loop) by --concurrency
+    workers. Latency is measured from each request's scheduled start so
+    queueing when the API cannot keep up is included.
+
+    Throughput, p50/p95/p99 latency and error rates are reported per route.
+
+    Usage:
+        python -m benchmarks.load --rate 50 --duration 30 --mix xml=0.8 list=0.1 revisions=0.05 upload=0.05
+        python -m benchmarks.load --server --concurrency 16 --plugins 1000
+
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from werkzeug.serving import make_server
+
+from benchmarks import catalogue, synthetic
+from benchmarks.stand_ins import STORAGE, local_storage
+from src.plugin import api, log
+
+QGIS_VERSIONS = ("3.16.0", "3.22.16", "3.28.15", "3.34.4", "3.40.1")
+DEFAULT_MIX = ("xml=0.8", "list=0.1", "revisions=0.05", "upload=0.05")
+
+
+def route_request(route, rng, plugin_ids, iteration):
+    """
+    Build a request for a route
+    :param route: route name
+    :type route: str
+    :param rng: random number generator
+    :type rng: random.Random
+    :param plugin_ids: ids of seeded plugins
+    :type plugin_ids: list
+    :param iteration: request number
+    :type iteration: int
+    :returns: method, path, body and headers
+    :rtype: tuple
+    """
+
+    plugin_id = rng.choice(plugin_ids)
+    if route == "xml":
+        return "GET", f"/v1/plugins.xml?qgis={rng.choice(QGIS_VERSIONS)}", None, {}
+    if route == "list":
+        return "GET", f"/v1/plugin/{plugin_id}", None, {}
+    if route == "revisions":
+        return "GET", f"/v1/plugin/{plugin_id}/revision", None, {}
+    if route == "upload":
+        headers = {"Authorization": f"Bearer {catalogue.TOKEN}", "Content-Type": "application/octet-stream"}
+        return "POST", f"/v1/plugin/{plugin_id}", catalogue.plugin_zip(plugin_id, f"2.0.{iteration}"), headers
+    raise ValueError(f"Unknown route {route}")
+
+
+class InProcessClient:
+    """
+    Makes requests via the flask test client
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def request(self, method, path, data, headers):
+        if not hasattr(self._local, "client"):
+            self._local.client = api.app.test_client()
+        return self._local.client.open(path, method=method, data=data, headers=headers).status_code
+
+
+class HttpClient:
+    """
+    Makes requests to a local WSGI server
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def request(self, method, path, data, headers):
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+
+
+@contextmanager
+def wsgi_server():
+    """
+    Serve the API from a local threaded WSGI server
+    :returns: client for the server
+    :rtype: HttpClient
+    """
+
+    server = make_server("127.0.0.1", 0, api.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield HttpClient(f"http://127.0.0.1:{server.server_port}")
+    finally:
+        server.shutdown()
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest rank percentile of sorted values
+    """
+
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values) + 0.5) - 1))
+    return round(sorted_values[index], 3)
+
+
+def summarise(samples, elapsed):
+    """
+    Summarise the samples of each route
+    :param samples: route -> list of (latency ms, status)
+    :type samples: dict
+    :param elapsed: duration of the run (s)
+    :type elapsed: float
+    :returns: route -> throughput, latency percentiles and error rates
+    :rtype: dict
+    """
+
+    report = {}
+    for route, route_samples in sorted(samples.items()):
+        latencies = sorted(latency for latency, _ in route_samples)
+        server_errors = sum(1 for _, status in route_samples if status is None or status >= 500)
+        client_errors = sum(1 for _, status in route_samples if status is not None and 400 <= status < 500)
+        report[route] = {
+            "requests": len(route_samples),
+            "throughput_rps": round(len(route_samples) / elapsed, 2),
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+            "max_ms": round(latencies[-1], 3),
+            "error_rate": round(server_errors / len(route_samples), 4),
+            "client_error_rate": round(client_errors / len(route_samples), 4),
+        }
+    return report
+
+
+def run_schedule(client, schedule, concurrency):
+    """
+    Start each request at its scheduled time (open loop)
+    :param client: InProcessClient or HttpClient
+    :type client: object
+    :param schedule: (seconds from start, route, request) in time order
+    :type schedule: iterable
+    :param concurrency: worker threads
+    :type concurrency: int
+    :returns: summary per route and for all routes
+    :rtype: dict
+    """
+
+    samples = defaultdict(list)
+    lock = threading.Lock()
+
+    def send(route, request, scheduled):
+        try:
+            status = client.request(*request)
+        except Exception:  # pylint: disable=broad-except
+            status = None
+        latency = (time.perf_counter() - scheduled) * 1000
+        with lock:
+            samples[route].append((latency, status))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for offset, route, request in schedule:
+            scheduled = start + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, route, request, scheduled)
+    elapsed = time.perf_counter() - start
+    report = summarise(samples, elapsed)
+    report["all"] = summarise({"all": [sample for route_samples in samples.values() for sample in route_samples]}, elapsed)[
+        "all"
+    ]
+    return report
+
+
+def mixed_schedule(mix, plugin_ids, rate, duration, seed=0):
+    """
+    Schedule requests for the routes of a mix at the target rate for the duration
+    :param mix: route -> weight
+    :type mix: dict
+    :param plugin_ids: ids of seeded plugins
+    :type plugin_ids: list
+    :param rate: requests started per second
+    :type rate: float
+    :param duration: seconds to start requests for
+    :type duration: float
+    :returns: (seconds from start, route, request) as taken by run_schedule
+    :rtype: generator
+    """
+
+    rng = random.Random(seed)
+    routes, weights = zip(*mix.items())
+    for iteration in range(int(rate * duration)):
+        route = rng.choices(routes, weights)[0]
+        yield iteration / rate, route, route_request(route, rng, plugin_ids, iteration)
+
+
+def parse_mix(values):
+    """
+    Parse route=weight values
+    """
+
+    mix = {}
+    for value in values:
+        route, _, weight = value.partition("=")
+        mix[route] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the API against local stand-ins")
+    parser.add_argument(
+        "--mix", nargs="+", default=list(DEFAULT_MIX), help="route=weight. Routes: xml, list, revisions, upload"
+    )
+    parser.add_argument("--rate", type=float, default=20, help="requests started per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to start requests for")
+    parser.add_argument("--concurrency", type=int, default=8, help="worker threads")
+    parser.add_argument("--plugins", type=int, default=100, help="synthetic plugins seeded")
+    parser.add_argument("--revisions", type=int, default=3, help="revisions per synthetic plugin")
+    parser.add_argument("--server", action="store_true", help="drive a local WSGI server over HTTP")
+    parser.add_argument("--storage", choices=sorted(STORAGE), default="aws", help="stand-in the API is run against")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    for route in mix:
+        route_request(route, random.Random(), ["plugin"], 0)
+    # Request logs would swamp the report
+    log.configure(level="warning")
+    with local_storage(args.storage):
+        plugin_ids = synthetic.generate(args.plugins, args.revisions, generator=synthetic.Generator(seed=args.seed))
+        schedule = mixed_schedule(mix, plugin_ids, args.rate, args.duration, args.seed)
+        if not args.server:
+            report = run_schedule(InProcessClient(), schedule, args.concurrency)
+        else:
+            with wsgi_server() as client:
+                report = run_schedule(client, schedule, args.concurrency)
+    print(
+        json.dumps({"rate": args.rate, "duration": args.duration, "concurrency": args.concurrency, "routes": report}, indent=2)
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Replay of production read traffic from RequestMetadata logs.
+
+    Exported API logs (JSON lines, optionally prefixed as in CloudWatch
+    exports) are parsed for RequestMetadata events. Their GET requests, such
+    as plugins.xml with its real qgis version distribution and plugin lookups,
+    are replayed at the recorded rate, or scaled by --speed, against a local
+    instance. Latency distributions per route are compared with the recorded
+    durations. Events of logs sampled with LOG_SAMPLE_RATE are scaled by their
+    sampleRate so the replayed rate is that of all requests, not just those
+    logged.
+
+    By default the local instance is the API in process (or served by a local
+    WSGI server with --server) backed by local stand-ins seeded with a
+    synthetic repository. Recorded plugin ids are then mapped onto synthetic
+    plugins, keeping the popularity of each plugin. With --target requests
+    are sent as recorded to an instance already running elsewhere.
+
+    Usage:
+        python -m benchmarks.replay api-logs.jsonl --speed 2
+        python -m benchmarks.replay api-logs.jsonl --target http://localhost:5000
+
+"""
+
+import argparse
+import json
+import urllib.parse
+from collections import Counter, defaultdict
+
+from werkzeug.exceptions import HTTPException
+
+from benchmarks import load, synthetic
+from benchmarks.stand_ins import STORAGE, local_storage
+from src.plugin import api, log
+
+
+def parse_records(lines):
+    """
+    Parse the RequestMetadata events of log lines
+    :param lines: log lines
+    :type lines: iterable
+    :returns: RequestMetadata events
+    :rtype: generator
+    """
+
+    return (event for event in log.read_events(lines, "RequestMetadata") if "time" in event)
+
+
+def read_traffic(records):
+    """
+    Reconstruct the read traffic of RequestMetadata events
+    :param records: RequestMetadata events
+    :type records: iterable
+    :returns: (time ms, route, path, recorded duration ms) of GET requests, scaled by
+        their sample rate, in time order
+    :rtype: list
+    """
+
+    adapter = api.app.url_map.bind("localhost")
+    traffic = []
+    for record in records:
+        if record.get("method") != "GET":
+            continue
+        try:
+            rule, view_args = adapter.match(record["uri"], method="GET", return_rule=True)
+        except HTTPException:
+            continue
+        traffic.append(
+            (
+                record["time"],
+                rule.rule,
+                rule.endpoint,
+                view_args,
+                record.get("args") or {},
+                record.get("duration"),
+                record.get("sampleRate", 1),
+            )
+        )
+    traffic.sort(key=lambda request: request[0])
+    return unsample(traffic)
+
+
+def unsample(traffic):
+    """
+    Scale sampled traffic back up to the requests it represents. Each
+    request logged at a sampleRate is replayed 1 / sampleRate times, spread
+    evenly until the next recorded request. Fractions are carried over
+    so the total number of requests is kept
+    :param traffic: (time ms, route, endpoint, view args, args, duration ms, sample rate) in time order
+    :type traffic: list
+    :returns: (time ms, route, endpoint, view args, args, duration ms) in time order
+    :rtype: list
+    """
+
+    requests = []
+    owed = 0.0
+    for index, (recorded_time, *request, sample_rate) in enumerate(traffic):
+        owed += 1 / sample_rate
+        copies = int(round(owed, 6))
+        owed -= copies
+        following = traffic[index + 1][0] if index + 1 < len(traffic) else recorded_time
+        for copy in range(copies):
+            requests.append((recorded_time + (following - recorded_time) * copy / copies, *request))
+    return requests
+
+
+class PluginMap:
+    """
+    Maps recorded plugin ids onto local plugin ids. Distinct recorded
+    plugins map to distinct local plugins while there are enough
+    """
+
+    def __init__(self, plugin_ids):
+        self.plugin_ids = plugin_ids
+        self.mapped = {}
+
+    def __call__(self, plugin_id):
+        if plugin_id not in self.mapped:
+            self.mapped[plugin_id] = self.plugin_ids[len(self.mapped) % len(self.plugin_ids)]
+        return self.mapped[plugin_id]
+
+
+def schedule(traffic, speed, plugin_map=None):
+    """
+    Schedule the traffic relative to its first request
+    :param traffic: traffic as returned by read_traffic
+    :type traffic: list
+    :param speed: replay rate relative to the recorded rate
+    :type speed: float
+    :param plugin_map: maps recorded plugin ids. Not mapped if None
+    :type plugin_map: PluginMap
+    :returns: (seconds from start, route, request)
+    :rtype: generator
+    """
+
+    adapter = api.app.url_map.bind("localhost")
+    first = traffic[0][0] if traffic else 0
+    for recorded_time, route, endpoint, view_args, args, _ in traffic:
+        if plugin_map and "plugin_id" in view_args:
+            view_args = {**view_args, "plugin_id": plugin_map(view_args["plugin_id"])}
+        path = adapter.build(endpoint, view_args)
+        if args:
+            path += "?" + urllib.parse.urlencode(args)
+        yield (recorded_time - first) / 1000 / speed, route, ("GET", path, None, {})
+
+
+def recorded_summary(traffic):
+    """
+    Latency percentiles of the recorded durations per route
+    """
+
+    durations = defaultdict(list)
+    for _, route, _, _, _, duration in traffic:
+        if duration is not None:
+            durations[route].append(duration)
+    return {
+        route: {
+            "requests": len(values),
+            "p50_ms": load.percentile(sorted(values), 0.50),
+            "p95_ms": load.percentile(sorted(values), 0.95),
+            "p99_ms": load.percentile(sorted(values), 0.99),
+        }
+        for route, values in durations.items()
+    }
+
+
+def compare(recorded, replayed):
+    """
+    Compare replayed latency percentiles with those recorded
+    :returns: route -> recorded, replayed and the ratio of each percentile
+    :rtype: dict
+    """
+
+    comparison = {}
+    for route, replayed_route in replayed.items():
+        if route == "all":
+            continue
+        recorded_route = recorded.get(route, {})
+        comparison[route] = {
+            "recorded": recorded_route,
+            "replayed": replayed_route,
+            "ratio": {
+                key: round(replayed_route[key] / recorded_route[key], 3)
+                for key in ("p50_ms", "p95_ms", "p99_ms")
+                if recorded_route.get(key) and replayed_route.get(key) is not None
+            },
+        }
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay production read traffic from RequestMetadata logs")
+    parser.add_argument("logs", nargs="+", help="exported log files")
+    parser.add_argument("--speed", type=float, default=1, help="replay rate relative to the recorded rate")
+    parser.add_argument("--limit", type=int, help="replay at most this many requests")
+    parser.add_argument("--concurrency", type=int, default=16, help="worker threads")
+    parser.add_argument("--target", help="base URL of a running instance to replay against")
+    parser.add_argument("--server", action="store_true", help="serve the local instance from a WSGI server")
+    parser.add_argument("--storage", choices=sorted(STORAGE), default="aws", help="stand-in the local instance uses")
+    parser.add_argument("--plugins", type=int, default=200, help="synthetic plugins seeded")
+    parser.add_argument("--revisions", type=int, default=3, help="revisions per synthetic plugin")
+    args = parser.parse_args()
+
+    traffic = []
+    for path in args.logs:
+        with open(path, encoding="utf-8") as logs:
+            traffic.extend(read_traffic(parse_records(logs)))
+    traffic.sort(key=lambda request: request[0])
+    traffic = traffic[: args.limit]
+    recorded = recorded_summary(traffic)
+    qgis_versions = Counter(request[4].get("qgis") for request in traffic if request[1].endswith("plugins.xml"))
+
+    if args.target:
+        replayed = load.run_schedule(load.HttpClient(args.target.rstrip("/")), schedule(traffic, args.speed), args.concurrency)
+    else:
+        # Request logs would swamp the report
+        log.configure(level="warning")
+        with local_storage(args.storage):
+            plugin_map = PluginMap(synthetic.generate(args.plugins, args.revisions, ("", "dev")))
+            requests = schedule(traffic, args.speed, plugin_map)
+            if args.server:
+                with load.wsgi_server() as client:
+                    replayed = load.run_schedule(client, requests, args.concurrency)
+            else:
+                replayed = load.run_schedule(load.InProcessClient(), requests, args.concurrency)
+
+    report = {
+        "requests": len(traffic),
+        "speed": args.speed,
+        "qgis_versions": dict(qgis_versions.most_common()),
+        "routes": compare(recorded, replayed),
+        "all": replayed.get("all"),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Benchmarks of the API hot paths run offline against local stand-ins
+    for DynamoDB and S3, or the memory or SQLite stores (see stand_ins.py).
+
+    Catalogue dependent benchmarks are run at each --sizes catalogue size.
+    Results are written as JSON and, with --baseline, compared against a
+    stored baseline. The run fails if any benchmark's median is slower
+    than its baseline by more than its threshold.
+
+    Usage:
+        python -m benchmarks.run --sizes 10 100 1000 --output results.json
+        python -m benchmarks.run --baseline baseline.json --threshold 0.25 --threshold xml_body=0.5
+
+"""
+
+import argparse
+import io
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import zipfile
+from datetime import datetime, timezone
+from typing import Any, Callable
+
+from benchmarks import catalogue, synthetic
+from benchmarks.stand_ins import STORAGE, local_storage
+from src.plugin import api, log, plugin_parser, plugin_xml, storage
+from src.plugin.metadata_model import format_item_version
+
+# name -> (function(size), or function() if not sized, returning the function(iteration) to time,
+# whether it depends on catalogue size)
+BENCHMARKS: dict[str, tuple[Callable[..., Any], bool]] = {}
+DEFAULT_THRESHOLD = 0.25
+QGIS_VERSION = "3.34.0"
+# Seed catalogues with synthetic plugins (see synthetic.py) rather than identical minimal plugins
+# and run against the "aws", "memory" or "sqlite" stand-in
+OPTIONS = {"synthetic": False, "storage": "aws"}
+
+
+def benchmark(name, sized=True):
+    """
+    Register a benchmark
+    :param name: benchmark name
+    :type name: str
+    :param sized: True if run at each catalogue size
+    :type sized: bool
+    :returns: decorator
+    :rtype: function
+    """
+
+    def register(func):
+        BENCHMARKS[name] = (func, sized)
+        return func
+
+    return register
+
+
+def seed(size):
+    """
+    Seed a catalogue of plugins
+    :param size: number of plugins
+    :type size: int
+    :returns: plugin ids
+    :rtype: list
+    """
+
+    if OPTIONS["synthetic"]:
+        return synthetic.generate(size, 1)
+    return catalogue.seed(size)
+
+
+@benchmark("xml_body")
+def xml_body(size):
+    seed(size)
+    return lambda iteration: plugin_xml.generate_xml_body(api.repo_bucket_name, api.aws_region, QGIS_VERSION, "")
+
+
+@benchmark("all_version_zeros")
+def all_version_zeros(size):
+    seed(size)
+    metadata_store = storage.get_metadata_store()
+    return lambda iteration: list(metadata_store.all_version_zeros(""))
+
+
+@benchmark("revision_listing")
+def revision_listing(size):
+    [plugin_id] = catalogue.seed(1)
+    catalogue.batch_put(
+        catalogue.version_zero(plugin_id, item_version=format_item_version("", str(revision)))
+        for revision in range(1, size + 1)
+    )
+    client = api.app.test_client()
+    return lambda iteration: client.get(f"/v1/plugin/{plugin_id}/revision")
+
+
+@benchmark("upload")
+def upload(size):
+    plugin_id = seed(size)[0]
+    client = api.app.test_client()
+    headers = {"Authorization": f"Bearer {catalogue.TOKEN}"}
+
+    def run(iteration):
+        response = client.post(
+            f"/v1/plugin/{plugin_id}", data=catalogue.plugin_zip(plugin_id, f"1.0.{iteration}"), headers=headers
+        )
+        assert response.status_code == 201, response.json
+
+    return run
+
+
+def inspect(data):
+    def run(iteration):  # pylint: disable=unused-argument
+        with zipfile.ZipFile(io.BytesIO(data)) as plugin_zipfile:
+            return plugin_parser.inspect_plugin(plugin_zipfile)
+
+    return run
+
+
+@benchmark("plugin_parser[small]", sized=False)
+def plugin_parser_small():
+    return inspect(catalogue.plugin_zip("small_plugin", files=10, payload_size=1024))
+
+
+@benchmark("plugin_parser[large]", sized=False)
+def plugin_parser_large():
+    return inspect(catalogue.plugin_zip("large_plugin", files=100, payload_size=64 * 1024))
+
+
+def measure(func, repeat, warmup=1):
+    """
+    Time repeated calls
+    :param func: function(iteration) to time
+    :type func: function
+    :param repeat: timed calls
+    :type repeat: int
+    :param warmup: untimed calls first
+    :type warmup: int
+    :returns: timing statistics (ms)
+    :rtype: dict
+    """
+
+    for iteration in range(warmup):
+        func(iteration)
+    timings = []
+    for iteration in range(warmup, warmup + repeat):
+        start = time.perf_counter()
+        func(iteration)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "repeat": repeat,
+        "min_ms": round(timings[0], 3),
+        "median_ms": round(statistics.median(timings), 3),
+        "mean_ms": round(statistics.fmean(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+    }
+
+
+def run_benchmarks(names, sizes, repeat):
+    """
+    Run benchmarks, each against a freshly seeded catalogue
+    :returns: benchmark (with size) -> timing statistics
+    :rtype: dict
+    """
+
+    results = {}
+    for name in names:
+        func, sized = BENCHMARKS[name]
+        for size in sizes if sized else [None]:
+            with local_storage(OPTIONS["storage"]):
+                results[f"{name}[{size}]" if sized else name] = measure(func(size) if sized else func(), repeat)
+    return results
+
+
+def threshold_for(name, thresholds):
+    """
+    Regression threshold of a benchmark. Most specific (e.g. xml_body[1000]) first
+    """
+
+    base_name = name.split("[")[0]
+    return thresholds.get(name, thresholds.get(base_name, thresholds.get(None, DEFAULT_THRESHOLD)))
+
+
+def compare(results, baseline, thresholds):
+    """
+    Compare results against a baseline
+    :param results: benchmark -> timing statistics
+    :type results: dict
+    :param baseline: benchmark -> timing statistics
+    :type baseline: dict
+    :param thresholds: benchmark name -> fraction slower allowed. None is the default
+    :type thresholds: dict
+    :returns: comparison of each benchmark in both
+    :rtype: list
+    """
+
+    comparisons = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        change = result["median_ms"] / baseline[name]["median_ms"] - 1 if baseline[name]["median_ms"] else 0.0
+        threshold = threshold_for(name, thresholds)
+        comparisons.append(
+            {
+                "benchmark": name,
+                "baseline_ms": baseline[name]["median_ms"],
+                "median_ms": result["median_ms"],
+                "change": round(change, 3),
+                "threshold": threshold,
+                "regression": change > threshold,
+            }
+        )
+    return comparisons
+
+
+def parse_thresholds(values):
+    """
+    Parse --threshold values: "0.25" (default) or "<benchmark>=0.5"
+    """
+
+    thresholds = {}
+    for value in values:
+        name, _, fraction = value.rpartition("=")
+        thresholds[name or None] = float(fraction)
+    return thresholds
+
+
+def metadata():
+    """
+    Details of the run results are only comparable between
+    """
+
+    try:
+        git_sha = subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        git_sha = None
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_sha": git_sha,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API hot paths against local stand-ins")
+    parser.add_argument("--benchmarks", nargs="+", choices=sorted(BENCHMARKS), default=sorted(BENCHMARKS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10, 100, 1000], help="catalogue sizes")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per benchmark")
+    parser.add_argument("--output", help="write results to this file rather than stdout")
+    parser.add_argument("--baseline", help="results to compare against")
+    parser.add_argument(
+        "--threshold",
+        action="append",
+        default=[],
+        help=f"fraction slower than the baseline allowed (default {DEFAULT_THRESHOLD}). <benchmark>=<fraction> per benchmark",
+    )
+    parser.add_argument("--synthetic", action="store_true", help="seed catalogues with synthetic plugins")
+    parser.add_argument("--storage", choices=sorted(STORAGE), default="aws", help="stand-in the API is run against")
+    args = parser.parse_args()
+
+    OPTIONS["synthetic"] = args.synthetic
+    OPTIONS["storage"] = args.storage
+    # Request logs would swamp the results
+    log.configure(level="warning")
+    report = {"meta": metadata(), "results": run_benchmarks(args.benchmarks, args.sizes, args.repeat)}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+        report["comparison"] = compare(report["results"], baseline, parse_thresholds(args.threshold))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+
+    regressions = [comparison["benchmark"] for comparison in report.get("comparison", []) if comparison["regression"]]
+    if regressions:
+        sys.exit(f"Regressions: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Local stand-ins for the repository's DynamoDB table and S3 bucket.
+
+    If AWS_ENDPOINT_URL is set (e.g. to DynamoDB Local, MinIO or LocalStack)
+    every client is pointed at it. Otherwise AWS is mocked in process
+    with moto (pip install "moto[dynamodb,s3]").
+
+    Alternatively the API is run against the memory or SQLite stores
+    (see src/plugin/storage.py) with no AWS at all.
+
+"""
+
+import os
+from contextlib import contextmanager
+
+from src.plugin import api, aws, idempotency, jobs, storage
+from src.plugin.metadata_model import MetadataModel, TableMeta
+
+TABLE_NAME = "qgis-plugin-repository-local"
+BUCKET_NAME = "qgis-plugin-repository-local"
+REGION = "ap-southeast-2"
+# Stand-in -> store url. "aws" is DynamoDB and S3 (see local_aws)
+STORAGE = {"aws": None, "memory": storage.MEMORY_URL, "sqlite": storage.SQLITE_PREFIX}
+
+# Environment the API expects in Lambda
+LOCAL_ENV = {
+    "AWS_REGION": REGION,
+    "AWS_DEFAULT_REGION": REGION,
+    "AWS_ACCESS_KEY_ID": "local",
+    "AWS_SECRET_ACCESS_KEY": "local",
+    "AWS_LAMBDA_FUNCTION_NAME": "local",
+    "AWS_LAMBDA_FUNCTION_MEMORY_SIZE": "0",
+    "AWS_LAMBDA_FUNCTION_VERSION": "0",
+    "AWS_LAMBDA_LOG_STREAM_NAME": "local",
+}
+
+
+def reset_clients():
+    """
+    Discard clients created before (or for) the stand-ins
+    """
+
+    aws.discard_clients([MetadataModel, idempotency.IdempotencyModel, jobs.JobModel])
+
+
+def create_resources(table_name, bucket_name):
+    """
+    Create the repository table and bucket if they do not exist
+    """
+
+    TableMeta.table_name = table_name
+    TableMeta.region = REGION
+    api.repo_bucket_name = bucket_name
+    api.aws_region = REGION
+    if not MetadataModel.exists():
+        MetadataModel.create_table(billing_mode="PAY_PER_REQUEST", wait=True)
+    s3_client = aws.get_client("s3")
+    try:
+        s3_client.head_bucket(Bucket=bucket_name)
+    except s3_client.exceptions.ClientError:
+        s3_client.create_bucket(Bucket=bucket_name, CreateBucketConfiguration={"LocationConstraint": REGION})
+
+
+@contextmanager
+def local_aws(table_name=TABLE_NAME, bucket_name=BUCKET_NAME):
+    """
+    Run the API against local stand-ins for its table and bucket
+    :param table_name: table name
+    :type table_name: str
+    :param bucket_name: bucket name
+    :type bucket_name: str
+    """
+
+    for key, value in LOCAL_ENV.items():
+        os.environ.setdefault(key, value)
+    reset_clients()
+    try:
+        if os.environ.get("AWS_ENDPOINT_URL"):
+            create_resources(table_name, bucket_name)
+            yield
+            return
+        try:
+            from moto import mock_aws  # pylint: disable=import-outside-toplevel
+        except ImportError as error:
+            raise SystemExit('Set AWS_ENDPOINT_URL or pip install "moto[dynamodb,s3]"') from error
+        with mock_aws():
+            create_resources(table_name, bucket_name)
+            yield
+    finally:
+        reset_clients()
+
+
+@contextmanager
+def local_storage(stand_in="aws"):
+    """
+    Run the API against fresh local stores
+    :param stand_in: "aws" (see local_aws), "memory" or "sqlite"
+    :type stand_in: str
+    """
+
+    if not STORAGE[stand_in]:
+        with local_aws():
+            yield
+        return
+    for key, value in LOCAL_ENV.items():
+        os.environ.setdefault(key, value)
+    store_urls = storage.METADATA_STORE_URL, storage.OBJECT_STORE_URL
+    storage.METADATA_STORE_URL = storage.OBJECT_STORE_URL = STORAGE[stand_in]
+    storage._stores.clear()  # pylint: disable=protected-access
+    api.repo_bucket_name = BUCKET_NAME
+    api.aws_region = REGION
+    try:
+        yield
+    finally:
+        storage.METADATA_STORE_URL, storage.OBJECT_STORE_URL = store_urls
+        storage._stores.clear()  # pylint: disable=protected-access
@@ -0,0 +1,295 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Synthetic plugin repository generator for load and scale testing.
+
+    Generates N plugins with M revisions each for each stage. QGIS version
+    bounds, about text sizes and plugin file sizes follow configurable
+    distributions and generation is reproducible for a given --seed. Plugin
+    files are real zips, validated by plugin_parser and stored content
+    addressed as the API stores them. Records are loaded through
+    the configured metadata store (batched writes to DynamoDB).
+
+    Records are streamed so large repositories (e.g. 10k plugins with 100
+    revisions) do not need to fit in memory. Plugin files are only built
+    for the current version of each plugin unless --all-zips is given.
+
+    Usage (against a local stand-in such as LocalStack):
+        AWS_ENDPOINT_URL=http://localhost:4566 python -m benchmarks.synthetic --plugins 10000 --revisions 100
+
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import random
+import time
+import zipfile
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from benchmarks import catalogue
+from benchmarks.stand_ins import local_aws
+from src.plugin import api, plugin_parser, storage
+from src.plugin.metadata_model import MetadataModel, format_item_version
+
+# (qgisMinimumVersion, weight) of recent QGIS LTR and latest releases
+QGIS_MINIMUM_VERSIONS = (("3.0", 3), ("3.10", 2), ("3.16", 3), ("3.22", 4), ("3.28", 5), ("3.34", 4), ("3.40", 2))
+CATEGORIES = ("Raster", "Vector", "Database", "Web", "Analysis", None)
+WORDS = "map layer raster vector tile export import style symbol query projection survey parcel address".split()
+
+
+@dataclass
+class Distributions:  # pylint: disable=too-many-instance-attributes
+    """
+    Distributions generated plugins follow. Each parameter is a field
+    so it can be overridden on its own (see --distributions)
+    """
+
+    # (qgisMinimumVersion, weight)
+    qgis_minimum_versions: tuple[tuple[str, int], ...] = QGIS_MINIMUM_VERSIONS
+    # Fraction of plugins with a qgisMaximumVersion below the default <major>.99
+    bounded_maximum: float = 0.1
+    # Median and lognormal sigma of the about text (characters)
+    about_median: int = 400
+    about_sigma: float = 1.0
+    # Median and lognormal sigma of the plugin file content (bytes)
+    zip_median: int = 200 * 1024
+    zip_sigma: float = 1.2
+    zip_max: int = 8 * 1024 * 1024
+    # Fraction of plugin file content that is incompressible
+    incompressible: float = 0.5
+    files: int = 8
+    experimental: float = 0.1
+    deprecated: float = 0.02
+    archived: float = 0.03
+    categories: tuple[str | None, ...] = field(default=CATEGORIES)
+
+
+def lognormal(rng, median, sigma, maximum=None):
+    value = int(rng.lognormvariate(0, sigma) * median)
+    return max(1, min(value, maximum) if maximum else value)
+
+
+def text(rng, length):
+    words = []
+    total = 0
+    while total < length:
+        words.append(rng.choice(WORDS))
+        total += len(words[-1]) + 1
+    return " ".join(words)[:length]
+
+
+def plugin_file(rng, plugin_id, metadata, distributions):
+    """
+    Build a plugin file of a size drawn from the distributions
+    :returns: plugin file
+    :rtype: bytes
+    """
+
+    size = lognormal(rng, distributions.zip_median, distributions.zip_sigma, distributions.zip_max)
+    file_size = max(1, size // distributions.files)
+    random_size = int(file_size * distributions.incompressible)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        lines = ["[general]"] + [f"{key}={value}" for key, value in metadata.items() if value is not None]
+        archive.writestr(f"{plugin_id}/metadata.txt", "\n".join(lines) + "\n")
+        for index in range(distributions.files):
+            content = rng.randbytes(random_size) + b"#" * (file_size - random_size)
+            archive.writestr(f"{plugin_id}/module_{index}.py", content)
+    return buffer.getvalue()
+
+
+def plugin_metadata(rng, plugin_id, revision, distributions):
+    """
+    metadata.txt values of a plugin's revision
+    """
+
+    minimum_versions, weights = zip(*distributions.qgis_minimum_versions)
+    minimum = rng.choices(minimum_versions, weights)[0]
+    major, minor = (int(part) for part in minimum.split("."))
+    maximum = f"{major}.99"
+    if rng.random() < distributions.bounded_maximum:
+        maximum = f"{major}.{rng.randint(minor, 98)}"
+    return {
+        "name": plugin_id.replace("_", " ").title(),
+        "qgisMinimumVersion": minimum,
+        "qgisMaximumVersion": maximum,
+        "description": text(rng, 80),
+        "about": text(rng, lognormal(rng, distributions.about_median, distributions.about_sigma, 16000)),
+        "version": f"{revision // 10}.{revision % 10}.0",
+        "author": "Synthetic",
+        "email": "synthetic@linz.govt.nz",
+        "repository": f"https://github.com/linz/{plugin_id}",
+        "tracker": f"https://github.com/linz/{plugin_id}/issues",
+        "homepage": f"https://github.com/linz/{plugin_id}",
+        "tags": ",".join(rng.sample(WORDS, 3)),
+        "category": rng.choice(distributions.categories),
+        "experimental": str(rng.random() < distributions.experimental),
+        "deprecated": str(rng.random() < distributions.deprecated),
+    }
+
+
+class Generator:
+    """
+    Generates the records and plugin files of synthetic plugins
+    """
+
+    def __init__(self, distributions=None, seed=0, bucket=None, all_zips=False):
+        """
+        :param distributions: distributions plugins follow
+        :type distributions: Distributions
+        :param seed: random seed
+        :type seed: int
+        :param bucket: bucket plugin files are stored in. Not stored if None
+        :type bucket: str
+        :param all_zips: build plugin files for every revision rather than only the current
+        :type all_zips: bool
+        """
+
+        self.rng = random.Random(seed)
+        self.distributions = distributions or Distributions()
+        self.bucket = bucket
+        self.all_zips = all_zips
+
+    def store_plugin_file(self, plugin_id, metadata):
+        """
+        Build and store a plugin file as the API does
+        :returns: file name (its SHA-256) and manifest
+        :rtype: tuple
+        """
+
+        data = plugin_file(self.rng, plugin_id, metadata, self.distributions)
+        with zipfile.ZipFile(io.BytesIO(data)) as plugin_zipfile:
+            manifest, _ = plugin_parser.inspect_plugin(plugin_zipfile)
+        file_name = hashlib.sha256(data).hexdigest()
+        if self.bucket:
+            storage.get_object_store(self.bucket).put(data, file_name, plugin_id)
+        return file_name, manifest
+
+    def plugin_records(self, plugin_id, plugin_stage, revisions):
+        """
+        Yield the version zero, token and revision records of a plugin,
+        storing its plugin files
+        """
+
+        created_at = datetime(2019, 1, 1, tzinfo=timezone.utc) + timedelta(days=self.rng.randint(0, 1500))
+        archived = self.rng.random() < self.distributions.archived
+        for revision in range(1, revisions + 1):
+            metadata = plugin_metadata(self.rng, plugin_id, revision, self.distributions)
+            current = revision == revisions
+            updated_at = created_at + timedelta(days=revision * 7)
+            attributes = {
+                "created_at": created_at,
+                "updated_at": updated_at,
+                "file_name": f"{plugin_id}.{metadata['version']}.zip",
+                "file_sha256": None,
+                "manifest": None,
+                "ended_at": updated_at if current and archived else None,
+                **metadata_attributes(metadata),
+            }
+            if current or self.all_zips:
+                attributes["file_name"], attributes["manifest"] = self.store_plugin_file(plugin_id, metadata)
+                attributes["file_sha256"] = attributes["file_name"]
+            yield catalogue.version_zero(
+                plugin_id, plugin_stage, revision, format_item_version(plugin_stage, str(revision)), **attributes
+            )
+            if current:
+                yield catalogue.version_zero(plugin_id, plugin_stage, revision, **attributes)
+        yield catalogue.token_record(plugin_id, plugin_stage)
+
+
+def metadata_attributes(metadata):
+    """
+    Record attributes of metadata.txt values, as stored by the API
+    """
+
+    return {
+        "name": metadata["name"],
+        "qgis_minimum_version": metadata["qgisMinimumVersion"],
+        "qgis_maximum_version": metadata["qgisMaximumVersion"],
+        "description": metadata["description"],
+        "about": metadata["about"],
+        "version": metadata["version"],
+        "author_name": metadata["author"],
+        "email": metadata["email"],
+        "repository": metadata["repository"],
+        "tracker": metadata["tracker"],
+        "homepage": metadata["homepage"],
+        "tags": metadata["tags"],
+        "category": metadata["category"],
+        "experimental": metadata["experimental"],
+        "deprecated": metadata["deprecated"],
+    }
+
+
+def generate(plugins, revisions, stages=("",), generator=None):
+    """
+    Generate and load a synthetic repository
+    :param plugins: plugins per stage
+    :type plugins: int
+    :param revisions: revisions per plugin
+    :type revisions: int
+    :param stages: plugin stages (e.g. "" and dev)
+    :type stages: tuple
+    :param generator: generator of the plugins. Defaults to Generator()
+    :type generator: Generator
+    :returns: plugin ids
+    :rtype: list
+    """
+
+    generator = generator or Generator()
+    plugin_ids = [f"synthetic_{index:06d}" for index in range(plugins)]
+    records = (
+        record
+        for plugin_stage in stages
+        for plugin_id in plugin_ids
+        for record in generator.plugin_records(plugin_id, plugin_stage, revisions)
+    )
+    catalogue.batch_put(records)
+    return plugin_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate and load a synthetic plugin repository")
+    parser.add_argument("--plugins", type=int, default=100, help="plugins per stage")
+    parser.add_argument("--revisions", type=int, default=10, help="revisions per plugin")
+    parser.add_argument("--stages", nargs="+", default=["", "dev"], help='plugin stages. "" is production')
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--all-zips", action="store_true", help="build plugin files for every revision")
+    parser.add_argument("--no-files", action="store_true", help="do not store plugin files")
+    parser.add_argument("--distributions", help="JSON file overriding Distributions fields")
+    args = parser.parse_args()
+
+    if not os.environ.get("AWS_ENDPOINT_URL"):
+        parser.error("Set AWS_ENDPOINT_URL to the local stand-in to load (in process stand-ins do not persist)")
+    overrides: dict[str, Any] = {}
+    if args.distributions:
+        with open(args.distributions, encoding="utf-8") as distributions_file:
+            overrides = json.load(distributions_file)
+    if "qgis_minimum_versions" in overrides:
+        overrides["qgis_minimum_versions"] = tuple(map(tuple, overrides["qgis_minimum_versions"]))
+    distributions = Distributions(**overrides)
+
+    start = time.perf_counter()
+    with local_aws():
+        bucket = None if args.no_files else api.repo_bucket_name
+        generate(args.plugins, args.revisions, tuple(args.stages), Generator(distributions, args.seed, bucket, args.all_zips))
+        records = MetadataModel.count()
+    print(json.dumps({"records": records, "seconds": round(time.perf_counter() - start, 1)}))
+
+
+if __name__ == "__main__":
+    main()
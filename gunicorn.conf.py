@@ -0,0 +1,73 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    gunicorn settings for running the API as a long-running multi-worker
+    server (e.g. on-premises) rather than on Lambda:
+        gunicorn src.plugin.api:app
+
+    The app is loaded once before the workers are forked and a refresher
+    process keeps the catalogue snapshot the workers share up to date
+    (see src/plugin/snapshot.py).
+
+"""
+
+# pylint: disable=invalid-name
+
+
+import os
+import subprocess
+import sys
+import tempfile
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", (os.cpu_count() or 1) * 2))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+preload_app = True
+# Plugin downloads (see api.download) are sent with sendfile
+sendfile = True
+
+# tmpfs where available so the snapshot is only ever in memory
+os.environ.setdefault(
+    "CATALOGUE_SNAPSHOT_PATH",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "qgis-plugins.snapshot"),
+)
+
+
+def when_ready(server):
+    """
+    Start the snapshot refresher once the master is ready
+    """
+
+    server.refresher = subprocess.Popen([sys.executable, "-m", "src.plugin.refresher"])  # pylint: disable=consider-using-with
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """
+    Workers create their own AWS connections rather than sharing any the master created
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from src.plugin import aws, idempotency, jobs
+    from src.plugin.metadata_model import MetadataModel
+
+    aws.discard_clients([MetadataModel, idempotency.IdempotencyModel, jobs.JobModel])
+
+
+def on_exit(server):
+    """
+    Stop the snapshot refresher with the master
+    """
+
+    refresher = getattr(server, "refresher", None)
+    if refresher:
+        refresher.terminate()
+        refresher.wait(10)
@@ -16,17 +16,30 @@
 # pylint: disable=W0703,E0237
 
 
+import functools
+import hashlib
 import os
 import time
-import uuid
 import zipfile
 from io import BytesIO
 from re import match
 
 import ulid
-from flask import Flask, g, jsonify, request
-
-from src.plugin import aws, plugin_parser, plugin_xml, swagger_ui
+from flask import Flask, g, jsonify, request, send_file
+
+from src.plugin import (
+    aws,
+    capacity,
+    idempotency,
+    jobs,
+    plugin_parser,
+    plugin_xml,
+    retention,
+    revision_archive,
+    storage,
+    swagger_ui,
+    timing,
+)
 from src.plugin.error import DataError, add_data_error_handler
 from src.plugin.log import get_log
 from src.plugin.metadata_model import MetadataModel
@@ -35,6 +48,8 @@ app = Flask(__name__)
 
 
 app.config["JSONIFY_PRETTYPRINT_REGULAR"] = True
+# Reject request bodies larger than this before they are read into memory
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("PLUGIN_MAX_UPLOAD_SIZE", 10 * 1024 * 1024))
 add_data_error_handler(app)
 
 AUTH_PREFIX = "bearer "
@@ -49,6 +64,20 @@ aws_stage = os.environ.get("STAGE")
 # AWS region
 aws_region = os.environ.get("AWS_REGION", None)
 
+# Base url of plugin downloads served by the API when plugin files are
+# stored on the filesystem. Defaults to <API root>/v1/download
+download_base_url = os.environ.get("DOWNLOAD_BASE_URL")
+# Plugin files are content addressed so never change once stored
+DOWNLOAD_MAX_AGE = int(os.environ.get("DOWNLOAD_MAX_AGE", 365 * 24 * 60 * 60))
+# Leave sending plugin files to a fronting web server (e.g. nginx with X-Sendfile)
+app.config["USE_X_SENDFILE"] = os.environ.get("DOWNLOAD_X_SENDFILE", "").lower() == "true"
+
+# Diagnostics (see profiler.py, memory.py and sampler.py) are only imported
+# once a request needs them so cold starts do not load cProfile or tracemalloc
+MEMORY_TRACE = os.environ.get("MEMORY_TRACE", "").lower() == "true"
+# Header carrying the profile secret (see profiler.requested)
+PROFILE_HEADER = "X-Profile"
+
 # Git commit SHA
 git_sha = os.environ.get("GIT_SHA", None)
 git_tag = os.environ.get("GIT_TAG", None)
@@ -62,6 +91,48 @@ swaggerui_blueprint = swagger_ui.get_swagger_ui_blueprint(swagger_url, api_url,
 
 app.register_blueprint(swaggerui_blueprint, url_prefix=swagger_url)
 
+# Optionally create AWS clients ("clients") and open their connections
+# ("connect") at cold start rather than in the first request. A failure
+# is left for the first request to report rather than failing to start
+aws_warm_up = os.environ.get("AWS_WARM_UP", "")
+if aws_warm_up:
+    try:
+        aws.warm_up(repo_bucket_name, [MetadataModel], connect=aws_warm_up == "connect")
+    except Exception as warm_up_error:  # pylint: disable=broad-except
+        get_log().error("AwsWarmUpFailed", exception=warm_up_error)
+
+
+@functools.cache
+def lambda_details():
+    """
+    Lambda details logged with each request. These are
+    constant for the life of the container so are read once
+    """
+
+    return {
+        "lambdaName": os.environ["AWS_LAMBDA_FUNCTION_NAME"],
+        "lambdaMemory": os.environ["AWS_LAMBDA_FUNCTION_MEMORY_SIZE"],
+        "lambdaVersion": os.environ["AWS_LAMBDA_FUNCTION_VERSION"],
+        "lambdaLogStreamName": os.environ["AWS_LAMBDA_LOG_STREAM_NAME"],
+        "lambdaRegion": os.environ["AWS_REGION"],
+    }
+
+
+@functools.cache
+def start_sampler():
+    """
+    Start low rate stack sampling if SAMPLER_HZ is set. Called by every
+    request but only the first in a process (e.g. a forked worker) starts it
+    :returns: the sampler
+    :rtype: sampler.StackSampler
+    """
+
+    if not os.environ.get("SAMPLER_HZ"):
+        return None
+    from src.plugin import sampler  # pylint: disable=import-outside-toplevel
+
+    return sampler.start()
+
 
 @app.before_request
 def before_request():
@@ -70,8 +141,21 @@ def before_request():
     """
 
     g.start_time = time.time()
+    g.spans = {}
+    g.consumed_capacity = {"read": 0.0, "write": 0.0}
     g.request_id = str(ulid.new())
-    get_log().info("CorrelationId", correlationId=request.headers.get("x-linz-correlation-id", str(ulid.new())))
+    get_log().info("CorrelationId", correlationId=request.headers.get("x-linz-correlation-id") or str(ulid.new()))
+    start_sampler()
+    # pylint: disable=import-outside-toplevel
+    if MEMORY_TRACE:
+        from src.plugin import memory
+
+        memory.start()
+    if PROFILE_HEADER in request.headers:
+        from src.plugin import profiler
+
+        if profiler.requested(request.headers):
+            profiler.start()
 
 
 @app.after_request
@@ -80,21 +164,36 @@ def after_request(response):
     After request logout API/Lambda metrics
     """
 
+    # pylint: disable=import-outside-toplevel
+    if "profiler" in g:
+        from src.plugin import profiler
+
+        profile_name = profiler.stop()
+        if profile_name:
+            response.headers["X-Profile-Key"] = profile_name
+    usage = None
+    if MEMORY_TRACE:
+        from src.plugin import memory
+
+        usage = memory.stop()
+    duration = (time.time() - g.start_time) * 1000
     get_log().info(
         "RequestMetadata",
         uri=request.path,
         method=request.method,
         status=response.status,
         args=dict(request.args),
-        duration=(time.time() - g.start_time) * 1000,
-        lambdaName=os.environ["AWS_LAMBDA_FUNCTION_NAME"],
-        lambdaMemory=os.environ["AWS_LAMBDA_FUNCTION_MEMORY_SIZE"],
-        lambdaVersion=os.environ["AWS_LAMBDA_FUNCTION_VERSION"],
-        lambdaLogStreamName=os.environ["AWS_LAMBDA_LOG_STREAM_NAME"],
-        lambdaRegion=os.environ["AWS_REGION"],
+        duration=duration,
+        endpoint=request.url_rule.rule if request.url_rule else None,
+        consumedCapacity=capacity.consumed_capacity(),
+        spans=timing.spans(),
+        memory=usage,
+        **lambda_details(),
     )
 
     response.headers["X-Request-ID"] = g.request_id
+    if timing.SERVER_TIMING:
+        response.headers["Server-Timing"] = timing.server_timing(duration)
     return response
 
 
@@ -142,6 +241,77 @@ def validate_stage(plugin_stage):
     return plugin_stage
 
 
+def prefers_async(headers):
+    """
+    Test if the client asked for an asynchronous response (RFC 7240)
+    :param headers: request headers
+    :type headers: werkzeug.datastructures.Headers
+    :returns: True if "Prefer: respond-async" was sent
+    :rtype: bool
+    """
+
+    return any(
+        preference.strip().lower() == "respond-async" for value in headers.getlist("Prefer") for preference in value.split(",")
+    )
+
+
+def replay_idempotent_request(plugin_id, plugin_stage, data=b""):
+    """
+    If the request carries an Idempotency-Key that has already been
+    used, return the stored response of the original request. Otherwise
+    the key is claimed for this request
+    :param plugin_id: plugin_id
+    :type plugin_id: string
+    :param plugin_stage: the plugin's stage (e.g. dev)
+    :type plugin_stage: string
+    :param data: request body
+    :type data: bytes
+    :returns: stored response or None
+    :rtype: flask.wrappers.Response
+    """
+
+    key = idempotency.idempotency_key(request.headers)
+    if not key:
+        return None
+    req_hash = idempotency.request_hash(request.method, request.path, plugin_stage, data)
+    record = idempotency.stored_response(key, plugin_id, plugin_stage, req_hash)
+    if not record:
+        g.idempotency, record = idempotency.claim(key, plugin_id, plugin_stage, req_hash)
+    if not record:
+        return None
+    response = app.response_class(response=record.body, status=record.status, mimetype="application/json")
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def record_idempotent_response(response):
+    """
+    Store the response against the Idempotency-Key the request claimed, if any
+    :param response: response as returned by format_response
+    :type response: tuple (flask.wrappers.Response, int)
+    :returns: the response
+    :rtype: tuple (flask.wrappers.Response, int)
+    """
+
+    claim = g.pop("idempotency", None)
+    if claim:
+        body, status = response
+        idempotency.store_response(claim, body.get_data(as_text=True), status)
+    return response
+
+
+@app.teardown_request
+def release_idempotency_key(error=None):  # pylint: disable=unused-argument
+    """
+    Release the Idempotency-Key claimed by a request that failed
+    before its response was stored, so the request can be retried
+    """
+
+    claim = g.pop("idempotency", None)
+    if claim:
+        idempotency.release(claim)
+
+
 @app.route(f"/{API_VERSION}/plugin/<plugin_id>", methods=["POST"])
 def upload(plugin_id):
     """
@@ -165,37 +335,106 @@ def upload(plugin_id):
 
     # Get users access token from header
     token = get_access_token(request.headers)
-    MetadataModel.validate_token(token, plugin_id, plugin_stage)
+    metadata_store = storage.get_metadata_store()
+    metadata_store.validate_token(token, plugin_id, plugin_stage)
+
+    # A retried request is answered with the original outcome
+    replay = replay_idempotent_request(plugin_id, plugin_stage, post_data)
+    if replay:
+        return replay
 
     # Test the file is a zipfile
-    if not zipfile.is_zipfile(BytesIO(post_data)):
+    try:
+        plugin_zipfile = zipfile.ZipFile(BytesIO(post_data), "r", zipfile.ZIP_DEFLATED, False)
+    except zipfile.BadZipFile as error:
         get_log().error("NotZipfile")
-        raise DataError(400, "Plugin file supplied not a Zipfile")
+        raise DataError(400, "Plugin file supplied not a Zipfile") from error
 
-    # Extract plugin metadata
-    with zipfile.ZipFile(BytesIO(post_data), "r", zipfile.ZIP_DEFLATED, False) as plugin_zipfile:
-        metadata_path = plugin_parser.metadata_path(plugin_zipfile)
-        metadata = plugin_parser.metadata_contents(plugin_zipfile, metadata_path)
+    # Extract plugin metadata and manifest
+    with plugin_zipfile:
+        manifest, metadata = plugin_parser.inspect_plugin(plugin_zipfile)
 
-        # Get the plugins root dir. This is what QGIS references when handling plugins
-        g.plugin_id = plugin_parser.zipfile_root_dir(plugin_zipfile)
+    # Get the plugins root dir. This is what QGIS references when handling plugins
+    g.plugin_id = manifest["root_dir"]
     if g.plugin_id != plugin_id:
         raise DataError(400, f"Invalid plugin name {g.plugin_id}")
 
-    # Allocate a filename
-    filename = str(uuid.uuid4())
+    # Allocate a filename. Plugins are content addressed so that
+    # identical archives (e.g. retries, dev then prd) share one object
+    checksum = hashlib.sha256(post_data).hexdigest()
+    filename = checksum
     get_log().info("FileName", filename=filename)
 
-    # Upload the plugin to s3
-    aws.s3_put(post_data, repo_bucket_name, filename, g.plugin_id)
-    get_log().info("UploadedTos3", filename=filename, bucketName=repo_bucket_name)
+    # Upload the plugin to s3 if its content is not already stored. A stored
+    # file is touched so the cleanup does not delete it before the record is written
+    object_store = storage.get_object_store(repo_bucket_name)
+    if object_store.touch(filename, g.plugin_id):
+        get_log().info("DuplicateUploadSkipped", filename=filename, bucketName=repo_bucket_name)
+    else:
+        object_store.put(post_data, filename, g.plugin_id)
+        get_log().info("UploadedTos3", filename=filename, bucketName=repo_bucket_name)
 
     # Update metadata database
     try:
-        plugin_metadata = MetadataModel.new_plugin_version(metadata, g.plugin_id, filename, plugin_stage)
+        plugin_metadata = metadata_store.new_plugin_version(
+            metadata, g.plugin_id, filename, plugin_stage, {"file_sha256": checksum, "manifest": manifest}
+        )
     except ValueError as error:
         raise DataError(400, str(error)) from error
-    return format_response(plugin_metadata, 201)
+    expire_revision(metadata_store, plugin_metadata)
+
+    # Queue derived work to be processed outside of the request
+    job = queue_upload_verification(plugin_stage, filename)
+    if not job or not prefers_async(request.headers):
+        return record_idempotent_response(format_response(plugin_metadata, 201))
+    return record_idempotent_response(format_accepted_response(job, plugin_metadata))
+
+
+def format_accepted_response(job, plugin_metadata):
+    """
+    Format the 202 response of an upload whose job is processed asynchronously
+    :param job: job status as returned by jobs.enqueue
+    :type job: dict
+    :param plugin_metadata: version zero of the uploaded plugin
+    :type plugin_metadata: dict
+    :returns: API response, with the job's status resource as its Location
+    :rtype: tuple (flask.wrappers.Response, int)
+    """
+
+    status_url = f"/{API_VERSION}/job/{job['id']}"
+    response = format_response({"job": job, "status_url": status_url, "plugin": plugin_metadata}, 202)
+    response[0].headers["Location"] = status_url
+    return response
+
+
+def queue_upload_verification(plugin_stage, filename):
+    """
+    Queue a check of the CRC of every entry of an uploaded plugin file, if a
+    job queue is configured. Failures are logged, not raised, as the upload
+    has been stored and a retried request would revise the plugin again
+    :param plugin_stage: the plugin's stage (e.g. dev)
+    :type plugin_stage: string
+    :param filename: stored plugin file name
+    :type filename: string
+    :returns: job status or None if not queued
+    :rtype: dict
+    """
+
+    queue = jobs.get_queue()
+    if not queue:
+        return None
+    try:
+        return jobs.enqueue(
+            queue,
+            "verify_upload",
+            g.plugin_id,
+            plugin_stage,
+            bucket=repo_bucket_name,
+            file_name=filename,
+        )
+    except Exception as error:  # pylint: disable=broad-except
+        get_log().error("JobQueueFailed", jobType="verify_upload", exception=error)
+        return None
 
 
 @app.route(f"/{API_VERSION}/plugin", methods=["GET"])
@@ -207,7 +446,7 @@ def get_all_plugins():
     """
 
     plugin_stage = request.args.get("stage", DEFUALT_STAGE)
-    response = list(MetadataModel.all_version_zeros(plugin_stage))
+    response = list(storage.get_metadata_store().all_version_zeros(plugin_stage))
     return format_response(response, 200)
 
 
@@ -224,7 +463,7 @@ def get_plugin(plugin_id):
 
     plugin_stage = request.args.get("stage", DEFUALT_STAGE)
     g.plugin_id = plugin_id
-    return format_response(MetadataModel.plugin_version_zero(plugin_id, plugin_stage), 200)
+    return format_response(storage.get_metadata_store().plugin_version_zero(plugin_id, plugin_stage), 200)
 
 
 @app.route(f"/{API_VERSION}/plugin/<plugin_id>/revision", methods=["GET"])
@@ -239,7 +478,13 @@ def get_all_revisions(plugin_id):
 
     plugin_stage = request.args.get("stage", DEFUALT_STAGE)
     g.plugin_id = plugin_id
-    return format_response(MetadataModel.plugin_all_versions(plugin_id, plugin_stage), 200)
+    versions = revision_archive.plugin_all_versions(
+        storage.get_metadata_store(),
+        storage.get_object_store(revision_archive.REVISION_ARCHIVE_BUCKET),
+        plugin_id,
+        plugin_stage,
+    )
+    return format_response(retention.retained(versions, plugin_stage), 200)
 
 
 @app.route(f"/{API_VERSION}/plugin/<plugin_id>", methods=["DELETE"])
@@ -259,10 +504,52 @@ def archive(plugin_id):
     # Get users access token from header
     token = get_access_token(request.headers)
     # validate access token
-    MetadataModel.validate_token(token, g.plugin_id, plugin_stage)
+    metadata_store = storage.get_metadata_store()
+    metadata_store.validate_token(token, g.plugin_id, plugin_stage)
+    # A retried request is answered with the original outcome
+    replay = replay_idempotent_request(plugin_id, plugin_stage)
+    if replay:
+        return replay
     # Archive plugins
-    response = MetadataModel.archive_plugin(plugin_id, plugin_stage)
-    return format_response(response, 200)
+    response = metadata_store.archive_plugin(plugin_id, plugin_stage)
+    expire_revision(metadata_store, response)
+    return record_idempotent_response(format_response(response, 200))
+
+
+def expire_revision(metadata_store, version_zero):
+    """
+    Apply the retention policy to the revision a write has pushed out of
+    the plugin's latest revisions. Failures are logged, not raised, as the
+    write has been made. The cleanup sets the expiry of revisions missed
+    :param metadata_store: metadata store
+    :type metadata_store: storage.DynamoDBStore | storage.MemoryStore | storage.SqliteStore
+    :param version_zero: version zero as updated by the write
+    :type version_zero: dict
+    """
+
+    try:
+        retention.expire_revision(metadata_store, version_zero)
+    except Exception as error:  # pylint: disable=broad-except
+        get_log().error("RevisionExpiryFailed", exception=error)
+
+
+@app.route(f"/{API_VERSION}/job/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """
+    Takes a job_id as returned when a plugin is uploaded
+    and returns the status of the job
+    :param job_id: job_id
+    :type data: string
+    :returns: tuple (http response, http code)
+    :rtype: tuple (flask.wrappers.Response, int)
+    """
+
+    queue = jobs.get_queue()
+    job = queue.get_status(job_id) if queue else None
+    if not job:
+        get_log().error("JobNotFound")
+        raise DataError(404, "Job Not Found")
+    return format_response(job, 200)
 
 
 def validate_qgis_version(qgis_version):
@@ -291,10 +578,56 @@ def qgis_plugin_xml(stage):
 
     validate_qgis_version(qgis_version)
 
-    xml = plugin_xml.generate_xml_body(repo_bucket_name, aws_region, qgis_version, plugin_stage)
+    xml = plugin_xml.generate_xml_body(repo_bucket_name, aws_region, qgis_version, plugin_stage, api_download_url())
     return app.response_class(response=xml, status=200, mimetype="text/xml")
 
 
+def api_download_url():
+    """
+    Base url of plugin downloads if plugin files are served by the API
+    :returns: base url or None if plugin files are downloaded from s3
+    :rtype: string
+    """
+
+    if not isinstance(storage.get_object_store(repo_bucket_name), storage.FilesystemObjectStore):
+        return None
+    return download_base_url or f"{request.url_root}{API_VERSION}/download"
+
+
+@app.route(f"/{API_VERSION}/download/<file_name>", methods=["GET"])
+def download(file_name):
+    """
+    Download a plugin file stored on the filesystem, as an attachment
+    named after its plugin where it was uploaded with one. Files are sent
+    with sendfile where the server supports it (e.g. gunicorn) and
+    Range, If-None-Match and If-Modified-Since requests are answered
+    :param file_name: plugin file name as in the download_url of plugins.xml
+    :type file_name: string
+    :returns: plugin file
+    :rtype: flask.wrappers.Response
+    """
+
+    object_store = storage.get_object_store(repo_bucket_name)
+    path = object_store.path(file_name) if isinstance(object_store, storage.FilesystemObjectStore) else None
+    if not path:
+        get_log().error("PluginFileNotFound", fileName=file_name)
+        raise DataError(404, "Plugin File Not Found")
+    # Plugin files are stored with their plugin id as content disposition (see upload)
+    plugin_id = object_store.content_disposition(file_name)
+    # Plugin files are named by their SHA-256 so the name is a strong ETag
+    response = send_file(
+        path,
+        mimetype="application/zip",
+        as_attachment=plugin_id is not None,
+        download_name=f"{plugin_id}.zip" if plugin_id else None,
+        etag=file_name,
+        conditional=True,
+        max_age=DOWNLOAD_MAX_AGE,
+    )
+    response.cache_control.immutable = True
+    return response
+
+
 @app.route(f"/{API_VERSION}/version", methods=["GET"])
 def version():
     """
@@ -323,11 +656,11 @@ def health():
     checks = {}
 
     # check database connection
-    MetadataModel.all_version_zeros(DEFUALT_STAGE)
+    storage.get_metadata_store().all_version_zeros(DEFUALT_STAGE)
     checks["db"] = {"status": "ok"}
 
     # check s3 connection
-    aws.s3_head_bucket(repo_bucket_name)
+    storage.get_object_store(repo_bucket_name).check()
     checks["s3"] = {"status": "ok"}
 
     # Anything not a 200 has been caught as an
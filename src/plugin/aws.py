@@ -15,9 +15,104 @@
 """
 
 
-import boto3
+import os
+import threading
+from typing import Any
 
+from botocore.config import Config
+from botocore.exceptions import ClientError
 
+from . import timing
+
+# Error codes S3 returns from HeadObject when the key does not exist
+S3_NOT_FOUND_CODES = ("404", "NoSuchKey", "NotFound")
+
+# Settings shared by every AWS client, including PynamoDB's DynamoDB connection
+CLIENT_SETTINGS: dict[str, Any] = {
+    "max_pool_connections": int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", 10)),
+    "connect_timeout": float(os.environ.get("AWS_CONNECT_TIMEOUT", 2)),
+    "read_timeout": float(os.environ.get("AWS_READ_TIMEOUT", 10)),
+    "retry_mode": os.environ.get("AWS_RETRY_MODE", "standard"),
+    "max_attempts": int(os.environ.get("AWS_MAX_ATTEMPTS", 3)),
+}
+
+# Sessions and clients are created once per container and reused by every request
+_session: Any = None
+_clients: dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def get_client(service):
+    """
+    Return the shared client for an AWS service, creating it on first use
+    :param service: AWS service name (e.g. s3)
+    :type service: str
+    :returns: boto3 client
+    :rtype: botocore.client.BaseClient
+    """
+
+    client = _clients.get(service)
+    if client:
+        return client
+    global _session  # pylint: disable=global-statement
+    with _lock:
+        if service not in _clients:
+            if not _session:
+                # boto3 (and s3transfer) is only imported once a client is needed
+                import boto3  # pylint: disable=import-outside-toplevel
+
+                _session = boto3.session.Session()
+            config = Config(
+                max_pool_connections=CLIENT_SETTINGS["max_pool_connections"],
+                connect_timeout=CLIENT_SETTINGS["connect_timeout"],
+                read_timeout=CLIENT_SETTINGS["read_timeout"],
+                retries={"mode": CLIENT_SETTINGS["retry_mode"], "total_max_attempts": CLIENT_SETTINGS["max_attempts"]},
+            )
+            _clients[service] = _session.client(service, config=config)
+    return _clients[service]
+
+
+def warm_up(bucket=None, models=(), connect=False):
+    """
+    Create the shared clients ahead of the first request (e.g. at cold start)
+    so credential and endpoint resolution is not paid for by a request.
+    :param bucket: bucket name. If connect, a connection to S3 is opened
+    :type bucket: str
+    :param models: PynamoDB models whose connections to create
+    :type models: list
+    :param connect: Also open pooled connections with cheap requests
+    :type connect: bool
+    """
+
+    s3_client = get_client("s3")
+    for model in models:
+        connection = model._get_connection()  # pylint: disable=protected-access
+        if connect:
+            connection.describe_table()
+        else:
+            connection.connection.client  # pylint: disable=pointless-statement
+    if connect and bucket:
+        s3_client.head_bucket(Bucket=bucket)
+
+
+def discard_clients(models=()):
+    """
+    Discard the shared clients, and the connections of PynamoDB models, so
+    they are created again on next use. For processes forked after clients
+    were created (e.g. gunicorn workers) as connections must not be shared
+    :param models: PynamoDB models whose connections to discard
+    :type models: list
+    """
+
+    global _session  # pylint: disable=global-statement
+    with _lock:
+        _clients.clear()
+        _session = None
+    for model in models:
+        model._connection = None  # pylint: disable=protected-access
+
+
+@timing.timed("s3.put")
 def s3_put(data, bucket, object_name, content_disposition=None):
     """
     Upload plugin file to S3 plugin repository bucket
@@ -28,10 +123,205 @@ def s3_put(data, bucket, object_name, content_disposition=None):
     :type bucket: str
     """
 
-    s3_client = boto3.client("s3")
-    s3_client.put_object(Body=data, Bucket=bucket, Key=object_name, ContentDisposition=content_disposition)
+    s3_client = get_client("s3")
+    # botocore rejects a None ContentDisposition so it is only sent when given
+    extra_args = {"ContentDisposition": content_disposition} if content_disposition else {}
+    s3_client.put_object(Body=data, Bucket=bucket, Key=object_name, **extra_args)
+
+
+@timing.timed("s3.head")
+def s3_object_exists(bucket, object_name):
+    """
+    Test if an object is already stored in the bucket
+    :param bucket: bucket name
+    :type bucket: str
+    :param object_name: object key
+    :type object_name: str
+    :returns: True if the object exists
+    :rtype: bool
+    """
+
+    s3_client = get_client("s3")
+    try:
+        s3_client.head_object(Bucket=bucket, Key=object_name)
+    except ClientError as error:
+        if error.response.get("Error", {}).get("Code") in S3_NOT_FOUND_CODES:
+            return False
+        raise
+    return True
+
+
+@timing.timed("s3.copy")
+def s3_touch(bucket, object_name, content_disposition=None):
+    """
+    Refresh an object's last modified time by copying it onto itself
+    :param bucket: bucket name
+    :type bucket: str
+    :param object_name: object key
+    :type object_name: str
+    :param content_disposition: content disposition, replacing the object's.
+        The object's own is kept if not given
+    :type content_disposition: str
+    :returns: True if touched, False if there is no object to touch
+    :rtype: bool
+    """
+
+    s3_client = get_client("s3")
+    try:
+        if not content_disposition:
+            # Copying replaces all of the object's metadata so its content disposition is copied explicitly
+            content_disposition = s3_client.head_object(Bucket=bucket, Key=object_name).get("ContentDisposition")
+        extra_args = {"ContentDisposition": content_disposition} if content_disposition else {}
+        # An object can only be copied onto itself if its metadata is replaced
+        s3_client.copy_object(
+            Bucket=bucket,
+            Key=object_name,
+            CopySource={"Bucket": bucket, "Key": object_name},
+            MetadataDirective="REPLACE",
+            **extra_args,
+        )
+    except ClientError as error:
+        if error.response.get("Error", {}).get("Code") in S3_NOT_FOUND_CODES:
+            return False
+        raise
+    return True
+
+
+@timing.timed("s3.get")
+def s3_get(bucket, object_name):
+    """
+    Get an object from the S3 plugin repository bucket
+    :param bucket: bucket name
+    :type bucket: str
+    :param object_name: object key
+    :type object_name: str
+    :returns: Object data
+    :rtype: binary
+    """
+
+    s3_client = get_client("s3")
+    return s3_client.get_object(Bucket=bucket, Key=object_name)["Body"].read()
+
+
+@timing.timed("s3.get")
+def s3_get_with_etag(bucket, object_name):
+    """
+    Get an object and its ETag, for a conditional put of its replacement (see s3_put_if)
+    :param bucket: bucket name
+    :type bucket: str
+    :param object_name: object key
+    :type object_name: str
+    :returns: (data, ETag)
+    :rtype: tuple
+    """
+
+    s3_client = get_client("s3")
+    response = s3_client.get_object(Bucket=bucket, Key=object_name)
+    return response["Body"].read(), response["ETag"]
+
+
+@timing.timed("s3.put")
+def s3_put_if(data, bucket, object_name, etag=None):
+    """
+    Put an object only if it is unchanged since it was read. S3 rejects
+    the put with a PreconditionFailed (or ConditionalRequestConflict) error otherwise
+    :param data: Object data
+    :type data: binary
+    :param bucket: bucket name
+    :type bucket: str
+    :param object_name: object key
+    :type object_name: str
+    :param etag: ETag of the object as read. None if there was no object
+    :type etag: str
+    """
+
+    s3_client = get_client("s3")
+    condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+    s3_client.put_object(Body=data, Bucket=bucket, Key=object_name, **condition)
+
+
+@timing.timed("s3.list")
+def s3_list(bucket, prefix=""):
+    """
+    List the objects in an S3 bucket
+    :param bucket: bucket name
+    :type bucket: str
+    :param prefix: only objects whose key starts with prefix
+    :type prefix: str
+    :returns: (object key, last modified epoch seconds) of each object
+    :rtype: list
+    """
+
+    s3_client = get_client("s3")
+    return [
+        (item["Key"], item["LastModified"].timestamp())
+        for page in s3_client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix)
+        for item in page.get("Contents", [])
+    ]
+
+
+@timing.timed("s3.delete")
+def s3_delete(bucket, object_name):
+    """
+    Delete an object from an S3 bucket
+    :param bucket: bucket name
+    :type bucket: str
+    :param object_name: object key
+    :type object_name: str
+    """
+
+    s3_client = get_client("s3")
+    s3_client.delete_object(Bucket=bucket, Key=object_name)
+
+
+@timing.timed("sqs.send")
+def sqs_send(queue_url, body):
+    """
+    Send a message to an SQS queue
+    :param queue_url: queue url
+    :type queue_url: str
+    :param body: message body
+    :type body: str
+    :returns: message id
+    :rtype: str
+    """
+
+    sqs_client = get_client("sqs")
+    return sqs_client.send_message(QueueUrl=queue_url, MessageBody=body)["MessageId"]
+
+
+def sqs_receive(queue_url, max_messages=1, wait_time=0):
+    """
+    Receive messages from an SQS queue
+    :param queue_url: queue url
+    :type queue_url: str
+    :param max_messages: maximum number of messages to return (1-10)
+    :type max_messages: int
+    :param wait_time: seconds to long poll for
+    :type wait_time: int
+    :returns: messages with MessageId, ReceiptHandle and Body keys
+    :rtype: list
+    """
+
+    sqs_client = get_client("sqs")
+    response = sqs_client.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=max_messages, WaitTimeSeconds=wait_time)
+    return response.get("Messages", [])
+
+
+def sqs_delete(queue_url, receipt_handle):
+    """
+    Delete a processed message from an SQS queue
+    :param queue_url: queue url
+    :type queue_url: str
+    :param receipt_handle: receipt handle of the received message
+    :type receipt_handle: str
+    """
+
+    sqs_client = get_client("sqs")
+    sqs_client.delete_message(QueueUrl=queue_url, ReceiptHandle=receipt_handle)
 
 
+@timing.timed("s3.head_bucket")
 def s3_head_bucket(bucket):
     """
     For healthcheck
@@ -39,5 +329,5 @@ def s3_head_bucket(bucket):
     :type bucket: str
     """
 
-    s3_client = boto3.resource("s3")
-    s3_client.meta.client.head_bucket(Bucket=bucket)
+    s3_client = get_client("s3")
+    s3_client.head_bucket(Bucket=bucket)
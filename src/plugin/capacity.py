@@ -0,0 +1,98 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    DynamoDB consumed capacity accounting per request.
+
+    PynamoDB requests ReturnConsumedCapacity=TOTAL for every item operation
+    but does not expose the result. A botocore after-call hook, registered on
+    each PynamoDB connection's client as it is first used, reads the consumed
+    capacity units from every response and accumulates them in flask.g as
+    read or write request units. They are logged with the request's RequestMetadata.
+
+"""
+
+import weakref
+from typing import Any
+
+from flask import g, has_app_context
+from pynamodb.signals import pre_dynamodb_send
+
+READ_OPERATIONS = ("BatchGetItem", "GetItem", "Query", "Scan", "TransactGetItems")
+WRITE_OPERATIONS = ("BatchWriteItem", "DeleteItem", "PutItem", "TransactWriteItems", "UpdateItem")
+
+# Clients the after-call hook has been registered on
+_clients: weakref.WeakSet[Any] = weakref.WeakSet()
+
+
+def capacity_units(response_capacity):
+    """
+    Total capacity units of a response's ConsumedCapacity
+    :param response_capacity: ConsumedCapacity of a response. A list for batch and transaction operations
+    :type response_capacity: dict | list
+    :returns: capacity units
+    :rtype: float
+    """
+
+    if isinstance(response_capacity, dict):
+        response_capacity = [response_capacity]
+    return sum(capacity.get("CapacityUnits", 0) for capacity in response_capacity)
+
+
+def record(operation_name, units):
+    """
+    Add consumed capacity units to the request's totals. Outside a request they are discarded
+    :param operation_name: DynamoDB operation (e.g. Query)
+    :type operation_name: str
+    :param units: capacity units consumed
+    :type units: float
+    """
+
+    if not has_app_context():
+        return
+    if "consumed_capacity" not in g:
+        g.consumed_capacity = {"read": 0.0, "write": 0.0}
+    if operation_name in READ_OPERATIONS:
+        g.consumed_capacity["read"] += units
+    elif operation_name in WRITE_OPERATIONS:
+        g.consumed_capacity["write"] += units
+
+
+def consumed_capacity():
+    """
+    The request's consumed capacity
+    :returns: read and write request units
+    :rtype: dict
+    """
+
+    if not has_app_context() or "consumed_capacity" not in g:
+        return {"read": 0.0, "write": 0.0}
+    return dict(g.consumed_capacity)
+
+
+# pylint: disable=unused-argument
+def after_call(parsed, model, **kwargs):
+    if parsed and "ConsumedCapacity" in parsed:
+        record(model.name, capacity_units(parsed["ConsumedCapacity"]))
+
+
+def register(sender, **kwargs):
+    """
+    Register the after-call hook on a PynamoDB connection's client
+    """
+
+    client = sender.client
+    if client not in _clients:
+        client.meta.events.register("after-call.dynamodb", after_call, unique_id="plugin-consumed-capacity")
+        _clients.add(client)
+
+
+pre_dynamodb_send.connect(register)
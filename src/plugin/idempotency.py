@@ -0,0 +1,231 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Idempotency-Key support for requests that modify plugins.
+    The outcome of a request is stored against the client supplied key
+    so that a retry is answered from the stored outcome rather than
+    uploading and revising the plugin again.
+
+    The key is claimed, with an in progress record, before the request
+    is processed so a concurrent duplicate is refused rather than
+    processed twice. The claim expires after IDEMPOTENCY_CLAIM_SECONDS
+    should the request holding it never complete.
+
+"""
+
+# pylint: disable=too-few-public-methods
+
+
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone
+
+from pynamodb.attributes import NumberAttribute, TTLAttribute, UnicodeAttribute
+from pynamodb.exceptions import DeleteError, PutError
+from pynamodb.models import Model
+
+from .error import DataError
+from .log import get_log
+from .metadata_model import TableMeta
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_TTL = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", 24 * 60 * 60))
+IDEMPOTENCY_CLAIM_SECONDS = int(os.environ.get("IDEMPOTENCY_CLAIM_SECONDS", 60))
+# Status of a claimed key whose request is still being processed
+IN_PROGRESS = 0
+MAX_KEY_LENGTH = 255
+RECORD_PREFIX = "idempotency"
+
+
+class IdempotencyModel(Model):
+    """
+    Stored outcome of an idempotent request. Kept in the metadata
+    table under its own partition and expired via DynamoDB TTL
+    """
+
+    class Meta(TableMeta):
+        """
+        db metadata
+        """
+
+    id = UnicodeAttribute(hash_key=True, null=False)
+    item_version = UnicodeAttribute(range_key=True, null=False)
+    request_hash = UnicodeAttribute(null=False)
+    status = NumberAttribute(null=False)
+    body = UnicodeAttribute(null=False)
+    expires_at = TTLAttribute(null=False)
+
+
+def record_keys(key, plugin_id, plugin_stage):
+    """
+    Database keys for an idempotency record
+    :param key: client supplied Idempotency-Key
+    :type key: str
+    :param plugin_id: plugin Id
+    :type plugin_id: str
+    :param plugin_stage: the plugin's stage (e.g. dev)
+    :type plugin_stage: str
+    :returns: (hash key, range key)
+    :rtype: tuple
+    """
+
+    return f"{RECORD_PREFIX}#{plugin_id}", f"{key}#{plugin_stage}"
+
+
+def idempotency_key(headers):
+    """
+    Parse the Idempotency-Key header
+    :param headers: request headers
+    :type headers: werkzeug.datastructures.Headers
+    :returns: the key or None if not supplied
+    :rtype: str
+    """
+
+    key = headers.get(IDEMPOTENCY_HEADER, None)
+    if key is None:
+        return None
+    if not key or len(key) > MAX_KEY_LENGTH:
+        get_log().error("InvalidIdempotencyKey")
+        raise DataError(400, "Invalid Idempotency-Key")
+    return key
+
+
+def request_hash(method, path, plugin_stage, data):
+    """
+    Fingerprint a request so a reused key can be matched to its original request
+    :param method: http method
+    :type method: str
+    :param path: request path
+    :type path: str
+    :param plugin_stage: the plugin's stage (e.g. dev)
+    :type plugin_stage: str
+    :param data: request body
+    :type data: bytes
+    :returns: SHA-256 hex digest
+    :rtype: str
+    """
+
+    digest = hashlib.sha256()
+    for part in (method, path, plugin_stage):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def stored_response(key, plugin_id, plugin_stage, req_hash):
+    """
+    Return the stored outcome of a previous request made with the key
+    :param key: client supplied Idempotency-Key
+    :type key: str
+    :param plugin_id: plugin Id
+    :type plugin_id: str
+    :param plugin_stage: the plugin's stage (e.g. dev)
+    :type plugin_stage: str
+    :param req_hash: fingerprint of the current request
+    :type req_hash: str
+    :returns: the stored record or None if the key has not been used
+    :rtype: IdempotencyModel
+    """
+
+    try:
+        hash_key, range_key = record_keys(key, plugin_id, plugin_stage)
+        record = IdempotencyModel.get(hash_key, range_key, consistent_read=True)
+    except IdempotencyModel.DoesNotExist:
+        return None
+    # DynamoDB TTL deletes lazily so expiry is also checked here
+    if record.expires_at <= datetime.now(timezone.utc):
+        return None
+    if record.request_hash != req_hash:
+        get_log().error("IdempotencyKeyReused")
+        raise DataError(422, "Idempotency-Key has already been used for a different request")
+    if record.status == IN_PROGRESS:
+        get_log().error("IdempotentRequestInProgress")
+        raise DataError(409, "A request with this Idempotency-Key is in progress")
+    get_log().info("IdempotentReplay", status=record.status)
+    return record
+
+
+def claim(key, plugin_id, plugin_stage, req_hash):
+    """
+    Claim an unused key for the current request. If the key is
+    claimed concurrently the stored outcome of that request is
+    returned, or the request refused while it is in progress
+    :param key: client supplied Idempotency-Key
+    :type key: str
+    :param plugin_id: plugin Id
+    :type plugin_id: str
+    :param plugin_stage: the plugin's stage (e.g. dev)
+    :type plugin_stage: str
+    :param req_hash: fingerprint of the current request
+    :type req_hash: str
+    :returns: (claim, None) once claimed or (None, stored record) if already completed
+    :rtype: tuple
+    """
+
+    hash_key, range_key = record_keys(key, plugin_id, plugin_stage)
+    record = IdempotencyModel(
+        hash_key,
+        range_key,
+        request_hash=req_hash,
+        status=IN_PROGRESS,
+        body="",
+        expires_at=timedelta(seconds=IDEMPOTENCY_CLAIM_SECONDS),
+    )
+    try:
+        record.save(
+            condition=(IdempotencyModel.id.does_not_exist() | (IdempotencyModel.expires_at < datetime.now(timezone.utc)))
+        )
+    except PutError as error:
+        stored = stored_response(key, plugin_id, plugin_stage, req_hash)
+        if stored is None:
+            # The other request's record expired between the writes
+            get_log().error("IdempotentRequestInProgress")
+            raise DataError(409, "A request with this Idempotency-Key is in progress") from error
+        return None, stored
+    return record, None
+
+
+def store_response(record, body, status):
+    """
+    Store the outcome of a request against the key it claimed
+    :param record: the claim as returned by claim
+    :type record: IdempotencyModel
+    :param body: json response body
+    :type body: str
+    :param status: http response code
+    :type status: int
+    """
+
+    record.status = status
+    record.body = body
+    record.expires_at = timedelta(seconds=IDEMPOTENCY_TTL)
+    try:
+        # Only while still claimed, i.e. the claim has not expired and been taken by a retry
+        record.save(
+            condition=(IdempotencyModel.status == IN_PROGRESS) & (IdempotencyModel.request_hash == record.request_hash)
+        )
+    except PutError:
+        get_log().info("IdempotencyRecordExists")
+
+
+def release(record):
+    """
+    Release the claim of a request that failed so the key can be retried
+    :param record: the claim as returned by claim
+    :type record: IdempotencyModel
+    """
+
+    try:
+        record.delete(condition=IdempotencyModel.status == IN_PROGRESS)
+    except DeleteError as error:
+        get_log().error("IdempotencyReleaseFailed", exception=error)
@@ -0,0 +1,322 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Queue of work derived from API requests (e.g. post upload processing)
+    that is run by the worker (see worker.py) outside of the request.
+
+    The queue is configured via the JOB_QUEUE_URL environment variable:
+        * unset - no derived work is queued
+        * sqlite:///<path> - local SQLite queue. Use sqlite:// for in memory
+        * https://sqs.<region>.amazonaws.com/... - SQS queue
+
+"""
+
+# pylint: disable=too-few-public-methods
+
+
+import json
+import os
+import threading
+import time
+import uuid
+import zipfile
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+from typing import Any, Callable
+
+from pynamodb.attributes import TTLAttribute, UnicodeAttribute, UTCDateTimeAttribute
+from pynamodb.models import Model
+
+from . import aws, plugin_parser, storage
+from .log import get_log
+from .metadata_model import TableMeta
+
+JOB_QUEUE_URL = os.environ.get("JOB_QUEUE_URL")
+JOB_STATUS_TTL = int(os.environ.get("JOB_STATUS_TTL_SECONDS", 7 * 24 * 60 * 60))
+SQLITE_PREFIX = "sqlite://"
+RECORD_PREFIX = "job"
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# job type -> function(**params) run by the worker
+JOB_HANDLERS: dict[str, Callable[..., Any]] = {}
+
+
+def job_handler(job_type):
+    """
+    Register a function to run jobs of job_type
+    :param job_type: name of the job type
+    :type job_type: str
+    :returns: decorator
+    :rtype: function
+    """
+
+    def register(func):
+        JOB_HANDLERS[job_type] = func
+        return func
+
+    return register
+
+
+class JobModel(Model):
+    """
+    Status of a queued job. Kept in the metadata
+    table under its own partition and expired via DynamoDB TTL
+    """
+
+    class Meta(TableMeta):
+        """
+        db metadata
+        """
+
+    id = UnicodeAttribute(hash_key=True, null=False)
+    item_version = UnicodeAttribute(range_key=True, null=False)
+    job_type = UnicodeAttribute(null=False)
+    plugin_id = UnicodeAttribute(null=True)
+    stage = UnicodeAttribute(null=True)
+    status = UnicodeAttribute(null=False)
+    error = UnicodeAttribute(null=True)
+    created_at = UTCDateTimeAttribute(null=False)
+    updated_at = UTCDateTimeAttribute(null=False)
+    expires_at = TTLAttribute(null=False)
+
+
+class SqsQueue:
+    """
+    Job queue backed by SQS with job status stored in DynamoDB
+    """
+
+    def __init__(self, queue_url):
+        self.queue_url = queue_url
+
+    def send_message(self, body):
+        return aws.sqs_send(self.queue_url, body)
+
+    def receive_messages(self, max_messages=1, wait_time=0):
+        return aws.sqs_receive(self.queue_url, max_messages, wait_time)
+
+    def delete_message(self, receipt_handle):
+        aws.sqs_delete(self.queue_url, receipt_handle)
+
+    @staticmethod
+    def set_status(job):
+        JobModel(
+            f"{RECORD_PREFIX}#{job['id']}",
+            RECORD_PREFIX,
+            job_type=job["type"],
+            plugin_id=job.get("plugin_id"),
+            stage=job.get("stage"),
+            status=job["status"],
+            error=job.get("error"),
+            created_at=datetime.fromisoformat(job["created_at"]),
+            updated_at=datetime.fromisoformat(job["updated_at"]),
+            expires_at=timedelta(seconds=JOB_STATUS_TTL),
+        ).save()
+
+    @staticmethod
+    def get_status(job_id):
+        try:
+            record = JobModel.get(f"{RECORD_PREFIX}#{job_id}", RECORD_PREFIX)
+        except JobModel.DoesNotExist:
+            return None
+        return {
+            "id": job_id,
+            "type": record.job_type,
+            "plugin_id": record.plugin_id,
+            "stage": record.stage,
+            "status": record.status,
+            "error": record.error,
+            "created_at": record.created_at.isoformat(),
+            "updated_at": record.updated_at.isoformat(),
+        }
+
+
+class SqliteQueue:
+    """
+    Job queue with the same interface as SqsQueue backed by SQLite.
+    For local development and tests.
+    """
+
+    def __init__(self, path=":memory:", visibility_timeout=30):
+        import sqlite3  # pylint: disable=import-outside-toplevel
+
+        self.visibility_timeout = visibility_timeout
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id TEXT PRIMARY KEY, body TEXT NOT NULL, visible_at REAL NOT NULL, receipt_handle TEXT
+            );
+            CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, job TEXT NOT NULL);
+            """)
+
+    def send_message(self, body):
+        message_id = str(uuid.uuid4())
+        with self._lock:
+            self._connection.execute("INSERT INTO messages VALUES (?, ?, 0, NULL)", (message_id, body))
+        return message_id
+
+    def receive_messages(self, max_messages=1, wait_time=0):
+        deadline = time.monotonic() + wait_time
+        while True:
+            received_at = time.time()
+            with self._lock:
+                rows = self._connection.execute(
+                    "SELECT id, body FROM messages WHERE visible_at <= ? ORDER BY rowid LIMIT ?", (received_at, max_messages)
+                ).fetchall()
+                messages = []
+                for message_id, body in rows:
+                    receipt_handle = str(uuid.uuid4())
+                    self._connection.execute(
+                        "UPDATE messages SET visible_at = ?, receipt_handle = ? WHERE id = ?",
+                        (received_at + self.visibility_timeout, receipt_handle, message_id),
+                    )
+                    messages.append({"MessageId": message_id, "ReceiptHandle": receipt_handle, "Body": body})
+            if messages or time.monotonic() >= deadline:
+                return messages
+            time.sleep(0.1)
+
+    def delete_message(self, receipt_handle):
+        with self._lock:
+            self._connection.execute("DELETE FROM messages WHERE receipt_handle = ?", (receipt_handle,))
+
+    def set_status(self, job):
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?)", (job["id"], json.dumps(job)))
+
+    def get_status(self, job_id):
+        with self._lock:
+            row = self._connection.execute("SELECT job FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+_queue: dict[str, SqsQueue | SqliteQueue] = {}
+
+
+def get_queue(queue_url=None):
+    """
+    Return the configured job queue. Queues are created once per process
+    :param queue_url: queue to use. Defaults to JOB_QUEUE_URL
+    :type queue_url: str
+    :returns: the job queue or None if no queue is configured
+    :rtype: SqsQueue | SqliteQueue
+    """
+
+    queue_url = queue_url or JOB_QUEUE_URL
+    if not queue_url:
+        return None
+    if queue_url not in _queue:
+        if queue_url.startswith(SQLITE_PREFIX):
+            # As per SQLAlchemy, sqlite:///relative/path and sqlite:////absolute/path
+            path = queue_url[len(SQLITE_PREFIX) :]
+            _queue[queue_url] = SqliteQueue(path[1:] if path.startswith("/") else ":memory:")
+        else:
+            _queue[queue_url] = SqsQueue(queue_url)
+    return _queue[queue_url]
+
+
+def now():
+    """
+    Current time as an iso formatted string
+    """
+
+    return datetime.now(timezone.utc).isoformat()
+
+
+def enqueue(queue, job_type, plugin_id=None, plugin_stage=None, **params):
+    """
+    Queue a job and record its status as queued
+    :param queue: job queue
+    :type queue: SqsQueue | SqliteQueue
+    :param job_type: registered job type
+    :type job_type: str
+    :param plugin_id: plugin the job relates to
+    :type plugin_id: str
+    :param plugin_stage: the plugin's stage (e.g. dev)
+    :type plugin_stage: str
+    :returns: job status
+    :rtype: dict
+    """
+
+    timestamp = now()
+    job = {
+        "id": str(uuid.uuid4()),
+        "type": job_type,
+        "plugin_id": plugin_id,
+        "stage": plugin_stage,
+        "status": QUEUED,
+        "error": None,
+        "created_at": timestamp,
+        "updated_at": timestamp,
+    }
+    # Status is recorded first so the worker can never finish a job that has no status
+    queue.set_status(job)
+    queue.send_message(json.dumps({"id": job["id"], "type": job_type, "params": params}))
+    get_log().info("JobQueued", jobId=job["id"], jobType=job_type)
+    return job
+
+
+def run_job(queue, body):
+    """
+    Run a queued job, recording its status as it progresses
+    :param queue: job queue
+    :type queue: SqsQueue | SqliteQueue
+    :param body: message body as sent by enqueue
+    :type body: str
+    :returns: True if the job succeeded
+    :rtype: bool
+    """
+
+    message = json.loads(body)
+    job = queue.get_status(message["id"]) or {
+        "id": message["id"],
+        "type": message["type"],
+        "created_at": now(),
+    }
+    job.update({"status": RUNNING, "updated_at": now()})
+    queue.set_status(job)
+    get_log().info("JobStarted", jobId=job["id"], jobType=job["type"])
+
+    try:
+        JOB_HANDLERS[message["type"]](**message["params"])
+    except Exception as error:  # pylint: disable=broad-except
+        job.update({"status": FAILED, "error": str(error), "updated_at": now()})
+        queue.set_status(job)
+        get_log().error("JobFailed", jobId=job["id"], jobType=job["type"], exception=error)
+        return False
+
+    job.update({"status": SUCCEEDED, "updated_at": now()})
+    queue.set_status(job)
+    get_log().info("JobSucceeded", jobId=job["id"], jobType=job["type"])
+    return True
+
+
+@job_handler("verify_upload")
+def verify_upload(bucket, file_name):
+    """
+    Check the CRC of every entry of a stored plugin file. Decompressing
+    the whole plugin is left to this job so uploads only read the zipfile's
+    central directory and metadata.txt (see plugin_parser.inspect_plugin)
+    :param bucket: bucket name
+    :type bucket: str
+    :param file_name: plugin file object key
+    :type file_name: str
+    """
+
+    data = storage.get_object_store(bucket).get(file_name)
+    with zipfile.ZipFile(BytesIO(data)) as plugin_zipfile:
+        if not plugin_parser.verify_crc(plugin_zipfile, plugin_zipfile.infolist(), plugin_parser.LIMITS):
+            get_log().error("CorruptZipfile", filename=file_name)
+            raise ValueError(f"Stored plugin file {file_name} is corrupt")
@@ -1,13 +1,22 @@
 # pylint: disable=missing-docstring
 
+import json
+import logging
 import os
-from datetime import datetime
+import random
+import time
 from typing import Any, MutableMapping
 
 import structlog
-from flask import g
+from flask import g, has_app_context
 from structlog import BoundLogger
 
+# Minimum level logged (e.g. debug, info, warning, error)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "info")
+# Fraction of requests whose SAMPLED_EVENTS are logged. Errors are always logged
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", 1))
+SAMPLED_EVENTS = ("CorrelationId", "RequestMetadata")
+
 # Convert to pinojs standard level numbers
 NAME_TO_LEVEL = {
     "critical": 60,
@@ -42,11 +51,11 @@ def add_default_keys(
     event_dict["level"] = NAME_TO_LEVEL[method_name]
 
     # Time needs to be in ms
-    event_dict["time"] = int(datetime.utcnow().timestamp() * 1000)
+    event_dict["time"] = time.time_ns() // 1_000_000
 
     # Standard keys that need to be added
     event_dict["v"] = 1
-    event_dict["pid"] = os.getpid()
+    event_dict["pid"] = _pid
 
     # Remap event -> msg
     event_dict["msg"] = event_dict["event"]
@@ -54,9 +63,34 @@ def add_default_keys(
     return event_dict
 
 
+def sample_events(
+    current_logger: BoundLogger, method_name: str, event_dict: MutableMapping[str, Any]
+) -> MutableMapping[str, Any]:
+    """
+    Drop SAMPLED_EVENTS of requests not sampled. All sampled events of
+    a request are kept or dropped together. Kept events record the
+    sampleRate so the number of requests they represent is known
+    """
+    if LOG_SAMPLE_RATE >= 1 or event_dict["event"] not in SAMPLED_EVENTS or NAME_TO_LEVEL[method_name] >= 40:
+        return event_dict
+    if has_app_context():
+        if "log_sampled" not in g:
+            g.log_sampled = random.random() < LOG_SAMPLE_RATE
+        sampled = g.log_sampled
+    else:
+        sampled = random.random() < LOG_SAMPLE_RATE
+    if not sampled:
+        raise structlog.DropEvent
+    event_dict["sampleRate"] = LOG_SAMPLE_RATE
+    return event_dict
+
+
 def add_flask_keys(
     current_logger: BoundLogger, method_name: str, event_dict: MutableMapping[str, Any]
 ) -> MutableMapping[str, Any]:
+    # The worker logs outside of a flask request
+    if not has_app_context():
+        return event_dict
     if "request_id" in g:
         event_dict["requestId"] = g.request_id
     if "plugin_id" in g:
@@ -64,15 +98,48 @@ def add_flask_keys(
     return event_dict
 
 
-structlog.configure(
-    processors=[
-        add_default_keys,
-        add_flask_keys,
-        structlog.processors.StackInfoRenderer(),
-        structlog.processors.format_exc_info,
-        structlog.processors.JSONRenderer(),
-    ],
-)
+def refresh_pid():
+    global _pid  # pylint: disable=global-statement
+    _pid = os.getpid()
+
+
+# The pid is constant per process so is looked up once (and again in forked workers)
+_pid = os.getpid()
+os.register_at_fork(after_in_child=refresh_pid)
+
+
+def serialize(event_dict: MutableMapping[str, Any], **kwargs: Any) -> str:
+    """
+    Render log lines as compact JSON
+    """
+    return json.dumps(event_dict, separators=(",", ":"), **kwargs)
+
+
+_logger = None
+
+
+def configure(level=None):
+    """
+    Configure structlog. Done on first use rather than at import
+    :param level: minimum level logged. Defaults to LOG_LEVEL
+    :type level: str
+    """
+
+    global _logger  # pylint: disable=global-statement
+    structlog.configure(
+        processors=[
+            sample_events,
+            add_default_keys,
+            add_flask_keys,
+            structlog.processors.StackInfoRenderer(),
+            structlog.processors.format_exc_info,
+            structlog.processors.JSONRenderer(serializer=serialize),
+        ],
+        wrapper_class=structlog.make_filtering_bound_logger(getattr(logging, (level or LOG_LEVEL).upper())),
+        cache_logger_on_first_use=True,
+    )
+    # Reused by every get_log call so the configured logger is only built once
+    _logger = structlog.get_logger()
 
 
 def get_log():
@@ -80,4 +147,27 @@ def get_log():
     Get logger instance
     """
 
-    return structlog.get_logger()
+    if _logger is None:
+        configure()
+    return _logger
+
+
+def read_events(lines, msg):
+    """
+    Parse the events of exported logs (JSON lines, optionally prefixed as
+    in CloudWatch exports). Lines that are not JSON are skipped
+    :param lines: log lines
+    :type lines: iterable
+    :param msg: event (e.g. RequestMetadata)
+    :type msg: str
+    :returns: events
+    :rtype: generator
+    """
+
+    for line in lines:
+        try:
+            event = json.loads(line[line.index("{") :])
+        except ValueError:
+            continue
+        if event.get("msg") == msg:
+            yield event
@@ -0,0 +1,76 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Optional per request memory instrumentation via tracemalloc.
+
+    With MEMORY_TRACE=true (see api.py) the peak memory traced during each request, the
+    process' maximum resident set size and the request's top allocation
+    sites (MEMORY_TOP, by net size allocated) are logged with its RequestMetadata.
+
+    tracemalloc slows python allocations so this is intended for
+    diagnosing memory use rather than being left enabled.
+
+"""
+
+import os
+import resource
+import tracemalloc
+
+from flask import g
+
+MEMORY_TOP = int(os.environ.get("MEMORY_TOP", 5))
+
+
+def start():
+    """
+    Start tracing the request's memory
+    """
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    g.memory_snapshot = tracemalloc.take_snapshot() if MEMORY_TOP else None
+
+
+def max_rss():
+    """
+    Maximum resident set size of the process
+    :returns: bytes
+    :rtype: int
+    """
+
+    # KiB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def stop():
+    """
+    Memory used by the request
+    :returns: peak traced memory, maximum resident set size and top allocation sites
+    :rtype: dict
+    """
+
+    current, peak = tracemalloc.get_traced_memory()
+    usage = {"peak": peak, "current": current, "maxRss": max_rss(), "top": []}
+    snapshot = g.pop("memory_snapshot", None)
+    if snapshot:
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        differences = tracemalloc.take_snapshot().filter_traces(filters).compare_to(snapshot.filter_traces(filters), "lineno")
+        usage["top"] = [
+            {
+                "site": f"{diff.traceback[0].filename}:{diff.traceback[0].lineno}",
+                "size": diff.size_diff,
+                "count": diff.count_diff,
+            }
+            for diff in differences[:MEMORY_TOP]
+        ]
+    return usage
@@ -20,15 +20,24 @@
 import hashlib
 import json
 import os
-from datetime import datetime
-
-from pynamodb.attributes import NumberAttribute, UnicodeAttribute, UTCDateTimeAttribute
+from datetime import datetime, timezone
+
+from pynamodb.attributes import (
+    JSONAttribute,
+    NumberAttribute,
+    TTLAttribute,
+    UnicodeAttribute,
+    UTCDateTimeAttribute,
+)
 from pynamodb.models import Model
 
+from . import aws
 from .error import DataError
 from .log import get_log
 
 RECORD_FILL = 6
+# Stages plugins are stored under (see api.validate_stage)
+STAGES = ("", "dev")
 
 # Database to metadata.txt mapping
 DBMD_MAP = {
@@ -76,6 +85,50 @@ def format_item_version(plugin_stage, item_version="0"):
     return f"metadata{plugin_stage}"
 
 
+def version_zero_updates(metadata, revisions, created_at, filename, file_attributes=None):
+    """
+    Attribute values a plugin's version zero is updated with when a
+    new version is uploaded. Attributes with a value of None are removed
+
+    :param metadata: ConfigParser representation of metadata.txt
+    :type metadata: configparser.ConfigParser
+    :param revisions: revisions of the current version zero
+    :type revisions: int
+    :param created_at: when the current version zero was created. None if never
+    :type created_at: datetime
+    :param filename: filename of plugin.zip in datastore
+    :type filename: str
+    :param file_attributes: plugin.zip attributes (file_sha256, its SHA-256 hex
+        digest, and manifest, as built by plugin_parser.inspect_plugin)
+    :type file_attributes: dict
+    :returns: attribute name -> value
+    :rtype: dict
+    """
+
+    general_metadata = metadata["general"]
+    updates = {
+        db_model_key: general_metadata.get(metadata_key)
+        for db_model_key, metadata_key in DBMD_MAP.items()
+        if metadata_key in general_metadata and general_metadata[metadata_key] != ""
+    }
+
+    # set all standard attributes for the update
+    updates.update(
+        {
+            "qgis_maximum_version": general_metadata.get(
+                "qgisMaximumVersion", f"{general_metadata.get('qgisMinimumVersion').split('.')[0]}.99"
+            ),
+            "revisions": revisions + 1,
+            "ended_at": None,
+            "created_at": created_at or datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc),
+            "file_name": filename,
+        }
+    )
+    updates.update((name, value) for name, value in (file_attributes or {}).items() if value)
+    return updates
+
+
 class ModelEncoder(json.JSONEncoder):
     """
     Encode json
@@ -95,12 +148,27 @@ class ModelEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, o)
 
 
+class TableMeta:
+    """
+    db settings shared by the Meta of all models stored in
+    the plugin repository table
+    """
+
+    table_name = os.environ.get("PLUGINS_TABLE_NAME", "qgis-plugin-repo-metadata")
+    region = os.environ.get("AWS_REGION")
+    max_pool_connections = aws.CLIENT_SETTINGS["max_pool_connections"]
+    connect_timeout_seconds = aws.CLIENT_SETTINGS["connect_timeout"]
+    read_timeout_seconds = aws.CLIENT_SETTINGS["read_timeout"]
+    # PynamoDB counts retries where botocore counts attempts
+    max_retry_attempts = aws.CLIENT_SETTINGS["max_attempts"] - 1
+
+
 class MetadataModel(Model):
     """
     metadata db model
     """
 
-    class Meta:
+    class Meta(TableMeta):
         """
         db metadata
 
@@ -112,9 +180,6 @@ class MetadataModel(Model):
         to the this document (plugins.xml)
         """
 
-        table_name = os.environ.get("PLUGINS_TABLE_NAME", "qgis-plugin-repo-metadata")
-        region = os.environ.get("AWS_REGION")
-
     id = UnicodeAttribute(hash_key=True, null=False)
     item_version = UnicodeAttribute(range_key=True, null=False)
     stage = UnicodeAttribute(null=True)
@@ -140,7 +205,11 @@ class MetadataModel(Model):
     icon = UnicodeAttribute(null=True)
     category = UnicodeAttribute(null=True)
     file_name = UnicodeAttribute(null=False)
+    file_sha256 = UnicodeAttribute(null=True)
+    manifest = JSONAttribute(null=True)
     secret = UnicodeAttribute(null=True)
+    # Revisions removed by the retention policy (see retention.py) are expired via DynamoDB TTL
+    expires_at = TTLAttribute(null=True)
 
     def __iter__(self):
         for name, attr in self._get_attributes().items():
@@ -161,14 +230,30 @@ class MetadataModel(Model):
         return cls.query(plugin_id, cls.item_version == format_item_version(plugin_stage, item_version))
 
     @classmethod
-    def all_version_zeros(cls, plugin_stage):
+    def all_version_zeros(cls, plugin_stage, consistent=False):
         """
         Yields all version zero plugin metadata
+        :param consistent: strongly consistent scan, reflecting every completed write
+        :type consistent: bool
         :returns: json describing plugin metadata
         :rtype: json
         """
 
-        for item in cls.scan(cls.item_version == format_item_version(plugin_stage)):
+        for item in cls.scan(cls.item_version == format_item_version(plugin_stage), consistent_read=consistent):
+            yield json.loads(json.dumps(item.attribute_values, cls=ModelEncoder))
+
+    @classmethod
+    def changed_since(cls, since=None):
+        """
+        Yields all records updated after a time. Records without an
+        updated_at (e.g. token records) are only yielded when since is None
+        :param since: time. None for all records
+        :type since: datetime
+        :returns: json describing records
+        :rtype: json
+        """
+
+        for item in cls.scan(cls.updated_at > since if since else None):
             yield json.loads(json.dumps(item.attribute_values, cls=ModelEncoder))
 
     @classmethod
@@ -206,7 +291,7 @@ class MetadataModel(Model):
         return versions
 
     @classmethod
-    def update_version_zero(cls, metadata, version_zero, filename):
+    def update_version_zero(cls, metadata, version_zero, filename, file_attributes=None):
         """
         Update dynamodb metadata store for uploaded plugin
 
@@ -216,35 +301,16 @@ class MetadataModel(Model):
         :type version_zero: metadata_model.Metadata
         :param filename: filename of plugin.zip in datastore (currently s3)
         :type filename: str
+        :param file_attributes: plugin.zip attributes (file_sha256 and manifest)
+        :type file_attributes: dict
         """
 
-        general_metadata = metadata["general"]
-        action_list = []
-
-        for db_model_key, metadata_key in DBMD_MAP.items():
-            if metadata_key in general_metadata and general_metadata[metadata_key] != "":
-                model_item = getattr(cls, db_model_key)
-                action_list.append(model_item.set(general_metadata.get(metadata_key)))
-
-        # set all standard actions for the update
-        action_list.extend(
-            [
-                cls.qgis_maximum_version.set(
-                    general_metadata.get(
-                        "qgisMaximumVersion", f"{general_metadata.get('qgisMinimumVersion').split('.')[0]}.99"
-                    )
-                ),
-                cls.revisions.set(version_zero.revisions + 1),
-                cls.ended_at.remove(),
-                cls.created_at.set(
-                    datetime.now()
-                    if "created_at" not in version_zero.attribute_values
-                    else version_zero.attribute_values["created_at"]
-                ),
-                cls.updated_at.set(datetime.now()),
-                cls.file_name.set(filename),
-            ]
+        updates = version_zero_updates(
+            metadata, version_zero.revisions, version_zero.attribute_values.get("created_at"), filename, file_attributes
         )
+        action_list = [
+            getattr(cls, name).remove() if value is None else getattr(cls, name).set(value) for name, value in updates.items()
+        ]
         version_zero.update(actions=action_list, condition=cls.revisions == version_zero.revisions)
 
     @classmethod
@@ -261,7 +327,7 @@ class MetadataModel(Model):
         revision.save(condition=(cls.revisions.does_not_exist() | cls.id.does_not_exist()))
 
     @classmethod
-    def new_plugin_version(cls, metadata, plugin_id, filename, plugin_stage):
+    def new_plugin_version(cls, metadata, plugin_id, filename, plugin_stage, file_attributes=None):
         """
         If a new version of an existing plugin is submitted via the API
         update the version zero record with its details and
@@ -275,6 +341,8 @@ class MetadataModel(Model):
         :type filename: str
         :param plugin_stage: plugins stage (dev or prd)
         :type stage: str
+        :param file_attributes: plugin.zip attributes (file_sha256 and manifest)
+        :type file_attributes: dict
         :returns: json describing plugin metadata
         :rtype: json
         """
@@ -286,7 +354,7 @@ class MetadataModel(Model):
             get_log().error("PluginNotFound")
             raise DataError(400, "Plugin Not Found") from error
         # Update version zero
-        cls.update_version_zero(metadata, version_zero, filename)
+        cls.update_version_zero(metadata, version_zero, filename, file_attributes)
         get_log().info("VersionZeroUpdated")
 
         # Insert v0 into revision
@@ -337,8 +405,8 @@ class MetadataModel(Model):
             raise DataError(400, "Plugin Not Found") from error
         version_zero.update(
             actions=[
-                cls.ended_at.set(datetime.now()),
-                cls.updated_at.set(datetime.now()),
+                cls.ended_at.set(datetime.now(timezone.utc)),
+                cls.updated_at.set(datetime.now(timezone.utc)),
                 cls.revisions.set(version_zero.revisions + 1),
             ]
         )
@@ -18,10 +18,30 @@
 import configparser
 import os
 import re
+import zipfile
+import zlib
 from io import StringIO
 
+from src.plugin import timing
 from src.plugin.error import DataError
 
+# Zip entry names always use "/" as the separator regardless of platform
+ZIP_SEP = "/"
+METADATA_PATH_PATTERN = re.compile(r"^[^/]*/metadata\.txt$")
+
+# Limits applied to untrusted plugin zipfiles. These are checked against the
+# central directory before anything is decompressed, and reads are capped
+# so a zipfile that misreports its sizes can not exceed them either.
+LIMITS = {
+    "max_entries": int(os.environ.get("PLUGIN_MAX_ENTRIES", 10000)),
+    "max_uncompressed_size": int(os.environ.get("PLUGIN_MAX_UNCOMPRESSED_SIZE", 256 * 1024 * 1024)),
+    "max_compression_ratio": int(os.environ.get("PLUGIN_MAX_COMPRESSION_RATIO", 100)),
+    "max_metadata_size": int(os.environ.get("PLUGIN_MAX_METADATA_SIZE", 64 * 1024)),
+}
+# Small entries can legitimately compress very well so the ratio is only enforced above this size
+RATIO_MIN_SIZE = 1024 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+
 
 def metadata_path(plugin_zipfile):
     """
@@ -33,11 +53,26 @@ def metadata_path(plugin_zipfile):
     """
 
     # Get Metadata.txt path
-    plugin_files = plugin_zipfile.namelist()
-    path = [i for i in plugin_files if re.search(r"^[^/]*/metadata\.txt$", i)]
-    if not path:
-        raise DataError(400, "No metadata.txt file found in plugin directory")
-    return path[0]
+    for path in plugin_zipfile.namelist():
+        if METADATA_PATH_PATTERN.match(path):
+            return path
+    raise DataError(400, "No metadata.txt file found in plugin directory")
+
+
+def root_dir(plugin_root):
+    """
+    Validate the set of top level entries contains the single plugin root dir
+    :param plugin_root: distinct top level names of all zipfile entries
+    :type plugin_root: set
+    :returns:  root dir name
+    :rtype: str
+    """
+
+    if len(plugin_root) > 1:
+        raise DataError(400, "Multiple directories exists at the root level. There should only be one")
+    if not plugin_root:
+        raise DataError(400, "The plugin has no root directory. One must exist")
+    return next(iter(plugin_root))
 
 
 def zipfile_root_dir(plugin_zipfile):
@@ -51,30 +86,150 @@ def zipfile_root_dir(plugin_zipfile):
     """
 
     # Get root dir
-    filelist = plugin_zipfile.filelist
-    plugin_root = set(path.filename.split(os.sep)[0] for path in filelist)
-    if len(plugin_root) > 1:
-        raise DataError(400, "Multiple directories exists at the root level. There should only be one")
-    if not plugin_root:
-        raise DataError(400, "The plugin has no root directory. One must exist")
-    plugin_root = next(iter(plugin_root))
-    return plugin_root
+    return root_dir(set(path.filename.split(ZIP_SEP, 1)[0] for path in plugin_zipfile.filelist))
 
 
-def metadata_contents(plugin_zipfile, metadata):
+def read_entry(plugin_zipfile, entry, max_bytes):
+    """
+    Stream a zipfile entry, stopping once more than max_bytes are decompressed
+    :param plugin_zipfile: Zipfile obj representing the plugin
+    :type plugin_zipfile: zipfile.ZipFile
+    :param entry: entry name or ZipInfo
+    :type entry: str | zipfile.ZipInfo
+    :param max_bytes: maximum number of bytes to decompress
+    :type max_bytes: int
+    :returns: generator of decompressed chunks
+    :rtype: generator
+    """
+
+    total = 0
+    with plugin_zipfile.open(entry) as entry_file:
+        while chunk := entry_file.read(READ_CHUNK_SIZE):
+            total += len(chunk)
+            if total > max_bytes:
+                raise DataError(400, "Plugin file exceeds the maximum uncompressed size")
+            yield chunk
+
+
+def validate_limits(infolist, limits):
+    """
+    Check the zipfile's central directory against the limits
+    before any entry is decompressed
+    :param infolist: ZipInfo for each zipfile entry
+    :type infolist: list
+    :param limits: limits as per LIMITS
+    :type limits: dict
+    """
+
+    if len(infolist) > limits["max_entries"]:
+        raise DataError(400, "Plugin file contains too many files")
+    uncompressed_size = 0
+    for info in infolist:
+        uncompressed_size += info.file_size
+        if uncompressed_size > limits["max_uncompressed_size"]:
+            raise DataError(400, "Plugin file exceeds the maximum uncompressed size")
+        if info.file_size > RATIO_MIN_SIZE and info.file_size > info.compress_size * limits["max_compression_ratio"]:
+            raise DataError(400, f"Plugin file entry {info.filename} exceeds the maximum compression ratio")
+
+
+@timing.timed("zip.crc")
+def verify_crc(plugin_zipfile, infolist, limits):
+    """
+    Stream every entry to check its CRC, without holding any entry in memory
+    :param plugin_zipfile: Zipfile obj representing the plugin
+    :type plugin_zipfile: zipfile.ZipFile
+    :param infolist: ZipInfo for each zipfile entry
+    :type infolist: list
+    :param limits: limits as per LIMITS
+    :type limits: dict
+    :returns: True if all entries match their CRC and decompress
+    :rtype: bool
+    """
+
+    remaining = limits["max_uncompressed_size"]
+    try:
+        for info in infolist:
+            for chunk in read_entry(plugin_zipfile, info, remaining):
+                remaining -= len(chunk)
+    # Corrupt compressed data fails to decompress (zlib.error) or ends early (EOFError)
+    except (zipfile.BadZipFile, zlib.error, EOFError):
+        return False
+    return True
+
+
+@timing.timed("zip.metadata")
+def metadata_contents(plugin_zipfile, metadata, max_size=None):
     """
     Return metadata.txt contents
     :param plugin_zipfile: Zipfile obj representing the plugin
     :type plugin_zipfile: zipfile.ZipFile
     :param metadata_path: Path in <plugin>.zip to metadata.txt file
     :type metadata_path: str
+    :param max_size: maximum metadata.txt size. Defaults to LIMITS["max_metadata_size"]
+    :type max_size: int
     :returns: ConfigParser representation of metadata
-    :rtype: configparser.ConfigParser
+    :rtype: configparser.RawConfigParser
     """
 
-    metadata = plugin_zipfile.open(metadata)
-    metadata = str(metadata.read(), "utf-8")
-    config_parser = configparser.ConfigParser()
+    max_size = LIMITS["max_metadata_size"] if max_size is None else max_size
+    try:
+        metadata = str(b"".join(read_entry(plugin_zipfile, metadata, max_size)), "utf-8")
+    except DataError as error:
+        raise DataError(400, "metadata.txt exceeds the maximum size") from error
+    except (zipfile.BadZipFile, zlib.error, EOFError) as error:
+        raise DataError(400, "Plugin file supplied is corrupt") from error
+    # metadata.txt values are free text (e.g. "about") so "%" must not be interpolated
+    config_parser = configparser.RawConfigParser()
     config_parser.read_file(StringIO(metadata))
 
     return config_parser
+
+
+@timing.timed("zip.inspect")
+def inspect_plugin(plugin_zipfile, limits=None):
+    """
+    Inspect the plugin in a single pass over the zipfile's central
+    directory and build a manifest describing it. Only metadata.txt is
+    decompressed, entry CRCs are checked outside of the request by the
+    upload's job (see verify_crc)
+    :param plugin_zipfile: Zipfile obj representing the plugin
+    :type plugin_zipfile: zipfile.ZipFile
+    :param limits: limits to enforce. Defaults to LIMITS
+    :type limits: dict
+    :returns: tuple (manifest, ConfigParser representation of metadata)
+    :rtype: tuple (dict, configparser.RawConfigParser)
+    """
+
+    limits = LIMITS if limits is None else {**LIMITS, **limits}
+    plugin_root = set()
+    names = set()
+    path = None
+    compressed_size = 0
+    uncompressed_size = 0
+    infolist = plugin_zipfile.infolist()
+    validate_limits(infolist, limits)
+    for info in infolist:
+        name = info.filename
+        names.add(name)
+        plugin_root.add(name.split(ZIP_SEP, 1)[0])
+        if path is None and METADATA_PATH_PATTERN.match(name):
+            path = name
+        compressed_size += info.compress_size
+        uncompressed_size += info.file_size
+
+    if path is None:
+        raise DataError(400, "No metadata.txt file found in plugin directory")
+    plugin_root = root_dir(plugin_root)
+    metadata = metadata_contents(plugin_zipfile, path, limits["max_metadata_size"])
+
+    icon = metadata.get("general", "icon", fallback=None)
+    icon_path = f"{plugin_root}{ZIP_SEP}{icon}" if icon else None
+    manifest = {
+        "root_dir": plugin_root,
+        "metadata_path": path,
+        "file_count": len(infolist),
+        "compressed_size": compressed_size,
+        "uncompressed_size": uncompressed_size,
+        "icon_path": icon_path if icon_path in names else None,
+    }
+    return manifest, metadata
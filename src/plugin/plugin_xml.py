@@ -16,12 +16,10 @@
 
 import xml.etree.ElementTree as ET
 
-from packaging.version import Version
+from src.plugin import storage, timing
 
-from src.plugin.metadata_model import MetadataModel
 
-
-def generate_download_url(repo_bucket_name, aws_region, plugin_id):
+def generate_download_url(repo_bucket_name, aws_region, plugin_id, download_base_url=None):
     """
     Returns path to plugin download
     :param repo_bucket_name: s3 bucket name
@@ -30,10 +28,14 @@ def generate_download_url(repo_bucket_name, aws_region, plugin_id):
     :type aws_region: string
     :param plugin_id: plugin_id
     :type plugin_id: string
+    :param download_base_url: base url of downloads served by the API. None if served from s3
+    :type download_base_url: string
     :returns: path to plugin download
     :rtype: string
     """
 
+    if download_base_url:
+        return f"{download_base_url}/{plugin_id}"
     return f"https://{repo_bucket_name}.s3-{aws_region}.amazonaws.com/{plugin_id}"
 
 
@@ -69,12 +71,16 @@ def compatible_with_qgis_version(metadata, qgis_version):
         return False
     if qgis_version == "0.0.0":
         return True
+    # Only needed when filtering by QGIS version so not imported at cold start
+    from packaging.version import Version  # pylint: disable=import-outside-toplevel
+
     return Version(metadata["qgis_minimum_version"]) <= Version(qgis_version) and Version(qgis_version) <= Version(
         metadata["qgis_maximum_version"]
     )
 
 
-def generate_xml_body(repo_bucket_name, aws_region, qgis_version, plugin_stage):
+@timing.timed("xml.generate")
+def generate_xml_body(repo_bucket_name, aws_region, qgis_version, plugin_stage, download_base_url=None):
     """
     Generate XML describing plugin store
     from dynamodb plugin metadata db
@@ -82,12 +88,15 @@ def generate_xml_body(repo_bucket_name, aws_region, qgis_version, plugin_stage):
     :type repo_bucket_name: string
     :param aws_region:  aws_region
     :type aws_region: string
+    :param download_base_url: base url of downloads served by the API. None if served from s3
+    :type download_base_url: string
     :returns: string representation of plugin xml
     :rtype: string
     """
 
     current_plugins = filter(
-        lambda item: compatible_with_qgis_version(item, qgis_version), MetadataModel.all_version_zeros(plugin_stage)
+        lambda item: compatible_with_qgis_version(item, qgis_version),
+        storage.get_metadata_store().all_version_zeros(plugin_stage, qgis_version),
     )
     root = ET.Element("plugins")
     for plugin in current_plugins:
@@ -95,12 +104,22 @@ def generate_xml_body(repo_bucket_name, aws_region, qgis_version, plugin_stage):
             continue
         current_group = ET.SubElement(root, "pyqgis_plugin", {"name": plugin["name"], "version": plugin["version"]})
         for key, value in plugin.items():
-            if key not in ("file_name", "name", "id", "category", "email", "item_version", "stage"):
+            if key not in (
+                "file_name",
+                "file_sha256",
+                "manifest",
+                "name",
+                "id",
+                "category",
+                "email",
+                "item_version",
+                "stage",
+            ):
                 new_element = new_xml_element(key, value)
                 current_group.append(new_element)
         new_element = new_xml_element("file_name", f"{plugin['id']}.{plugin['version']}.zip")
         current_group.append(new_element)
-        download_url = generate_download_url(repo_bucket_name, aws_region, plugin["file_name"])
+        download_url = generate_download_url(repo_bucket_name, aws_region, plugin["file_name"], download_base_url)
         new_element = new_xml_element("download_url", download_url)
         current_group.append(new_element)
     return ET.tostring(root)
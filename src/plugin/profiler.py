@@ -0,0 +1,119 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Opt-in per request profiling. A request carrying the PROFILE_SECRET
+    in the X-Profile header is run under cProfile. Its hottest functions
+    are logged and, if PROFILE_UPLOAD is set, the raw profile is uploaded
+    under the diagnostics prefix of the private bucket (PRIVATE_BUCKET_NAME).
+    Profiles are never uploaded to the public repository bucket as they
+    reveal the service's internals.
+
+    Requests are only profiled if PROFILE_SECRET is configured.
+
+"""
+
+import cProfile
+import hmac
+import io
+import marshal
+import os
+import pstats
+
+from flask import g
+
+from . import aws
+from .log import get_log
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_SECRET = os.environ.get("PROFILE_SECRET")
+PROFILE_TOP = int(os.environ.get("PROFILE_TOP", 25))
+PROFILE_UPLOAD = os.environ.get("PROFILE_UPLOAD", "").lower() == "true"
+PROFILE_BUCKET = os.environ.get("PRIVATE_BUCKET_NAME")
+DIAGNOSTICS_PREFIX = "diagnostics/profiles/"
+
+
+def requested(headers):
+    """
+    Test if the request asks to be profiled
+    :param headers: request headers
+    :type headers: werkzeug.datastructures.EnvironHeaders
+    :returns: True if profiling is enabled and the header carries the secret
+    :rtype: bool
+    """
+
+    if not PROFILE_SECRET:
+        return False
+    secret = headers.get(PROFILE_HEADER)
+    return bool(secret) and hmac.compare_digest(secret.encode(), PROFILE_SECRET.encode())
+
+
+def start():
+    """
+    Start profiling the request
+    """
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as error:
+        # Only one profiler can be active at a time (e.g. another threaded request is profiled)
+        get_log().warning("ProfileNotStarted", exception=error)
+        return
+    g.profiler = profiler
+
+
+def hot_functions(stats, top):
+    """
+    The functions with the highest cumulative time
+    :param stats: profile statistics
+    :type stats: pstats.Stats
+    :param top: number of functions
+    :type top: int
+    :returns: functions with their call count and internal and cumulative time (ms)
+    :rtype: list
+    """
+
+    functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+    return [
+        {
+            "function": f"{filename}:{line}({name})",
+            "calls": calls,
+            "tottime": round(tottime * 1000, 3),
+            "cumtime": round(cumtime * 1000, 3),
+        }
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in functions
+    ]
+
+
+def stop(bucket=None):
+    """
+    Stop profiling the request, log its hot functions and optionally upload the profile
+    :param bucket: private bucket to upload the profile to. Defaults to PROFILE_BUCKET
+    :type bucket: str
+    :returns: object key of the uploaded profile or None
+    :rtype: str
+    """
+
+    profiler = g.pop("profiler")
+    profiler.disable()
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    get_log().info("RequestProfile", functions=hot_functions(stats, PROFILE_TOP))
+    bucket = bucket or PROFILE_BUCKET
+    if not PROFILE_UPLOAD:
+        return None
+    if not bucket:
+        get_log().warning("ProfileNotUploaded", reason="PRIVATE_BUCKET_NAME is not set")
+        return None
+    object_name = f"{DIAGNOSTICS_PREFIX}{g.request_id}.prof"
+    # The pstats file format as written by cProfile.Profile.dump_stats
+    aws.s3_put(marshal.dumps(stats.stats), bucket, object_name)  # type: ignore[attr-defined]
+    return object_name
@@ -0,0 +1,270 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Optional SQLite read model of the plugin catalogue. Version zero
+    records are materialised into an indexed SQLite file so listing and
+    QGIS version filtering are answered with indexed SQL rather than by
+    filtering full scans in Python.
+
+    The metadata store (e.g. DynamoDB) remains the source of truth. At
+    most every READ_MODEL_REFRESH_SECONDS each stage's version zeros are
+    replaced with those listed by the store the read model wraps, so
+    deletions are applied too. With CATALOGUE_SNAPSHOT_PATH set that is
+    the catalogue snapshot (see snapshot.py) and a refresh reads the
+    snapshot rather than scanning the table. Writes made through the read
+    model are applied immediately.
+
+    Revisions are read from the metadata store, a query of one plugin's
+    partition, so revisions deleted (e.g. by TTL, see retention.py) are
+    never listed.
+
+    Enabled by setting READ_MODEL_PATH (e.g. /tmp/qgis-plugins.sqlite),
+    which on Lambda survives between invocations of a container.
+
+"""
+
+import json
+import os
+import re
+import threading
+import time
+
+from .log import get_log
+from .metadata_model import STAGES, format_item_version
+
+READ_MODEL_PATH = os.environ.get("READ_MODEL_PATH")
+READ_MODEL_REFRESH_SECONDS = float(os.environ.get("READ_MODEL_REFRESH_SECONDS", 10))
+QGIS_VERSION = re.compile(r"^(\d{1,3})\.(\d{1,3})(?:\.(\d{1,3}))?$")
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS records (
+        id TEXT NOT NULL,
+        item_version TEXT NOT NULL,
+        stage TEXT NOT NULL,
+        version_zero INTEGER NOT NULL,
+        revisions INTEGER,
+        qgis_minimum_version INTEGER,
+        qgis_maximum_version INTEGER,
+        record TEXT NOT NULL,
+        PRIMARY KEY (id, item_version)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS version_zeros
+        ON records (stage, qgis_minimum_version, qgis_maximum_version) WHERE version_zero = 1;
+"""
+
+
+def version_key(version):
+    """
+    Sortable integer of a QGIS version (e.g. 3.34.1 -> 3034001)
+    :param version: version string
+    :type version: str
+    :returns: key or None if not of the form major.minor[.patch]
+    :rtype: int
+    """
+
+    match = QGIS_VERSION.match(version or "")
+    if not match:
+        return None
+    major, minor, patch = (int(part or 0) for part in match.groups())
+    return (major * 1000 + minor) * 1000 + patch
+
+
+class ReadModel:
+    """
+    SQLite file holding the catalogue's version zero records
+    """
+
+    def __init__(self, path):
+        import sqlite3  # pylint: disable=import-outside-toplevel
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.executescript(SCHEMA)
+
+    def rows(self, records):
+        """
+        Rows of the version zero records, ignoring other records (e.g. revisions or tokens)
+        """
+
+        rows = []
+        for record in records:
+            stage = record.get("stage") or ""
+            if "#" in record["id"] or record["item_version"] != format_item_version(stage):
+                continue
+            rows.append(
+                (
+                    record["id"],
+                    record["item_version"],
+                    stage,
+                    1,
+                    record.get("revisions"),
+                    version_key(record.get("qgis_minimum_version")),
+                    version_key(record.get("qgis_maximum_version")),
+                    json.dumps(record, separators=(",", ":")),
+                )
+            )
+        return rows
+
+    def upsert(self, records):
+        """
+        Store version zero records
+        :param records: records as returned by the metadata store
+        :type records: iterable
+        :returns: number of records stored
+        :rtype: int
+        """
+
+        rows = self.rows(records)
+        with self._lock:
+            self._connection.execute("BEGIN")
+            self._connection.executemany("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._connection.execute("COMMIT")
+        return len(rows)
+
+    def replace(self, plugin_stage, records):
+        """
+        Replace a stage's version zero records, dropping any no longer listed
+        :param plugin_stage: the plugin's stage (e.g. dev)
+        :type plugin_stage: str
+        :param records: the stage's version zero records as returned by the metadata store
+        :type records: iterable
+        :returns: number of records stored
+        :rtype: int
+        """
+
+        rows = self.rows(records)
+        with self._lock:
+            self._connection.execute("BEGIN")
+            self._connection.execute("DELETE FROM records WHERE stage = ?", (plugin_stage,))
+            self._connection.executemany("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._connection.execute("COMMIT")
+        return len(rows)
+
+    def version_zeros(self, plugin_stage, qgis_version=None):
+        """
+        Version zero records of a stage
+        :param plugin_stage: the plugin's stage (e.g. dev)
+        :type plugin_stage: str
+        :param qgis_version: only plugins compatible with this QGIS version. None for all
+        :type qgis_version: str
+        :returns: version zero records
+        :rtype: list
+        """
+
+        sql = "SELECT record FROM records WHERE version_zero = 1 AND stage = ?"
+        params = [plugin_stage]
+        key = version_key(qgis_version)
+        if qgis_version is not None:
+            sql += " AND revisions > 0"
+        if key:
+            # Versions that are not major.minor[.patch] are left for plugin_xml to filter
+            sql += (
+                " AND (qgis_minimum_version IS NULL OR qgis_maximum_version IS NULL"
+                " OR (qgis_minimum_version <= ? AND ? <= qgis_maximum_version))"
+            )
+            params.extend([key, key])
+        with self._lock:
+            rows = self._connection.execute(sql + " ORDER BY id", params).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def refresh(self, store):
+        """
+        Replace each stage's version zero records with those the store lists
+        :param store: metadata store, ideally a snapshot.SnapshotStore
+        :type store: snapshot.SnapshotStore | storage.DynamoDBStore | storage.MemoryStore | storage.SqliteStore
+        :returns: number of records stored
+        :rtype: int
+        """
+
+        return sum(self.replace(plugin_stage, store.all_version_zeros(plugin_stage)) for plugin_stage in STAGES)
+
+
+class ReadModelStore:
+    """
+    Metadata store answering listings from the read model and everything
+    else from the store it wraps. Writes go to the wrapped store and are
+    then applied to the read model
+    """
+
+    def __init__(self, store, path, refresh_seconds=READ_MODEL_REFRESH_SECONDS):
+        self.store = store
+        self.refresh_seconds = refresh_seconds
+        self.read_model = ReadModel(path)
+        self._refreshed = None
+        self._lock = threading.Lock()
+
+    def fresh(self):
+        """
+        The read model, refreshed if it is due
+        """
+
+        if self._refreshed is None or time.monotonic() - self._refreshed >= self.refresh_seconds:
+            with self._lock:
+                if self._refreshed is None or time.monotonic() - self._refreshed >= self.refresh_seconds:
+                    applied = self.read_model.refresh(self.store)
+                    self._refreshed = time.monotonic()
+                    get_log().info("ReadModelRefreshed", records=applied)
+        return self.read_model
+
+    def all_version_zeros(self, plugin_stage, qgis_version=None, consistent=False):
+        if consistent:
+            # The read model lags the store by up to its refresh interval
+            return self.store.all_version_zeros(plugin_stage, qgis_version, consistent)
+        return iter(self.fresh().version_zeros(plugin_stage, qgis_version))
+
+    def plugin_version_zero(self, plugin_id, plugin_stage):
+        return self.store.plugin_version_zero(plugin_id, plugin_stage)
+
+    def plugin_all_versions(self, plugin_id, plugin_stage):
+        return self.store.plugin_all_versions(plugin_id, plugin_stage)
+
+    def new_plugin_version(self, metadata, plugin_id, filename, plugin_stage, file_attributes=None):
+        version_zero = self.store.new_plugin_version(metadata, plugin_id, filename, plugin_stage, file_attributes)
+        self.apply_write(version_zero)
+        return version_zero
+
+    def archive_plugin(self, plugin_id, plugin_stage):
+        version_zero = self.store.archive_plugin(plugin_id, plugin_stage)
+        self.apply_write(version_zero)
+        return version_zero
+
+    def validate_token(self, token, plugin_id, plugin_stage):
+        self.store.validate_token(token, plugin_id, plugin_stage)
+
+    def put_records(self, records):
+        written = self.store.put_records(records)
+        self._refreshed = None
+        return written
+
+    def get_record(self, plugin_id, item_version):
+        return self.store.get_record(plugin_id, item_version)
+
+    def set_expiry(self, plugin_id, item_version, expires_at):
+        self.store.set_expiry(plugin_id, item_version, expires_at)
+
+    def purge_expired(self, now=None):
+        return self.store.purge_expired(now)
+
+    def delete_records(self, keys):
+        # Only revisions are deleted (see revision_archive.py) so the read model is unaffected
+        return self.store.delete_records(keys)
+
+    def changed_since(self, since=None):
+        return self.store.changed_since(since)
+
+    def apply_write(self, version_zero):
+        """
+        Apply an updated version zero so the container reads its own writes before the next refresh
+        """
+
+        self.read_model.upsert([version_zero])
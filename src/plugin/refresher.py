@@ -0,0 +1,105 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Refresher keeping the catalogue snapshot (see snapshot.py) up to date
+    for long-running servers. gunicorn.conf.py runs one alongside the
+    workers. It can also be run on its own:
+        CATALOGUE_SNAPSHOT_PATH=/dev/shm/qgis-plugins.snapshot python -m src.plugin.refresher [--once]
+
+    The snapshot is rewritten every --interval seconds and, within a
+    second, after a worker marks it stale by uploading or archiving a plugin.
+
+    On Lambda, where writes patch the snapshot shared through S3, handler
+    rebuilds it from a consistent scan on a schedule (see serverless.yml).
+
+"""
+
+import argparse
+import os
+import time
+
+from src.plugin import snapshot, storage
+from src.plugin.log import get_log
+
+REFRESH_INTERVAL = float(os.environ.get("CATALOGUE_SNAPSHOT_REFRESH_SECONDS", 30))
+
+
+def refresh(store, once=False, interval=REFRESH_INTERVAL, poll_interval=1):
+    """
+    Rewrite the snapshot when it is due or stale. Failed refreshes are
+    logged and retried at the next poll, the workers falling back to
+    the metadata store once the snapshot is older than its max age
+    :param store: metadata store wrapped by the snapshot
+    :type store: snapshot.SnapshotStore
+    :param once: refresh once and return
+    :type once: bool
+    :param interval: seconds between refreshes
+    :type interval: float
+    :param poll_interval: seconds between checks for a stale snapshot
+    :type poll_interval: float
+    """
+
+    refreshed_at = None
+    while True:
+        if refreshed_at is None or store.stale() or time.monotonic() - refreshed_at >= interval:
+            try:
+                store.refresh()
+                refreshed_at = time.monotonic()
+            except Exception as error:  # pylint: disable=broad-except
+                get_log().error("CatalogueSnapshotFailed", exception=error)
+        if once:
+            return
+        time.sleep(poll_interval)
+
+
+def snapshot_store(store):
+    """
+    The snapshot store among a metadata store and the stores it wraps (e.g. by a read model)
+    :returns: snapshot store or None
+    :rtype: snapshot.SnapshotStore
+    """
+
+    while store is not None and not isinstance(store, snapshot.SnapshotStore):
+        store = getattr(store, "store", None)
+    return store
+
+
+def handler(event, context):  # pylint: disable=unused-argument
+    """
+    Lambda entry point rebuilding the catalogue snapshot shared through S3
+    (see snapshot.py). Relists writes whose patch of the snapshot failed
+    :returns: snapshot size in bytes, None if no snapshot is shared
+    :rtype: dict
+    """
+
+    store = snapshot_store(storage.get_metadata_store())
+    if not store or not store.key:
+        get_log().info("CatalogueSnapshotNotShared")
+        return {"size": None}
+    return {"size": store.refresh()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep the catalogue snapshot up to date")
+    parser.add_argument("--interval", type=float, default=REFRESH_INTERVAL, help="Seconds between refreshes")
+    parser.add_argument("--once", action="store_true", help="Write the snapshot once and exit")
+    args = parser.parse_args()
+
+    store = snapshot_store(storage.get_metadata_store())
+    if not store:
+        parser.error("Set CATALOGUE_SNAPSHOT_PATH")
+    get_log().info("RefresherStarted", path=store.path)
+    refresh(store, args.once, args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Retention of dev plugin revisions and cleanup of plugin files.
+
+    Dev revisions are kept while they are among the plugin's latest
+    DEV_REVISION_KEEP revisions or newer than DEV_REVISION_RETENTION_DAYS.
+    When an upload or archive pushes a revision out of the latest
+    revisions its expires_at is set so DynamoDB TTL deletes it once it
+    is also old enough. Revision listings apply the same policy so
+    revisions awaiting deletion are never returned.
+
+    Plugin files are content addressed and shared by records (e.g. a
+    retried upload, or dev then prd). The cleanup, run as a scheduled
+    Lambda (handler) or locally:
+        python -m src.plugin.retention [--dry-run]
+    sets expiry on dev revisions written before the policy applied, and
+    prunes expired revisions from dev archives and deletes plugin files no
+    longer referenced by any record, including archived revisions (see
+    revision_archive.py). Plugin files are in the repository bucket
+    (REPO_BUCKET_NAME) and archives in the private bucket. Files modified within ORPHAN_GRACE_SECONDS are
+    kept so an upload in progress, whose file is stored (or, if already
+    stored, touched) before its record, is never cleaned up. A file is
+    also kept if it was modified after it was listed.
+
+"""
+
+import argparse
+import os
+import re
+from datetime import datetime, timedelta, timezone
+
+from src.plugin import revision_archive, storage
+from src.plugin.log import get_log
+from src.plugin.metadata_model import format_item_version
+
+DEV_REVISION_KEEP = int(os.environ.get("DEV_REVISION_KEEP", 10))
+DEV_REVISION_RETENTION_DAYS = float(os.environ.get("DEV_REVISION_RETENTION_DAYS", 30))
+ORPHAN_GRACE_SECONDS = float(os.environ.get("ORPHAN_GRACE_SECONDS", 24 * 60 * 60))
+RETENTION_BUCKET = os.environ.get("REPO_BUCKET_NAME")
+# Stages whose revisions expire
+RETAINED_STAGES = ("dev",)
+# Plugin files are named by their SHA-256 (see api.upload). Other objects
+# (e.g. archives if both buckets share an OBJECT_STORE_URL) are never cleaned up
+PLUGIN_FILE = re.compile(r"^[0-9a-f]{64}$")
+# Modification time of a file no longer listed
+UNLISTED = -1.0
+
+
+def expiry(revision, revisions, keep=DEV_REVISION_KEEP, days=DEV_REVISION_RETENTION_DAYS):
+    """
+    Earliest time a revision may expire
+    :param revision: revision record
+    :type revision: dict
+    :param revisions: number of revisions of the plugin (as per version zero)
+    :type revisions: int
+    :returns: time or None if the revision is among the latest keep revisions
+    :rtype: datetime
+    """
+
+    if revision_archive.revision_number(revision) > revisions - keep:
+        return None
+    return datetime.fromisoformat(revision["updated_at"]) + timedelta(days=days)
+
+
+def retained(versions, plugin_stage, now=None, keep=DEV_REVISION_KEEP, days=DEV_REVISION_RETENTION_DAYS):
+    """
+    Versions of a plugin not removed by the retention policy
+    :param versions: version zero and revisions of a plugin
+    :type versions: list
+    :param plugin_stage: the plugin's stage (e.g. dev)
+    :type plugin_stage: str
+    :returns: versions
+    :rtype: list
+    """
+
+    if plugin_stage not in RETAINED_STAGES:
+        return versions
+    now = now or datetime.now(timezone.utc)
+    revisions = max((version["revisions"] for version in versions if not revision_archive.revision_number(version)), default=0)
+    kept = []
+    for version in versions:
+        expires_at = revision_archive.revision_number(version) and expiry(version, revisions, keep, days)
+        if not expires_at or expires_at > now:
+            kept.append(version)
+    return kept
+
+
+def expire_revision(store, version_zero, keep=DEV_REVISION_KEEP, days=DEV_REVISION_RETENTION_DAYS):
+    """
+    Set the expiry of the revision a write has pushed out of the latest revisions
+    :param store: metadata store
+    :type store: storage.DynamoDBStore | storage.MemoryStore | storage.SqliteStore
+    :param version_zero: version zero as updated by the write
+    :type version_zero: dict
+    :returns: expiry time or None if no revision expires
+    :rtype: datetime
+    """
+
+    plugin_stage = version_zero.get("stage") or ""
+    number = version_zero["revisions"] - keep
+    if plugin_stage not in RETAINED_STAGES or number < 1:
+        return None
+    item_version = format_item_version(plugin_stage, str(number))
+    revision = store.get_record(version_zero["id"], item_version)
+    if not revision or "expires_at" in revision:
+        return None
+    # DynamoDB ignores TTLs more than five years past so never set one in the past
+    expires_at = max(expiry(revision, version_zero["revisions"], keep, days), datetime.now(timezone.utc))
+    store.set_expiry(version_zero["id"], item_version, expires_at)
+    get_log().info("RevisionExpirySet", pluginId=version_zero["id"], itemVersion=item_version, expiresAt=expires_at)
+    return expires_at
+
+
+def expire_revisions(store, keep=DEV_REVISION_KEEP, days=DEV_REVISION_RETENTION_DAYS):
+    """
+    Set the expiry of every dev revision outside the latest revisions
+    that has none (e.g. written before the policy applied)
+    :returns: number of revisions given an expiry
+    :rtype: int
+    """
+
+    now = datetime.now(timezone.utc)
+    expired = 0
+    for plugin_stage in RETAINED_STAGES:
+        for version_zero in list(store.all_version_zeros(plugin_stage)):
+            for revision in store.plugin_all_versions(version_zero["id"], plugin_stage):
+                if not revision_archive.revision_number(revision) or "expires_at" in revision:
+                    continue
+                expires_at = expiry(revision, version_zero["revisions"], keep, days)
+                if expires_at:
+                    store.set_expiry(revision["id"], revision["item_version"], max(expires_at, now))
+                    expired += 1
+    return expired
+
+
+def retained_archive(store, plugin_id, plugin_stage, archived):
+    """
+    Archived revisions of a plugin stage not removed by the retention policy
+    :param archived: archived revisions
+    :type archived: list
+    :returns: revisions
+    :rtype: list
+    """
+
+    if plugin_stage not in RETAINED_STAGES:
+        return archived
+    # Version zero's revisions decide which revisions are among the latest
+    version_zero = store.get_record(plugin_id, format_item_version(plugin_stage))
+    versions = retained(([version_zero] if version_zero else []) + archived, plugin_stage)
+    return [version for version in versions if revision_archive.revision_number(version)]
+
+
+def prune_archives(store, archive_store):
+    """
+    Remove the revisions the retention policy has expired from dev
+    archives (e.g. archived before dev stages were no longer compacted)
+    :param archive_store: store of archived revisions
+    :type archive_store: storage.S3ObjectStore | storage.MemoryObjectStore | storage.SqliteObjectStore
+    :returns: number of revisions removed
+    :rtype: int
+    """
+
+    pruned = 0
+    for plugin_id, plugin_stage in list(revision_archive.archived_plugins(archive_store)):
+        if plugin_stage not in RETAINED_STAGES:
+            continue
+        archived = revision_archive.read_archive(archive_store, plugin_id, plugin_stage)
+        kept = retained_archive(store, plugin_id, plugin_stage, archived)
+        if len(kept) == len(archived):
+            continue
+        if kept:
+            revision_archive.write_archive(archive_store, plugin_id, plugin_stage, kept)
+        else:
+            archive_store.delete(revision_archive.archive_name(plugin_id, plugin_stage))
+        pruned += len(archived) - len(kept)
+        get_log().info("ArchivedRevisionsPruned", pluginId=plugin_id, stage=plugin_stage, revisions=len(archived) - len(kept))
+    return pruned
+
+
+def referenced_files(store, archive_store):
+    """
+    Names of the plugin files referenced by records and retained archived revisions
+    :param archive_store: store of archived revisions
+    :type archive_store: storage.S3ObjectStore | storage.MemoryObjectStore | storage.SqliteObjectStore
+    :rtype: set
+    """
+
+    references = {record["file_name"] for record in store.changed_since(None) if record.get("file_name")}
+    for plugin_id, plugin_stage in revision_archive.archived_plugins(archive_store):
+        archived = revision_archive.read_archive(archive_store, plugin_id, plugin_stage)
+        archived = retained_archive(store, plugin_id, plugin_stage, archived)
+        references.update(revision["file_name"] for revision in archived if revision.get("file_name"))
+    return references
+
+
+def modified_since(object_store, name, modified):
+    """
+    Test if a file has been modified (e.g. touched by an upload of the
+    same content) or deleted since it was listed
+    :param modified: modification time when listed
+    :type modified: float
+    :rtype: bool
+    """
+
+    return dict(object_store.names(name)).get(name, UNLISTED) != modified
+
+
+def delete_unreferenced_files(store, object_store, archive_store, grace=ORPHAN_GRACE_SECONDS, dry_run=False):
+    """
+    Delete plugin files no record references
+    :param object_store: store of plugin files
+    :type object_store: storage.S3ObjectStore | storage.MemoryObjectStore | storage.SqliteObjectStore
+    :param archive_store: store of archived revisions
+    :type archive_store: storage.S3ObjectStore | storage.MemoryObjectStore | storage.SqliteObjectStore
+    :param grace: seconds since modification files are kept for
+    :type grace: float
+    :param dry_run: only log the files that would be deleted
+    :type dry_run: bool
+    :returns: names of the unreferenced files deleted, or that would be if dry_run
+    :rtype: list
+    """
+
+    now = datetime.now(timezone.utc).timestamp()
+    # Listed before references are read so a file stored since is never a candidate
+    candidates = {
+        name: modified
+        for name, modified in object_store.names()
+        if PLUGIN_FILE.match(name) and (modified is None or now - modified >= grace)
+    }
+    references = referenced_files(store, archive_store)
+    unreferenced = []
+    for name, modified in candidates.items():
+        if name in references:
+            continue
+        # An upload touches a file it shares before writing its record
+        if not dry_run and modified_since(object_store, name, modified):
+            get_log().info("UnreferencedFileModified", filename=name)
+            continue
+        get_log().info("UnreferencedFile", filename=name, deleted=not dry_run)
+        if not dry_run:
+            object_store.delete(name)
+        unreferenced.append(name)
+    return unreferenced
+
+
+def clean_up(store, object_store, archive_store, dry_run=False):
+    """
+    Apply the retention policy and delete unreferenced plugin files
+    :returns: counts of revisions expired, records purged, archived revisions pruned and files deleted
+    :rtype: dict
+    """
+
+    result = {"expired": 0, "purged": 0, "pruned": 0}
+    if not dry_run:
+        result["expired"] = expire_revisions(store)
+        result["purged"] = store.purge_expired()
+        result["pruned"] = prune_archives(store, archive_store)
+    result["files"] = len(delete_unreferenced_files(store, object_store, archive_store, dry_run=dry_run))
+    get_log().info("CleanUpFinished", **result)
+    return result
+
+
+def handler(event, context):  # pylint: disable=unused-argument
+    """
+    Lambda entry point for the scheduled cleanup
+    """
+
+    return clean_up(
+        storage.get_metadata_store(),
+        storage.get_object_store(RETENTION_BUCKET),
+        storage.get_object_store(revision_archive.REVISION_ARCHIVE_BUCKET),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply revision retention and delete unreferenced plugin files")
+    parser.add_argument("--dry-run", action="store_true", help="Only log the files that would be deleted")
+    args = parser.parse_args()
+    clean_up(
+        storage.get_metadata_store(),
+        storage.get_object_store(RETENTION_BUCKET),
+        storage.get_object_store(revision_archive.REVISION_ARCHIVE_BUCKET),
+        args.dry_run,
+    )
+
+
+if __name__ == "__main__":
+    main()
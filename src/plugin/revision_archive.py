@@ -0,0 +1,186 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Archive of old plugin revisions. Every upload and archive stores a
+    full revision record, so compaction keeps the latest
+    REVISION_ARCHIVE_KEEP revisions of each prd plugin in the metadata
+    store and moves older ones to a gzipped JSON lines object per plugin
+    stage in the private bucket (PRIVATE_BUCKET_NAME, see storage.py):
+        revisions/<stage>/<plugin_id>.jsonl.gz (stage is prd or dev)
+
+    Dev revisions expire instead (see retention.py), so are only archived
+    if a plugin's dev stage is compacted explicitly.
+
+    Revisions are read across both tiers by plugin_all_versions.
+
+    Compaction runs as a scheduled Lambda (handler) or locally:
+        python -m src.plugin.revision_archive [--keep N] [--plugin-id ID [--stage dev]]
+
+"""
+
+import argparse
+import gzip
+import json
+import os
+
+from src.plugin import storage
+from src.plugin.log import get_log
+from src.plugin.metadata_model import RECORD_FILL
+
+REVISION_ARCHIVE_KEEP = int(os.environ.get("REVISION_ARCHIVE_KEEP", 100))
+REVISION_ARCHIVE_BUCKET = os.environ.get("PRIVATE_BUCKET_NAME")
+ARCHIVE_PREFIX = "revisions"
+ARCHIVE_SUFFIX = ".jsonl.gz"
+# Stages compacted. Dev revisions expire rather than being archived
+ARCHIVED_STAGES = ("",)
+
+
+def archive_name(plugin_id, plugin_stage):
+    """
+    Object name of a plugin stage's archived revisions
+    """
+
+    return f"{ARCHIVE_PREFIX}/{plugin_stage or 'prd'}/{plugin_id}{ARCHIVE_SUFFIX}"
+
+
+def archived_plugins(object_store):
+    """
+    Plugin stages with archived revisions
+    :returns: (plugin id, plugin stage) of each archive
+    :rtype: generator
+    """
+
+    for name, _ in object_store.names(f"{ARCHIVE_PREFIX}/"):
+        plugin_stage, plugin_id = name[len(ARCHIVE_PREFIX) + 1 : -len(ARCHIVE_SUFFIX)].split("/", 1)
+        yield plugin_id, "" if plugin_stage == "prd" else plugin_stage
+
+
+def revision_number(record):
+    return int(record["item_version"][:RECORD_FILL])
+
+
+def read_archive(object_store, plugin_id, plugin_stage):
+    """
+    Archived revisions of a plugin stage
+    :returns: revisions in revision order. Empty if none are archived
+    :rtype: list
+    """
+
+    name = archive_name(plugin_id, plugin_stage)
+    if not object_store.exists(name):
+        return []
+    return [json.loads(line) for line in gzip.decompress(object_store.get(name)).splitlines()]
+
+
+def write_archive(object_store, plugin_id, plugin_stage, revisions):
+    lines = b"".join(json.dumps(revision, separators=(",", ":")).encode("utf-8") + b"\n" for revision in revisions)
+    object_store.put(gzip.compress(lines), archive_name(plugin_id, plugin_stage))
+
+
+def plugin_all_versions(store, object_store, plugin_id, plugin_stage):
+    """
+    Version zero and all revisions of a plugin, archived or not
+    :param store: metadata store
+    :type store: storage.DynamoDBStore | storage.MemoryStore | storage.SqliteStore
+    :param object_store: store of archived revisions
+    :type object_store: storage.S3ObjectStore | storage.MemoryObjectStore | storage.SqliteObjectStore
+    :param plugin_id: plugin id
+    :type plugin_id: str
+    :param plugin_stage: the plugin's stage (e.g. dev)
+    :type plugin_stage: str
+    :returns: records in item_version order
+    :rtype: list
+    """
+
+    versions = store.plugin_all_versions(plugin_id, plugin_stage)
+    revisions = [version for version in versions if revision_number(version)]
+    version_zero_revisions = max((version["revisions"] for version in versions if not revision_number(version)), default=0)
+    # Only plugins missing revisions from the table have archived revisions to read
+    if len(revisions) >= version_zero_revisions:
+        return versions
+    merged = {version["item_version"]: version for version in read_archive(object_store, plugin_id, plugin_stage)}
+    merged.update((version["item_version"], version) for version in versions)
+    return [merged[item_version] for item_version in sorted(merged)]
+
+
+def compact_plugin(store, object_store, plugin_id, plugin_stage, keep=REVISION_ARCHIVE_KEEP):
+    """
+    Move all but the latest revisions of a plugin stage to its archive.
+    The archive is written before revisions are deleted so an interrupted
+    compaction is completed by the next
+    :param keep: number of revisions kept in the metadata store
+    :type keep: int
+    :returns: number of revisions archived
+    :rtype: int
+    """
+
+    revisions = sorted(
+        (version for version in store.plugin_all_versions(plugin_id, plugin_stage) if revision_number(version)),
+        key=revision_number,
+    )
+    old = revisions[: max(len(revisions) - keep, 0)]
+    if not old:
+        return 0
+    archived = {revision["item_version"]: revision for revision in read_archive(object_store, plugin_id, plugin_stage)}
+    archived.update((revision["item_version"], revision) for revision in old)
+    write_archive(object_store, plugin_id, plugin_stage, [archived[item_version] for item_version in sorted(archived)])
+    store.delete_records((revision["id"], revision["item_version"]) for revision in old)
+    get_log().info("RevisionsArchived", pluginId=plugin_id, stage=plugin_stage, revisions=len(old), archived=len(archived))
+    return len(old)
+
+
+def compact(store, object_store, keep=REVISION_ARCHIVE_KEEP, stages=ARCHIVED_STAGES):
+    """
+    Compact every plugin stage with more than keep revisions
+    :param stages: stages to compact
+    :type stages: tuple
+    :returns: number of revisions archived
+    :rtype: int
+    """
+
+    archived = 0
+    for plugin_stage in stages:
+        for version_zero in list(store.all_version_zeros(plugin_stage)):
+            if version_zero.get("revisions", 0) > keep:
+                archived += compact_plugin(store, object_store, version_zero["id"], plugin_stage, keep)
+    return archived
+
+
+def handler(event, context):  # pylint: disable=unused-argument
+    """
+    Lambda entry point for a scheduled compaction
+    :returns: number of revisions archived
+    :rtype: dict
+    """
+
+    archived = compact(storage.get_metadata_store(), storage.get_object_store(REVISION_ARCHIVE_BUCKET))
+    return {"archived": archived}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old plugin revisions")
+    parser.add_argument("--keep", type=int, default=REVISION_ARCHIVE_KEEP, help="Revisions kept per plugin stage")
+    parser.add_argument("--plugin-id", help="Compact only this plugin")
+    parser.add_argument("--stage", default="", help="Stage of --plugin-id (e.g. dev)")
+    args = parser.parse_args()
+
+    store = storage.get_metadata_store()
+    object_store = storage.get_object_store(REVISION_ARCHIVE_BUCKET)
+    if args.plugin_id:
+        archived = compact_plugin(store, object_store, args.plugin_id, args.stage, args.keep)
+    else:
+        archived = compact(store, object_store, args.keep)
+    get_log().info("CompactionFinished", archived=archived)
+
+
+if __name__ == "__main__":
+    main()
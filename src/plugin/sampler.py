@@ -0,0 +1,152 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Always-on, low rate statistical stack sampler.
+
+    A background thread samples the stacks of all other threads SAMPLER_HZ
+    times a second. Stacks running plugin repository code (e.g. flask routes,
+    generate_xml_body, model reads and logging processors) are aggregated as
+    collapsed stacks ("module:function;module:function" -> count). Every
+    SAMPLER_FLUSH_SECONDS, and at shutdown, the aggregate is logged as a
+    StackSamples event. Its stacks can be written one per line as
+    "<stack> <count>" and passed to flamegraph.pl or speedscope.
+
+    Disabled unless SAMPLER_HZ is set.
+
+"""
+
+import atexit
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from .log import get_log
+
+SAMPLER_HZ = float(os.environ.get("SAMPLER_HZ", 0))
+SAMPLER_FLUSH_SECONDS = float(os.environ.get("SAMPLER_FLUSH_SECONDS", 60))
+# Distinct stacks kept between flushes. Further stacks are counted as OTHER
+SAMPLER_MAX_STACKS = int(os.environ.get("SAMPLER_MAX_STACKS", 500))
+MAX_DEPTH = 64
+OTHER = "[other]"
+
+
+def collapse(frame, max_depth=MAX_DEPTH):
+    """
+    Collapse a stack, root first, as "module:function;module:function"
+    :param frame: innermost frame
+    :type frame: frame
+    :param max_depth: innermost frames kept
+    :type max_depth: int
+    :returns: collapsed stack
+    :rtype: str
+    """
+
+    names: list[str] = []
+    while frame and len(names) < max_depth:
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    """
+    Samples the stacks of all other threads in a background thread
+    """
+
+    def __init__(self, hz, flush_seconds=SAMPLER_FLUSH_SECONDS, include="src.plugin", max_stacks=SAMPLER_MAX_STACKS):
+        self.interval = 1 / hz
+        self.flush_seconds = flush_seconds
+        self.include = include
+        self.max_stacks = max_stacks
+        # Only counted and flushed by the sampling thread, or by stop once it
+        # has ended, so needs no lock
+        self.stacks: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        """
+        Sample the stacks of all threads other than the calling thread
+        """
+
+        current = threading.get_ident()
+        for ident, frame in sys._current_frames().items():  # pylint: disable=protected-access
+            if ident == current:
+                continue
+            stack = collapse(frame)
+            if f"{self.include}." not in stack:
+                continue
+            if stack not in self.stacks and len(self.stacks) >= self.max_stacks:
+                stack = OTHER
+            self.stacks[stack] += 1
+
+    def flush(self):
+        """
+        Log and reset the aggregated stacks
+        """
+
+        stacks, self.stacks = self.stacks, Counter()
+        samples = stacks.total()
+        if samples:
+            get_log().info("StackSamples", hz=1 / self.interval, samples=samples, stacks=dict(stacks.most_common()))
+
+    def run(self):
+        next_flush = time.monotonic() + self.flush_seconds
+        while not self._stop.wait(self.interval):
+            self.sample()
+            if time.monotonic() >= next_flush:
+                self.flush()
+                next_flush = time.monotonic() + self.flush_seconds
+
+    def start(self):
+        """
+        Start sampling. Also restarts the thread in forked processes
+        """
+
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop sampling and flush the aggregate
+        """
+
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.flush()
+
+
+_sampler = None
+
+
+def start():
+    """
+    Start the process' sampler if SAMPLER_HZ is set
+    :returns: the sampler
+    :rtype: StackSampler
+    """
+
+    global _sampler  # pylint: disable=global-statement
+    if not SAMPLER_HZ:
+        return None
+    if not _sampler:
+        _sampler = StackSampler(SAMPLER_HZ)
+        atexit.register(_sampler.stop)
+        os.register_at_fork(after_in_child=_sampler.start)
+    _sampler.start()
+    return _sampler
@@ -0,0 +1,589 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Memory-mapped snapshot of the version zero catalogue, for long-running
+    multi-worker servers (see gunicorn.conf.py) and Lambda cold starts.
+
+    One refresher process (see refresher.py) writes the snapshot to
+    CATALOGUE_SNAPSHOT_PATH, ideally on tmpfs (e.g. /dev/shm). Every worker
+    maps it read-only so its pages are shared between workers rather than
+    each holding a copy, and plugins.xml and plugin listings are served
+    from it rather than by scanning the metadata store per request.
+
+    On Lambda set CATALOGUE_SNAPSHOT_PATH under /tmp and CATALOGUE_SNAPSHOT_S3_KEY.
+    The snapshot is then shared through the PRIVATE_BUCKET_NAME bucket: a
+    new container downloads it with a single GET rather than scanning the
+    table, and warm containers download it again once their copy is
+    CATALOGUE_SNAPSHOT_MAX_AGE old.
+
+    A write patches the version zero it made into the snapshot in S3: it is
+    downloaded with its ETag and put back conditional on it not changing,
+    retrying if a concurrent write changed it. Of two versions of a plugin's
+    version zero the later updated is kept. Writes never scan the table, a
+    scheduled Lambda (see refresher.handler) rebuilds the snapshot from a
+    consistent scan, relisting any write whose patch failed.
+
+    Layout (integers are little-endian):
+        * magic (8 bytes) and header length (uint32)
+        * header: JSON {"created_at": epoch seconds, "scanned_at": epoch seconds
+          the scan of the store began, "strings": {"offset", "count"},
+          "stages": {stage: {"offset", "count"}}}
+        * strings at their offset: count + 1 uint32 offsets followed by the
+          UTF-8 strings. Each distinct string, including attribute names, is
+          stored once
+        * per stage at its offset: count + 1 uint32 record offsets, count
+          columns of revisions and QGIS minimum and maximum version keys
+          (int32, -1 if unset, see read_model.version_key) then the records.
+          Each record is a uint16 attribute count followed by, per attribute,
+          its name's string index (uint32), a type tag (uint8) and its value
+        * QGIS version filtering is done on the columns, and records and
+          strings are only decoded when iterated
+
+"""
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+from botocore.exceptions import ClientError
+
+from . import aws
+from .log import get_log
+from .metadata_model import STAGES
+from .read_model import version_key
+
+CATALOGUE_SNAPSHOT_PATH = os.environ.get("CATALOGUE_SNAPSHOT_PATH")
+# Snapshots older than this are ignored (e.g. the refresher has stopped)
+CATALOGUE_SNAPSHOT_MAX_AGE = float(os.environ.get("CATALOGUE_SNAPSHOT_MAX_AGE", 300))
+CATALOGUE_SNAPSHOT_S3_KEY = os.environ.get("CATALOGUE_SNAPSHOT_S3_KEY")
+CATALOGUE_SNAPSHOT_BUCKET = os.environ.get("PRIVATE_BUCKET_NAME")
+MAGIC = b"QGISCAT2"
+HEADER = struct.Struct("<8sI")
+OFFSET = struct.Struct("<I")
+RANGE = struct.Struct("<2I")
+COLUMNS = struct.Struct("<3i")
+COUNT = struct.Struct("<H")
+ATTRIBUTE = struct.Struct("<IB")
+INTEGER = struct.Struct("<q")
+FLOAT = struct.Struct("<d")
+STALE_SUFFIX = ".stale"
+UNSET = -1
+# Conditional puts attempted before a publish gives up
+PUBLISH_ATTEMPTS = 3
+# Error codes S3 rejects a conditional put with when the object has changed
+PRECONDITION_CODES = ("PreconditionFailed", "ConditionalRequestConflict")
+
+# Attribute value type tags
+NULL, STRING, INTEGER_TAG, FLOAT_TAG, TRUE, FALSE, JSON = range(7)
+
+
+class Strings:
+    """
+    Interned string table of a snapshot being written
+    """
+
+    def __init__(self):
+        self.indexes = {}
+
+    def index(self, string):
+        return self.indexes.setdefault(string, len(self.indexes))
+
+    def pack(self):
+        blobs = [string.encode("utf-8") for string in self.indexes]
+        offsets = [0]
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+        return struct.pack(f"<{len(offsets)}I", *offsets) + b"".join(blobs)
+
+
+def pack_value(value, strings):
+    """
+    Type tag and packed value of an attribute
+    """
+
+    if value is None:
+        return struct.pack("<B", NULL)
+    if isinstance(value, bool):
+        return struct.pack("<B", TRUE if value else FALSE)
+    if isinstance(value, int):
+        return struct.pack("<B", INTEGER_TAG) + INTEGER.pack(value)
+    if isinstance(value, float):
+        return struct.pack("<B", FLOAT_TAG) + FLOAT.pack(value)
+    if isinstance(value, str):
+        return struct.pack("<BI", STRING, strings.index(value))
+    return struct.pack("<BI", JSON, strings.index(json.dumps(value, separators=(",", ":"))))
+
+
+def pack_record(record, strings):
+    packed = bytearray(COUNT.pack(len(record)))
+    for name, value in record.items():
+        packed += OFFSET.pack(strings.index(name)) + pack_value(value, strings)
+    return bytes(packed)
+
+
+def columns(record):
+    """
+    Revisions and QGIS version keys of a version zero record
+    """
+
+    revisions = record.get("revisions")
+    return (
+        UNSET if revisions is None else revisions,
+        version_key(record.get("qgis_minimum_version")) or UNSET,
+        version_key(record.get("qgis_maximum_version")) or UNSET,
+    )
+
+
+def pack_stage(records, strings):
+    """
+    Record offsets, columns and records of a stage
+    :returns: (record count, packed stage)
+    :rtype: tuple
+    """
+
+    records = list(records)
+    blobs = [pack_record(record, strings) for record in records]
+    offsets = [0]
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    return (
+        len(blobs),
+        struct.pack(f"<{len(offsets)}I", *offsets)
+        + b"".join(COLUMNS.pack(*columns(record)) for record in records)
+        + b"".join(blobs),
+    )
+
+
+def write(path, catalogue, scanned_at=None):
+    """
+    Write a snapshot. The file is replaced atomically so readers
+    only ever map a complete snapshot
+    :param path: snapshot path
+    :type path: str
+    :param catalogue: stage -> version zero records
+    :type catalogue: dict
+    :param scanned_at: when the records were read from the store (epoch seconds). Defaults to now
+    :type scanned_at: float
+    :returns: snapshot size in bytes
+    :rtype: int
+    """
+
+    strings = Strings()
+    blocks = {plugin_stage: pack_stage(records, strings) for plugin_stage, records in catalogue.items()}
+    body = bytearray(strings.pack())
+    stages = {}
+    for plugin_stage, (count, block) in blocks.items():
+        stages[plugin_stage] = {"offset": len(body), "count": count}
+        body += block
+    created_at = time.time()
+    header = json.dumps(
+        {
+            "created_at": created_at,
+            "scanned_at": created_at if scanned_at is None else scanned_at,
+            "strings": {"offset": 0, "count": len(strings.indexes)},
+            "stages": stages,
+        }
+    ).encode("utf-8")
+
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False) as snapshot_file:
+        snapshot_file.write(HEADER.pack(MAGIC, len(header)))
+        snapshot_file.write(header)
+        snapshot_file.write(body)
+    os.replace(snapshot_file.name, path)
+    return HEADER.size + len(header) + len(body)
+
+
+def read_header(data, name):
+    """
+    Header of a snapshot
+    :param data: snapshot, or at least its header
+    :type data: bytes | mmap.mmap
+    :param name: snapshot path or key, for errors
+    :type name: str
+    :returns: header and the offset of the body following it
+    :rtype: tuple
+    """
+
+    magic, header_length = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"{name} is not a catalogue snapshot")
+    header = json.loads(data[HEADER.size : HEADER.size + header_length])
+    header.setdefault("scanned_at", header["created_at"])
+    return header, HEADER.size + header_length
+
+
+class Snapshot:
+    """
+    Read-only memory-mapped snapshot
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as snapshot_file:
+            stat = os.fstat(snapshot_file.fileno())
+            self.key = (stat.st_ino, stat.st_mtime_ns)
+            self.mtime = stat.st_mtime
+            self._map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.header, self._body = read_header(self._map, path)
+        self._string_offsets = self._body + self.header["strings"]["offset"]
+        self._strings: list[str | None] = [None] * self.header["strings"]["count"]
+
+    @property
+    def scanned_at(self):
+        return self.header["scanned_at"]
+
+    def age(self):
+        """
+        Seconds since the snapshot's records were read from the store
+        """
+
+        return time.time() - self.scanned_at
+
+    def string(self, index):
+        """
+        Interned string, decoded once
+        """
+
+        string = self._strings[index]
+        if string is None:
+            start, end = RANGE.unpack_from(self._map, self._string_offsets + OFFSET.size * index)
+            data = self._string_offsets + OFFSET.size * (len(self._strings) + 1)
+            string = self._strings[index] = str(self._map[data + start : data + end], "utf-8")
+        return string
+
+    def record(self, position):
+        """
+        Decode the record at a position in the map
+        """
+
+        record = {}
+        (count,) = COUNT.unpack_from(self._map, position)
+        position += COUNT.size
+        for _ in range(count):
+            name, tag = ATTRIBUTE.unpack_from(self._map, position)
+            position += ATTRIBUTE.size
+            if tag in (STRING, JSON):
+                (index,) = OFFSET.unpack_from(self._map, position)
+                position += OFFSET.size
+                value = self.string(index) if tag == STRING else json.loads(self.string(index))
+            elif tag == INTEGER_TAG:
+                (value,) = INTEGER.unpack_from(self._map, position)
+                position += INTEGER.size
+            elif tag == FLOAT_TAG:
+                (value,) = FLOAT.unpack_from(self._map, position)
+                position += FLOAT.size
+            else:
+                value = {NULL: None, TRUE: True, FALSE: False}[tag]
+            record[self.string(name)] = value
+        return record
+
+    def records(self, plugin_stage, qgis_version=None):
+        """
+        Yields the stage's version zero records
+        :param plugin_stage: the plugin's stage (e.g. dev)
+        :type plugin_stage: str
+        :param qgis_version: only plugins with revisions and that may be compatible
+            with this QGIS version. None for all. plugin_xml makes the final check
+        :type qgis_version: str
+        :returns: version zero records
+        :rtype: generator
+        """
+
+        stage = self.header["stages"].get(plugin_stage)
+        if not stage:
+            return
+        offsets = self._body + stage["offset"]
+        stage_columns = offsets + OFFSET.size * (stage["count"] + 1)
+        records = stage_columns + COLUMNS.size * stage["count"]
+        key = version_key(qgis_version)
+        for index in range(stage["count"]):
+            if qgis_version is not None:
+                revisions, minimum, maximum = COLUMNS.unpack_from(self._map, stage_columns + COLUMNS.size * index)
+                if revisions <= 0:
+                    continue
+                if key and UNSET not in (minimum, maximum) and not minimum <= key <= maximum:
+                    continue
+            (start,) = OFFSET.unpack_from(self._map, offsets + OFFSET.size * index)
+            yield self.record(records + start)
+
+
+_snapshot = None
+
+
+def current(path):
+    """
+    The latest snapshot at path, re-mapped when the refresher replaces it
+    :param path: snapshot path
+    :type path: str
+    :returns: snapshot or None if none has been written
+    :rtype: Snapshot
+    """
+
+    global _snapshot  # pylint: disable=global-statement
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if not _snapshot or _snapshot.key != (stat.st_ino, stat.st_mtime_ns):
+        _snapshot = Snapshot(path)
+    return _snapshot
+
+
+def mark_stale(path):
+    """
+    Ask the refresher to rewrite the snapshot (e.g. after a plugin is uploaded)
+    """
+
+    with open(path + STALE_SUFFIX, "a", encoding="utf-8"):
+        pass
+
+
+def download(path, bucket, key):
+    """
+    Replace the local snapshot with the one in S3
+    :returns: its ETag, or None if none has been put yet
+    :rtype: str
+    """
+
+    try:
+        data, etag = aws.s3_get_with_etag(bucket, key)
+    except ClientError as error:
+        if error.response.get("Error", {}).get("Code") in aws.S3_NOT_FOUND_CODES:
+            return None
+        raise
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False) as snapshot_file:
+        snapshot_file.write(data)
+    os.replace(snapshot_file.name, path)
+    return etag
+
+
+def read_catalogue(path):
+    """
+    Records of a snapshot
+    :returns: (scanned_at, stage -> version zero records)
+    :rtype: tuple
+    """
+
+    snapshot = Snapshot(path)
+    return snapshot.scanned_at, {
+        plugin_stage: list(snapshot.records(plugin_stage)) for plugin_stage in snapshot.header["stages"]
+    }
+
+
+def merge(records, updates):
+    """
+    Version zero records with updates applied. Of two records of the same
+    plugin the later updated is kept, so a delayed update does not undo a later one
+    :param records: version zero records
+    :type records: list
+    :param updates: version zero records to apply
+    :type updates: list
+    :returns: version zero records
+    :rtype: list
+    """
+
+    merged = {record["id"]: record for record in records}
+    for update in updates:
+        record = merged.get(update["id"])
+        if record is None or (update.get("updated_at") or "") >= (record.get("updated_at") or ""):
+            merged[update["id"]] = update
+    return list(merged.values())
+
+
+def publish(path, bucket, key, catalogue, scanned_at=None):
+    """
+    Apply version zero records to the snapshot in S3. It is downloaded,
+    patched and put back conditional on it not changing since the download,
+    retrying if it has. The patched snapshot is left at path
+    :param path: local snapshot path
+    :type path: str
+    :param catalogue: stage -> version zero records to apply
+    :type catalogue: dict
+    :param scanned_at: when the records were read by a full scan of the store,
+        None if they are only those changed by a write
+    :type scanned_at: float
+    :returns: True if put, False if there is no snapshot to patch
+    :rtype: bool
+    """
+
+    for _ in range(PUBLISH_ATTEMPTS):
+        etag = download(path, bucket, key)
+        if etag is None and scanned_at is None:
+            return False
+        remote_scanned_at, remote = read_catalogue(path) if etag else (scanned_at, {})
+        size = write(
+            path,
+            {
+                plugin_stage: merge(remote.get(plugin_stage, []), catalogue.get(plugin_stage, []))
+                for plugin_stage in set(remote) | set(catalogue)
+            },
+            max(remote_scanned_at, scanned_at or remote_scanned_at),
+        )
+        with open(path, "rb") as snapshot_file:
+            data = snapshot_file.read()
+        try:
+            aws.s3_put_if(data, bucket, key, etag)
+            get_log().info("CatalogueSnapshotPublished", key=key, size=size, rebuilt=scanned_at is not None)
+            return True
+        except ClientError as error:
+            if error.response.get("Error", {}).get("Code") not in PRECONDITION_CODES:
+                raise
+    raise ClientError(
+        {"Error": {"Code": "PreconditionFailed", "Message": f"{key} changed {PUBLISH_ATTEMPTS} times"}}, "PutObject"
+    )
+
+
+class SnapshotStore:
+    """
+    Metadata store serving version zero listings from the snapshot
+    and everything else, including listings when there is no recent
+    snapshot, from the store it wraps. If an S3 key is given the
+    snapshot is shared through S3 rather than by a refresher
+    """
+
+    def __init__(self, store, path, max_age=CATALOGUE_SNAPSHOT_MAX_AGE, bucket=CATALOGUE_SNAPSHOT_BUCKET, key=None):
+        self.store = store
+        self.path = path
+        self.max_age = max_age
+        self.bucket = bucket
+        self.key = key
+
+    def snapshot(self):
+        """
+        The snapshot if recent enough to serve from
+        :returns: snapshot or None
+        :rtype: Snapshot
+        """
+
+        snapshot = current(self.path)
+        if not self.key:
+            return snapshot if snapshot and snapshot.age() <= self.max_age else None
+        # Shared through S3: writes patch it, so its age is that of the local copy
+        if snapshot and time.time() - snapshot.mtime <= self.max_age:
+            return snapshot
+        try:
+            if download(self.path, self.bucket, self.key) is None:
+                # Only until the first snapshot is published
+                self.refresh()
+        except ClientError as error:
+            get_log().error("CatalogueSnapshotUnavailable", bucketName=self.bucket, key=self.key, exception=error)
+            return None
+        return current(self.path)
+
+    def all_version_zeros(self, plugin_stage, qgis_version=None, consistent=False):
+        if consistent:
+            return self.store.all_version_zeros(plugin_stage, qgis_version, consistent)
+        snapshot = self.snapshot()
+        if snapshot:
+            return snapshot.records(plugin_stage, qgis_version)
+        return self.store.all_version_zeros(plugin_stage, qgis_version)
+
+    def changed_since(self, since=None):
+        return self.store.changed_since(since)
+
+    def plugin_version_zero(self, plugin_id, plugin_stage):
+        return self.store.plugin_version_zero(plugin_id, plugin_stage)
+
+    def plugin_all_versions(self, plugin_id, plugin_stage):
+        return self.store.plugin_all_versions(plugin_id, plugin_stage)
+
+    def new_plugin_version(self, metadata, plugin_id, filename, plugin_stage, file_attributes=None):
+        result = self.store.new_plugin_version(metadata, plugin_id, filename, plugin_stage, file_attributes)
+        self.written(result)
+        return result
+
+    def archive_plugin(self, plugin_id, plugin_stage):
+        result = self.store.archive_plugin(plugin_id, plugin_stage)
+        self.written(result)
+        return result
+
+    def validate_token(self, token, plugin_id, plugin_stage):
+        self.store.validate_token(token, plugin_id, plugin_stage)
+
+    def put_records(self, records):
+        written = self.store.put_records(records)
+        self.written()
+        return written
+
+    def get_record(self, plugin_id, item_version):
+        return self.store.get_record(plugin_id, item_version)
+
+    def set_expiry(self, plugin_id, item_version, expires_at):
+        self.store.set_expiry(plugin_id, item_version, expires_at)
+
+    def purge_expired(self, now=None):
+        return self.store.purge_expired(now)
+
+    def delete_records(self, keys):
+        # Only revisions are deleted (see revision_archive.py) so the snapshot is unaffected
+        return self.store.delete_records(keys)
+
+    def written(self, version_zero=None):
+        """
+        Update the snapshot after a write: patch the version zero into the
+        snapshot in S3 or, for long-running servers, mark it stale for the refresher
+        :param version_zero: version zero as updated by the write. None
+            (e.g. records put by a migration) rebuilds the snapshot
+        :type version_zero: dict
+        """
+
+        if not self.key:
+            mark_stale(self.path)
+            return
+        try:
+            if not version_zero:
+                self.refresh()
+            elif not publish(self.path, self.bucket, self.key, {version_zero.get("stage") or "": [version_zero]}):
+                # Listed once the first snapshot is published
+                get_log().info("CatalogueSnapshotNotPublishedYet", bucketName=self.bucket, key=self.key)
+        except ClientError as error:
+            # The write has been made. It is listed once a later write
+            # patches its plugin or the scheduled rebuild (see refresher.handler)
+            get_log().error("CatalogueSnapshotNotPublished", bucketName=self.bucket, key=self.key, exception=error)
+
+    def refresh(self):
+        """
+        Rewrite the snapshot from a consistent scan of the wrapped store.
+        If shared through S3 the scan is merged into the snapshot there,
+        keeping writes patched in since the scan began
+        :returns: snapshot size in bytes
+        :rtype: int
+        """
+
+        start = time.perf_counter()
+        # Cleared first so writes made during the refresh mark it stale again
+        try:
+            os.remove(self.path + STALE_SUFFIX)
+        except FileNotFoundError:
+            pass
+        scanned_at = time.time()
+        catalogue = {
+            plugin_stage: list(self.store.all_version_zeros(plugin_stage, consistent=True)) for plugin_stage in STAGES
+        }
+        if self.key:
+            publish(self.path, self.bucket, self.key, catalogue, scanned_at)
+            size = os.path.getsize(self.path)
+        else:
+            size = write(self.path, catalogue, scanned_at)
+        get_log().info("CatalogueSnapshotWritten", path=self.path, size=size, duration=(time.perf_counter() - start) * 1000)
+        return size
+
+    def stale(self):
+        """
+        Test if a write has been made since the snapshot was last refreshed
+        """
+
+        return os.path.exists(self.path + STALE_SUFFIX)
@@ -0,0 +1,777 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Storage of plugin metadata and plugin files. Each store has the same
+    interface whatever its backend so the API can run against DynamoDB
+    and S3 or, for local development, tests and benchmarks, without AWS.
+
+    Plugin metadata is stored as configured by METADATA_STORE_URL:
+        * unset - the DynamoDB table (see metadata_model.py)
+        * memory:// - in process memory
+        * sqlite:///<path> - SQLite database. Use sqlite:// for in memory
+
+    If CATALOGUE_SNAPSHOT_PATH is set version zero listings are read from
+    a shared memory-mapped snapshot of the store (see snapshot.py). If
+    READ_MODEL_PATH is set listings and QGIS version filtering are answered
+    from a SQLite read model refreshed from the snapshot (see read_model.py).
+
+    Plugin files are stored as configured by OBJECT_STORE_URL. Storing a
+    file that is already stored touches it (see retention.py):
+        * unset - the REPO_BUCKET_NAME S3 bucket
+        * memory:// - in process memory
+        * sqlite:///<path> - SQLite database. Use sqlite:// for in memory
+        * file:///<path> - directory, for self-hosting. Plugin files are
+          then downloaded from the API (see api.download) with the name
+          they were stored with as their content disposition
+
+    Idempotency records remain in DynamoDB and job status in the job
+    queue (see jobs.py).
+
+"""
+
+import abc
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any
+
+from werkzeug.security import safe_join
+
+from . import aws, read_model, snapshot
+from .error import DataError
+from .log import get_log
+from .metadata_model import (
+    MetadataModel,
+    ModelEncoder,
+    format_item_version,
+    hash_token,
+    version_zero_updates,
+)
+
+METADATA_STORE_URL = os.environ.get("METADATA_STORE_URL")
+OBJECT_STORE_URL = os.environ.get("OBJECT_STORE_URL")
+MEMORY_URL = "memory://"
+SQLITE_PREFIX = "sqlite://"
+FILE_PREFIX = "file://"
+# BatchWriteItem limit
+BATCH_SIZE = 25
+
+
+def plugin_not_found():
+    """
+    Error raised when a plugin has no record in the stage
+    :returns: error to raise
+    :rtype: DataError
+    """
+
+    get_log().error("PluginNotFound")
+    return DataError(400, "Plugin Not Found")
+
+
+def utc(value):
+    """
+    A datetime in UTC. Naive datetimes are taken to be UTC
+    :param value: datetime
+    :type value: datetime.datetime
+    :returns: UTC datetime
+    :rtype: datetime.datetime
+    """
+
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def encode(attributes):
+    """
+    JSON representation of a record, as returned by the DynamoDB store.
+    Unset attributes are omitted and datetimes are UTC. As with PynamoDB's
+    UTCDateTimeAttribute, naive datetimes are taken to be UTC
+    :param attributes: attribute name -> value
+    :type attributes: dict
+    :returns: record
+    :rtype: dict
+    """
+
+    return json.loads(
+        json.dumps(
+            {
+                name: utc(value) if isinstance(value, datetime) else value
+                for name, value in attributes.items()
+                if value is not None
+            },
+            cls=ModelEncoder,
+        )
+    )
+
+
+class DynamoDBStore:
+    """
+    Plugin metadata stored in the DynamoDB table
+    """
+
+    @staticmethod
+    def all_version_zeros(plugin_stage, qgis_version=None, consistent=False):  # pylint: disable=unused-argument
+        return MetadataModel.all_version_zeros(plugin_stage, consistent)
+
+    @staticmethod
+    def changed_since(since=None):
+        return MetadataModel.changed_since(since)
+
+    @staticmethod
+    def plugin_version_zero(plugin_id, plugin_stage):
+        return MetadataModel.plugin_version_zero(plugin_id, plugin_stage)
+
+    @staticmethod
+    def plugin_all_versions(plugin_id, plugin_stage):
+        return MetadataModel.plugin_all_versions(plugin_id, plugin_stage)
+
+    @staticmethod
+    def new_plugin_version(metadata, plugin_id, filename, plugin_stage, file_attributes=None):
+        return MetadataModel.new_plugin_version(metadata, plugin_id, filename, plugin_stage, file_attributes)
+
+    @staticmethod
+    def archive_plugin(plugin_id, plugin_stage):
+        return MetadataModel.archive_plugin(plugin_id, plugin_stage)
+
+    @staticmethod
+    def validate_token(token, plugin_id, plugin_stage):
+        MetadataModel.validate_token(token, plugin_id, plugin_stage)
+
+    @staticmethod
+    def put_records(records):
+        """
+        Write records in batches of 25, retrying unprocessed items. Records
+        are written as is so may omit attributes (e.g. token records) as
+        records created by new_plugin_record.sh do
+        :param records: records to write
+        :type records: iterable of MetadataModel
+        :returns: number of records written
+        :rtype: int
+        """
+
+        connection = MetadataModel._get_connection()  # pylint: disable=protected-access
+        written = 0
+        batch = []
+        for record in records:
+            batch.append(record.serialize(null_check=False))
+            if len(batch) == BATCH_SIZE:
+                written += write_batch(connection, batch)
+                batch = []
+        if batch:
+            written += write_batch(connection, batch)
+        return written
+
+    @staticmethod
+    def get_record(plugin_id, item_version):
+        try:
+            record = MetadataModel.get(plugin_id, item_version)
+        except MetadataModel.DoesNotExist:
+            return None
+        return json.loads(json.dumps(record.attribute_values, cls=ModelEncoder))
+
+    @staticmethod
+    def set_expiry(plugin_id, item_version, expires_at):
+        """
+        Set the time DynamoDB TTL deletes a record after
+        :param expires_at: expiry time (UTC)
+        :type expires_at: datetime
+        """
+
+        MetadataModel(plugin_id, item_version).update(
+            actions=[MetadataModel.expires_at.set(expires_at)], condition=MetadataModel.id.exists()
+        )
+
+    @staticmethod
+    def purge_expired(now=None):  # pylint: disable=unused-argument
+        # Expired records are deleted by DynamoDB TTL
+        return 0
+
+    @staticmethod
+    def delete_records(keys):
+        """
+        Delete records in batches, retrying unprocessed items
+        :param keys: (id, item_version) of the records to delete
+        :type keys: iterable
+        :returns: number of records deleted
+        :rtype: int
+        """
+
+        deleted = 0
+        with MetadataModel.batch_write() as batch:
+            for plugin_id, item_version in keys:
+                batch.delete(MetadataModel(plugin_id, item_version))
+                deleted += 1
+        return deleted
+
+
+def write_batch(connection, items):
+    """
+    Write one batch, retrying unprocessed items
+    """
+
+    written = len(items)
+    while items:
+        data = connection.batch_write_item(put_items=items)
+        items = [request["PutRequest"]["Item"] for request in data.get("UnprocessedItems", {}).get(connection.table_name, [])]
+    return written
+
+
+class RecordStore(abc.ABC):
+    """
+    Plugin metadata stored as JSON records keyed by id and item_version,
+    as in the DynamoDB table. Subclasses provide get, put, delete, partition,
+    scan and all_records
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+
+    def all_version_zeros(self, plugin_stage, qgis_version=None, consistent=False):  # pylint: disable=unused-argument
+        # Records are always read consistently
+        return iter(self.scan(format_item_version(plugin_stage)))
+
+    def changed_since(self, since=None):
+        since = encode({"since": since}).get("since")
+        return (record for record in self.all_records() if not since or record.get("updated_at", "") > since)
+
+    def plugin_version_zero(self, plugin_id, plugin_stage):
+        version_zero = self.get(plugin_id, format_item_version(plugin_stage))
+        if not version_zero:
+            raise plugin_not_found()
+        return version_zero
+
+    def plugin_all_versions(self, plugin_id, plugin_stage):
+        return [
+            record
+            for record in self.partition(plugin_id)
+            if not record["item_version"].startswith("metadata") and (record.get("stage") or "") == plugin_stage
+        ]
+
+    def new_plugin_version(self, metadata, plugin_id, filename, plugin_stage, file_attributes=None):
+        with self._lock:
+            version_zero = self.plugin_version_zero(plugin_id, plugin_stage)
+            updates = version_zero_updates(
+                metadata, version_zero["revisions"], version_zero.get("created_at"), filename, file_attributes
+            )
+            version_zero = self.update(version_zero, updates)
+            get_log().info("VersionZeroUpdated")
+            self.insert_revision(version_zero)
+        get_log().info("RevisionInserted", pluginId=plugin_id, stage=plugin_stage, revision=version_zero["revisions"])
+        return version_zero
+
+    def archive_plugin(self, plugin_id, plugin_stage):
+        with self._lock:
+            version_zero = self.plugin_version_zero(plugin_id, plugin_stage)
+            now = datetime.now(timezone.utc)
+            version_zero = self.update(
+                version_zero, {"ended_at": now, "updated_at": now, "revisions": version_zero["revisions"] + 1}
+            )
+            self.insert_revision(version_zero)
+        get_log().info("RevisionInserted", pluginId=plugin_id, revision=version_zero["revisions"])
+        get_log().info("MetadataStored", metadata=version_zero)
+        return version_zero
+
+    def validate_token(self, token, plugin_id, plugin_stage):
+        record = self.get(plugin_id, format_item_version(plugin_stage, "metadata"))
+        if not record:
+            raise plugin_not_found()
+        if hash_token(token) != record.get("secret"):
+            get_log().error("InvalidToken")
+            raise DataError(403, "Invalid token")
+
+    def put_records(self, records):
+        """
+        Write records as is
+        :param records: records to write
+        :type records: iterable of MetadataModel
+        :returns: number of records written
+        :rtype: int
+        """
+
+        records = [encode(record.attribute_values) for record in records]
+        self.put(records)
+        return len(records)
+
+    def delete_records(self, keys):
+        keys = list(keys)
+        self.delete(keys)
+        return len(keys)
+
+    def get_record(self, plugin_id, item_version):
+        return self.get(plugin_id, item_version)
+
+    def set_expiry(self, plugin_id, item_version, expires_at):
+        with self._lock:
+            record = self.get(plugin_id, item_version)
+            if record:
+                self.update(record, {"expires_at": expires_at})
+
+    def purge_expired(self, now=None):
+        """
+        Delete expired records, as DynamoDB TTL does
+        :returns: number of records deleted
+        :rtype: int
+        """
+
+        now = encode({"now": now or datetime.now(timezone.utc)})["now"]
+        return self.delete_records(
+            (record["id"], record["item_version"]) for record in self.all_records() if record.get("expires_at", now) < now
+        )
+
+    def update(self, record, updates):
+        """
+        Store a record with updated attributes. None values are removed
+        """
+
+        record = encode({**record, **updates})
+        self.put([record])
+        return record
+
+    def insert_revision(self, version_zero):
+        """
+        Store a copy of version zero as the revision it became
+        """
+
+        item_version = format_item_version(version_zero.get("stage") or "", str(version_zero["revisions"]))
+        self.put([{**version_zero, "item_version": item_version}])
+
+    @abc.abstractmethod
+    def get(self, plugin_id, item_version):
+        """
+        Record of a key or None if none is stored
+        """
+
+    @abc.abstractmethod
+    def put(self, records):
+        """
+        Store records, replacing any of the same key
+        """
+
+    @abc.abstractmethod
+    def delete(self, keys):
+        """
+        Delete the records of (id, item_version) keys
+        """
+
+    @abc.abstractmethod
+    def partition(self, plugin_id):
+        """
+        Records of a plugin id in item_version order
+        """
+
+    @abc.abstractmethod
+    def scan(self, item_version):
+        """
+        Records of an item_version across plugins
+        """
+
+    @abc.abstractmethod
+    def all_records(self):
+        """
+        Every record stored
+        """
+
+
+class MemoryStore(RecordStore):
+    """
+    Plugin metadata stored in process memory. For local development,
+    tests and benchmarks. Records are held as JSON so that callers
+    can not modify them
+    """
+
+    def __init__(self):
+        super().__init__()
+        # id -> item_version -> JSON record
+        self.records: defaultdict[str, dict[str, str]] = defaultdict(dict)
+
+    def get(self, plugin_id, item_version):
+        record = self.records.get(plugin_id, {}).get(item_version)
+        return json.loads(record) if record else None
+
+    def put(self, records):
+        with self._lock:
+            for record in records:
+                self.records[record["id"]][record["item_version"]] = json.dumps(record)
+
+    def delete(self, keys):
+        with self._lock:
+            for plugin_id, item_version in keys:
+                self.records.get(plugin_id, {}).pop(item_version, None)
+
+    def partition(self, plugin_id):
+        partition = self.records.get(plugin_id, {})
+        return [json.loads(partition[item_version]) for item_version in sorted(partition)]
+
+    def scan(self, item_version):
+        with self._lock:
+            return [json.loads(partition[item_version]) for partition in self.records.values() if item_version in partition]
+
+    def all_records(self):
+        with self._lock:
+            return [json.loads(record) for partition in self.records.values() for record in partition.values()]
+
+
+class SqliteStore(RecordStore):
+    """
+    Plugin metadata stored in SQLite. For local development and benchmarks
+    """
+
+    def __init__(self, path=":memory:"):
+        import sqlite3  # pylint: disable=import-outside-toplevel
+
+        super().__init__()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS records (
+                id TEXT NOT NULL, item_version TEXT NOT NULL, record TEXT NOT NULL, PRIMARY KEY (id, item_version)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS records_item_version ON records (item_version);
+            """)
+
+    def get(self, plugin_id, item_version):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT record FROM records WHERE id = ? AND item_version = ?", (plugin_id, item_version)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, records):
+        rows = [(record["id"], record["item_version"], json.dumps(record)) for record in records]
+        with self._lock:
+            self._connection.execute("BEGIN")
+            self._connection.executemany("INSERT OR REPLACE INTO records VALUES (?, ?, ?)", rows)
+            self._connection.execute("COMMIT")
+
+    def delete(self, keys):
+        with self._lock:
+            self._connection.execute("BEGIN")
+            self._connection.executemany("DELETE FROM records WHERE id = ? AND item_version = ?", list(keys))
+            self._connection.execute("COMMIT")
+
+    def partition(self, plugin_id):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT record FROM records WHERE id = ? ORDER BY item_version", (plugin_id,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def scan(self, item_version):
+        with self._lock:
+            rows = self._connection.execute("SELECT record FROM records WHERE item_version = ?", (item_version,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def all_records(self):
+        with self._lock:
+            rows = self._connection.execute("SELECT record FROM records").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+class S3ObjectStore:
+    """
+    Plugin files stored in an S3 bucket
+    """
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def put(self, data, object_name, content_disposition=None):
+        aws.s3_put(data, self.bucket, object_name, content_disposition)
+
+    def touch(self, object_name, content_disposition=None):
+        return aws.s3_touch(self.bucket, object_name, content_disposition)
+
+    def exists(self, object_name):
+        return aws.s3_object_exists(self.bucket, object_name)
+
+    def get(self, object_name):
+        return aws.s3_get(self.bucket, object_name)
+
+    def names(self, prefix=""):
+        return aws.s3_list(self.bucket, prefix)
+
+    def delete(self, object_name):
+        aws.s3_delete(self.bucket, object_name)
+
+    def check(self):
+        aws.s3_head_bucket(self.bucket)
+
+
+class MemoryObjectStore:
+    """
+    Plugin files stored in process memory. For local development,
+    tests and benchmarks
+    """
+
+    def __init__(self):
+        # object name -> (data, content disposition, modified epoch seconds)
+        self.objects = {}
+
+    def put(self, data, object_name, content_disposition=None):
+        self.objects[object_name] = (bytes(data), content_disposition, time.time())
+
+    def touch(self, object_name, content_disposition=None):
+        stored = self.objects.get(object_name)
+        if not stored:
+            return False
+        self.objects[object_name] = (stored[0], content_disposition or stored[1], time.time())
+        return True
+
+    def exists(self, object_name):
+        return object_name in self.objects
+
+    def get(self, object_name):
+        return self.objects[object_name][0]
+
+    def names(self, prefix=""):
+        return [(name, stored[2]) for name, stored in list(self.objects.items()) if name.startswith(prefix)]
+
+    def delete(self, object_name):
+        self.objects.pop(object_name, None)
+
+    def check(self):
+        pass
+
+
+class SqliteObjectStore:
+    """
+    Plugin files stored in SQLite. For local development and benchmarks
+    """
+
+    def __init__(self, path=":memory:"):
+        import sqlite3  # pylint: disable=import-outside-toplevel
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS objects (name TEXT PRIMARY KEY, data BLOB NOT NULL, content_disposition TEXT)"
+        )
+
+    def put(self, data, object_name, content_disposition=None):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO objects VALUES (?, ?, ?)", (object_name, bytes(data), content_disposition)
+            )
+
+    def touch(self, object_name, content_disposition=None):
+        # Modification times are not stored. The content disposition is only replaced if given
+        with self._lock:
+            cursor = self._connection.execute(
+                "UPDATE objects SET content_disposition = COALESCE(?, content_disposition) WHERE name = ?",
+                (content_disposition, object_name),
+            )
+        return cursor.rowcount > 0
+
+    def exists(self, object_name):
+        with self._lock:
+            return self._connection.execute("SELECT 1 FROM objects WHERE name = ?", (object_name,)).fetchone() is not None
+
+    def get(self, object_name):
+        with self._lock:
+            row = self._connection.execute("SELECT data FROM objects WHERE name = ?", (object_name,)).fetchone()
+        if not row:
+            raise KeyError(object_name)
+        return row[0]
+
+    def names(self, prefix=""):
+        # Modification times are not stored
+        with self._lock:
+            rows = self._connection.execute("SELECT name FROM objects WHERE substr(name, 1, ?) = ?", (len(prefix), prefix))
+            return [(row[0], None) for row in rows.fetchall()]
+
+    def delete(self, object_name):
+        with self._lock:
+            self._connection.execute("DELETE FROM objects WHERE name = ?", (object_name,))
+
+    def check(self):
+        with self._lock:
+            self._connection.execute("SELECT 1")
+
+
+class FilesystemObjectStore:
+    """
+    Plugin files stored in a directory. For self-hosting, with the
+    files served by the API from disk. An object's content disposition
+    is stored in a file of the same name under DISPOSITION_DIRECTORY
+    """
+
+    DISPOSITION_DIRECTORY = ".content-disposition"
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, object_name):
+        """
+        Path of a stored object
+        :param object_name: object name
+        :type object_name: str
+        :returns: path or None if no object of the name is stored
+        :rtype: str
+        """
+
+        if object_name.split("/", 1)[0] == self.DISPOSITION_DIRECTORY:
+            return None
+        # safe_join rejects names outside of the root (e.g. ../)
+        path = safe_join(self.root, object_name)
+        return path if path and os.path.isfile(path) else None
+
+    def put(self, data, object_name, content_disposition=None):
+        path = safe_join(self.root, object_name)
+        disposition_path = safe_join(self.root, self.DISPOSITION_DIRECTORY, object_name)
+        if not path or not disposition_path or object_name.split("/", 1)[0] == self.DISPOSITION_DIRECTORY:
+            raise ValueError(f"Invalid object name {object_name}")
+        if content_disposition:
+            write_file(disposition_path, content_disposition.encode("utf-8"))
+        elif os.path.isfile(disposition_path):
+            os.remove(disposition_path)
+        write_file(path, data)
+
+    def touch(self, object_name, content_disposition=None):
+        path = self.path(object_name)
+        if not path:
+            return False
+        if content_disposition:
+            write_file(safe_join(self.root, self.DISPOSITION_DIRECTORY, object_name), content_disposition.encode("utf-8"))
+        os.utime(path)
+        return True
+
+    def content_disposition(self, object_name):
+        """
+        Content disposition an object was stored with
+        :returns: content disposition or None if none was given
+        :rtype: str
+        """
+
+        path = safe_join(self.root, self.DISPOSITION_DIRECTORY, object_name)
+        if not path or not os.path.isfile(path):
+            return None
+        with open(path, encoding="utf-8") as disposition_file:
+            return disposition_file.read()
+
+    def exists(self, object_name):
+        return self.path(object_name) is not None
+
+    def get(self, object_name):
+        path = self.path(object_name)
+        if not path:
+            raise KeyError(object_name)
+        with open(path, "rb") as object_file:
+            return object_file.read()
+
+    def names(self, prefix=""):
+        names = []
+        for directory, directories, file_names in os.walk(self.root):
+            if directory == self.root and self.DISPOSITION_DIRECTORY in directories:
+                directories.remove(self.DISPOSITION_DIRECTORY)
+            for file_name in file_names:
+                path = os.path.join(directory, file_name)
+                name = os.path.relpath(path, self.root).replace(os.sep, "/")
+                if name.startswith(prefix):
+                    names.append((name, os.path.getmtime(path)))
+        return names
+
+    def delete(self, object_name):
+        path = self.path(object_name)
+        if path:
+            os.remove(path)
+            disposition_path = safe_join(self.root, self.DISPOSITION_DIRECTORY, object_name)
+            if disposition_path and os.path.isfile(disposition_path):
+                os.remove(disposition_path)
+
+    def check(self):
+        if not os.path.isdir(self.root):
+            raise FileNotFoundError(self.root)
+
+
+def write_file(path, data):
+    """
+    Write a file via a temporary file renamed into place so a partial file is never read
+    """
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as temporary_file:
+        temporary_file.write(data)
+    os.replace(temporary_file.name, path)
+
+
+# (store kind, url) -> store
+_stores: dict[tuple[str, str], Any] = {}
+
+
+def sqlite_path(store_url):
+    """
+    Database path of a sqlite:// url. As per SQLAlchemy,
+    sqlite:///relative/path and sqlite:////absolute/path
+    """
+
+    path = store_url[len(SQLITE_PREFIX) :]
+    return path[1:] if path.startswith("/") else ":memory:"
+
+
+def get_metadata_store(store_url=None):
+    """
+    Return the configured plugin metadata store. Stores are created once per process
+    :param store_url: store to use. Defaults to METADATA_STORE_URL
+    :type store_url: str
+    :returns: the metadata store
+    :rtype: DynamoDBStore | MemoryStore | SqliteStore | read_model.ReadModelStore | snapshot.SnapshotStore
+    """
+
+    store_url = store_url or METADATA_STORE_URL or ""
+    key = ("metadata", store_url)
+    if key not in _stores:
+        if not store_url:
+            _stores[key] = DynamoDBStore()
+        elif store_url == MEMORY_URL:
+            _stores[key] = MemoryStore()
+        elif store_url.startswith(SQLITE_PREFIX):
+            _stores[key] = SqliteStore(sqlite_path(store_url))
+        else:
+            raise ValueError(f"Unsupported metadata store {store_url}")
+        if snapshot.CATALOGUE_SNAPSHOT_PATH:
+            _stores[key] = snapshot.SnapshotStore(
+                _stores[key], snapshot.CATALOGUE_SNAPSHOT_PATH, key=snapshot.CATALOGUE_SNAPSHOT_S3_KEY
+            )
+        # Refreshed from the snapshot, if any, rather than by scanning the store
+        if read_model.READ_MODEL_PATH:
+            _stores[key] = read_model.ReadModelStore(_stores[key], read_model.READ_MODEL_PATH)
+    return _stores[key]
+
+
+def get_object_store(bucket, store_url=None):
+    """
+    Return the configured plugin file store. Stores are created once per process
+    :param bucket: bucket name. Used if no store is configured
+    :type bucket: str
+    :param store_url: store to use. Defaults to OBJECT_STORE_URL
+    :type store_url: str
+    :returns: the object store
+    :rtype: S3ObjectStore | MemoryObjectStore | SqliteObjectStore | FilesystemObjectStore
+    """
+
+    store_url = store_url or OBJECT_STORE_URL or ""
+    key = ("objects", store_url or bucket)
+    if key not in _stores:
+        if not store_url:
+            _stores[key] = S3ObjectStore(bucket)
+        elif store_url == MEMORY_URL:
+            _stores[key] = MemoryObjectStore()
+        elif store_url.startswith(SQLITE_PREFIX):
+            _stores[key] = SqliteObjectStore(sqlite_path(store_url))
+        elif store_url.startswith(FILE_PREFIX):
+            _stores[key] = FilesystemObjectStore(store_url[len(FILE_PREFIX) :])
+        else:
+            raise ValueError(f"Unsupported object store {store_url}")
+    return _stores[key]
@@ -0,0 +1,129 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Lightweight per request timing spans. Span durations are accumulated
+    per name in flask.g, logged with the request's RequestMetadata and
+    optionally returned in a Server-Timing response header.
+
+    Every DynamoDB request is timed as dynamodb.<operation> via PynamoDB's
+    signals. Other work is timed with the span context manager or timed decorator.
+
+"""
+
+import functools
+import os
+import time
+from contextlib import contextmanager
+from typing import Any
+
+from flask import g, has_app_context
+from pynamodb.signals import post_dynamodb_send, pre_dynamodb_send
+
+# Return span durations in a Server-Timing response header
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "").lower() == "true"
+
+# req_uuid -> start time of DynamoDB requests in flight
+_dynamodb_starts: dict[Any, float] = {}
+
+
+def record(name, duration):
+    """
+    Add a span's duration to the request's spans. Outside a request it is discarded
+    :param name: span name (e.g. s3.put)
+    :type name: str
+    :param duration: duration (ms)
+    :type duration: float
+    """
+
+    if not has_app_context():
+        return
+    if "spans" not in g:
+        g.spans = {}
+    span_totals = g.spans.setdefault(name, [0, 0.0])
+    span_totals[0] += 1
+    span_totals[1] += duration
+
+
+@contextmanager
+def span(name):
+    """
+    Time the enclosed block
+    :param name: span name
+    :type name: str
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, (time.perf_counter() - start) * 1000)
+
+
+def timed(name):
+    """
+    Decorator timing each call of the function
+    :param name: span name
+    :type name: str
+    :returns: decorator
+    :rtype: function
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def spans():
+    """
+    The request's spans
+    :returns: span name -> count and total duration (ms)
+    :rtype: dict
+    """
+
+    if not has_app_context() or "spans" not in g:
+        return {}
+    return {name: {"count": count, "duration": round(duration, 3)} for name, (count, duration) in g.spans.items()}
+
+
+def server_timing(total):
+    """
+    Format the request's spans as a Server-Timing header value
+    :param total: total request duration (ms)
+    :type total: float
+    :returns: Server-Timing header value
+    :rtype: str
+    """
+
+    metrics = [f'{name};desc="{value["count"]}";dur={value["duration"]}' for name, value in spans().items()]
+    metrics.append(f"total;dur={round(total, 3)}")
+    return ", ".join(metrics)
+
+
+# pylint: disable=unused-argument
+def dynamodb_started(sender, operation_name, table_name, req_uuid):
+    _dynamodb_starts[req_uuid] = time.perf_counter()
+
+
+def dynamodb_finished(sender, operation_name, table_name, req_uuid):
+    start = _dynamodb_starts.pop(req_uuid, None)
+    if start is not None:
+        record(f"dynamodb.{operation_name}", (time.perf_counter() - start) * 1000)
+
+
+pre_dynamodb_send.connect(dynamodb_started)
+post_dynamodb_send.connect(dynamodb_finished)
@@ -0,0 +1,80 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Worker running jobs queued by the API (see jobs.py).
+
+    On AWS the worker is a Lambda function triggered by the SQS job queue.
+    Locally it can poll the configured queue:
+        python -m src.plugin.worker [--once]
+
+"""
+
+import argparse
+
+from src.plugin import jobs
+from src.plugin.log import get_log
+
+
+def handler(event, context):  # pylint: disable=unused-argument
+    """
+    Lambda entry point for SQS events. Failed messages are reported so
+    that only they are returned to the queue to be retried
+    :param event: SQS event
+    :type event: dict
+    :returns: SQS partial batch response
+    :rtype: dict
+    """
+
+    queue = jobs.get_queue()
+    failures = []
+    for record in event["Records"]:
+        if not jobs.run_job(queue, record["body"]):
+            failures.append({"itemIdentifier": record["messageId"]})
+    return {"batchItemFailures": failures}
+
+
+def poll(queue, once=False, wait_time=5):
+    """
+    Receive and run jobs from the queue. Succeeded jobs are removed from the
+    queue, failed jobs become visible again after the visibility timeout
+    :param queue: job queue
+    :type queue: jobs.SqsQueue | jobs.SqliteQueue
+    :param once: stop once the queue is empty
+    :type once: bool
+    :param wait_time: seconds to wait for new messages
+    :type wait_time: int
+    """
+
+    while True:
+        messages = queue.receive_messages(max_messages=10, wait_time=0 if once else wait_time)
+        if not messages and once:
+            return
+        for message in messages:
+            if jobs.run_job(queue, message["Body"]):
+                queue.delete_message(message["ReceiptHandle"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run queued plugin repository jobs")
+    parser.add_argument("--queue-url", default=jobs.JOB_QUEUE_URL, help="Defaults to the JOB_QUEUE_URL env var")
+    parser.add_argument("--once", action="store_true", help="Exit once the queue is empty")
+    args = parser.parse_args()
+
+    queue = jobs.get_queue(args.queue_url)
+    if not queue:
+        parser.error("No job queue configured")
+    get_log().info("WorkerStarted")
+    poll(queue, args.once)
+
+
+if __name__ == "__main__":
+    main()
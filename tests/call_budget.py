@@ -0,0 +1,136 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Test-time counting of the DynamoDB and S3 calls, and the items they
+    read, made by each flask request, for asserting per endpoint budgets.
+
+"""
+
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from unittest import mock
+
+from botocore.client import BaseClient
+from flask import g, has_app_context
+
+from src.plugin.capacity import READ_OPERATIONS, WRITE_OPERATIONS
+
+# Made once per connection rather than by requests
+SETUP_OPERATIONS = ("DescribeTable",)
+
+
+@dataclass
+class Budget:
+    """
+    Most backend calls an endpoint may make per request
+    """
+
+    dynamodb_reads: int = 0
+    dynamodb_writes: int = 0
+    s3_calls: int = 0
+    items_read: int | None = None
+
+
+class CallLog:
+    """
+    Backend calls by request id
+    """
+
+    def __init__(self):
+        self.requests = defaultdict(list)
+
+    def record(self, service, operation, items):
+        request_id = g.get("request_id") if has_app_context() else None
+        self.requests[request_id].append((service, operation, items))
+
+    def last_request(self):
+        """
+        Calls of the most recent request
+        """
+
+        request_ids = [request_id for request_id in self.requests if request_id]
+        return self.requests[request_ids[-1]] if request_ids else []
+
+
+def counts(calls):
+    """
+    Count calls against the budget's categories
+    :param calls: (service, operation, items read)
+    :type calls: list
+    :returns: counts by Budget field
+    :rtype: dict
+    """
+
+    return {
+        "dynamodb_reads": sum(1 for service, operation, _ in calls if service == "dynamodb" and operation in READ_OPERATIONS),
+        "dynamodb_writes": sum(
+            1 for service, operation, _ in calls if service == "dynamodb" and operation in WRITE_OPERATIONS
+        ),
+        "s3_calls": sum(1 for service, _, _ in calls if service == "s3"),
+        "items_read": sum(items for _, _, items in calls),
+    }
+
+
+def assert_within_budget(calls, budget):
+    """
+    Fail if the calls exceed the budget
+    :param calls: (service, operation, items read)
+    :type calls: list
+    :param budget: budget
+    :type budget: Budget
+    """
+
+    made = counts(calls)
+    over = {
+        field: f"{made[field]} > {limit}" for field, limit in vars(budget).items() if limit is not None and made[field] > limit
+    }
+    assert not over, f"Over budget {over}. Calls: {[operation for _, operation, _ in calls]}"
+
+
+def items_read(operation, response):
+    """
+    Number of items a DynamoDB response returned
+    """
+
+    if "Items" in response:
+        return len(response["Items"])
+    if operation == "GetItem":
+        return int("Item" in response)
+    if operation == "BatchGetItem":
+        return sum(len(items) for items in response.get("Responses", {}).values())
+    return 0
+
+
+@contextmanager
+def count_backend_calls():
+    """
+    Count the AWS calls made by all clients (boto3 and PynamoDB)
+    :returns: the calls made by each request
+    :rtype: CallLog
+    """
+
+    call_log = CallLog()
+    make_api_call = getattr(BaseClient, "_make_api_call")
+
+    def counting(client, operation, api_params):
+        response = {}
+        try:
+            response = make_api_call(client, operation, api_params)
+            return response
+        finally:
+            # Failed calls (e.g. HeadObject of a missing object) count too
+            if operation not in SETUP_OPERATIONS:
+                call_log.record(client.meta.service_model.service_name, operation, items_read(operation, response))
+
+    with mock.patch.object(BaseClient, "_make_api_call", counting):
+        yield call_log
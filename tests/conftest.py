@@ -13,11 +13,27 @@
 
 # pylint: disable=redefined-outer-name
 
-from datetime import datetime
+from datetime import datetime, timezone
 
 import pytest
-
-from src.plugin import api
+from moto import mock_aws
+
+from src.plugin import api, aws, storage
+from src.plugin.metadata_model import MetadataModel, hash_token
+
+METADATA = {
+    "general": {
+        "name": "test",
+        "qgisMinimumVersion": "3.0",
+        "description": "this is a test",
+        "about": "testing",
+        "version": "1.1.0",
+        "author": "me",
+        "email": "me@theinternet.com",
+        "repository": "https://github.com/test",
+        "tags": "",
+    }
+}
 
 
 @pytest.fixture(name="api_fixture")
@@ -65,3 +81,66 @@ def api_version():
     """
 
     return "v1"
+
+
+@pytest.fixture(name="metadata_fixture")
+def fixture_metadata():
+    """
+    metadata.txt of a plugin as parsed by plugin_parser
+    """
+
+    return METADATA
+
+
+@pytest.fixture(name="metadata_store", params=["memory://", "sqlite://"])
+def fixture_metadata_store(request):
+    """
+    Memory and SQLite metadata stores holding a plugin with one revision
+    and a plugin that has not been uploaded yet
+    """
+
+    store = storage.MemoryStore() if request.param == "memory://" else storage.SqliteStore()
+    created_at = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    store.put_records(
+        [
+            MetadataModel(
+                id="test_plugin",
+                item_version="000000",
+                revisions=1,
+                created_at=created_at,
+                updated_at=created_at,
+                name="test",
+                qgis_minimum_version="3.0",
+                qgis_maximum_version="3.99",
+                description="this is a test",
+                about="testing",
+                version="1.0.0",
+                author_name="me",
+                email="me@theinternet.com",
+                repository="https://github.com/test",
+                file_name="abc",
+            ),
+            MetadataModel(id="test_plugin", item_version="metadata", secret=hash_token("secret")),
+            MetadataModel(id="new_plugin", item_version="000000dev", stage="dev", revisions=0),
+        ]
+    )
+    return store
+
+
+@pytest.fixture(name="s3_bucket_fixture")
+def fixture_s3_bucket(monkeypatch):
+    """
+    Fixture yielding the name of a bucket in S3 mocked with moto
+    """
+
+    monkeypatch.delenv("AWS_ENDPOINT_URL", raising=False)
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "ap-southeast-2")
+    aws.discard_clients()
+    try:
+        with mock_aws():
+            aws.get_client("s3").create_bucket(
+                Bucket="test-bucket", CreateBucketConfiguration={"LocationConstraint": "ap-southeast-2"}
+            )
+            yield "test-bucket"
+    finally:
+        aws.discard_clients()
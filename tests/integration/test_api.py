@@ -13,12 +13,23 @@
 
 # pylint: disable=E0237
 
+import hashlib
+import json
+import os
+import subprocess
+import sys
 import tempfile
+import tracemalloc
 import zipfile
 from contextlib import contextmanager
+from unittest.mock import ANY
 
+from botocore.stub import Stubber
 from flask import appcontext_pushed, g
 
+from benchmarks import catalogue
+from src.plugin import aws, jobs, storage
+
 
 @contextmanager
 def set_global(app, plugin_id=None, request_id=None):
@@ -254,3 +265,507 @@ def test_upload_data(mocker, api_fixture, api_version, now_fixture):
                 "updated_at": now.strftime("%Y-%m-%dT%H:%M:%S.%f"),
                 "version": "0.0.0",
             }
+
+
+def zipped_plugin(plugin_id="test_plugin"):
+    """
+    Return the bytes of a minimal valid plugin zipfile
+    """
+
+    with tempfile.SpooledTemporaryFile() as tmp:
+        with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr(f"{plugin_id}/{plugin_id}.py", "hello word")
+            archive.writestr(
+                f"{plugin_id}/metadata.txt",
+                "[general]\nname=test plugin\nemail=test@linz.govt.nz\nauthor=Tester\n"
+                "description=Plugin for testing the repository\nversion=0.1\nabout=this is a test\n"
+                "repository=github/test\nqgisMinimumVersion=4.0.0",
+            )
+        tmp.seek(0)
+        return tmp.read()
+
+
+def test_upload_corrupt_deflate(mocker, api_fixture, api_version):
+    """
+    Only the zipfile's central directory and metadata.txt are checked on upload,
+    so corrupt compressed data in other entries fails the upload's job
+    """
+
+    app = api_fixture.app
+    queue = jobs.SqliteQueue()
+    zipped_bytes = zipped_plugin()
+    # The first entry's deflate data follows its 30 byte local header and name
+    start = 30 + len("test_plugin/test_plugin.py")
+    corrupted = zipped_bytes[:start] + b"\xff" + zipped_bytes[start + 1 :]
+
+    mocker.patch("src.plugin.jobs.get_queue", return_value=queue)
+    mocker.patch("src.plugin.metadata_model.MetadataModel.validate_token")
+    mocker.patch("src.plugin.aws.s3_touch", return_value=False)
+    s3_put = mocker.patch("src.plugin.aws.s3_put")
+    mocker.patch("src.plugin.aws.s3_get", return_value=corrupted)
+    mocker.patch("src.plugin.metadata_model.MetadataModel.new_plugin_version", return_value={})
+
+    with set_global(app, 1234, 1234):
+        with app.test_client() as test_client:
+            result = test_client.post(
+                f"/{api_version}/plugin/test_plugin", data=corrupted, headers={"Authorization": "Bearer 12345"}
+            )
+    assert result.status_code == 201
+    s3_put.assert_called_once()
+    assert not jobs.run_job(queue, queue.receive_messages()[0]["Body"])
+
+
+def test_upload_content_addressed(mocker, api_fixture, api_version):
+    """
+    New plugin content is stored under the SHA-256 of the archive
+    and the checksum is recorded against version zero
+    """
+
+    app = api_fixture.app
+    zipped_bytes = zipped_plugin()
+    checksum = hashlib.sha256(zipped_bytes).hexdigest()
+
+    mocker.patch("src.plugin.metadata_model.MetadataModel.validate_token")
+    mocker.patch("src.plugin.aws.s3_touch", return_value=False)
+    s3_put = mocker.patch("src.plugin.aws.s3_put")
+    new_version = mocker.patch("src.plugin.metadata_model.MetadataModel.new_plugin_version", return_value={})
+
+    with set_global(app, 1234, 1234):
+        with app.test_client() as test_client:
+            result = test_client.post(
+                f"/{api_version}/plugin/test_plugin", data=zipped_bytes, headers={"Authorization": "Bearer 12345"}
+            )
+    assert result.status_code == 201
+    s3_put.assert_called_once_with(zipped_bytes, api_fixture.repo_bucket_name, checksum, "test_plugin")
+    assert new_version.call_args[0][2] == checksum
+    assert new_version.call_args[0][4]["file_sha256"] == checksum
+
+
+def test_upload_duplicate_content_skips_put(mocker, api_fixture, api_version):
+    """
+    Uploading content that is already stored does not put it to S3 again,
+    but touches it so it is not cleaned up before its record is written
+    """
+
+    app = api_fixture.app
+    zipped_bytes = zipped_plugin()
+
+    mocker.patch("src.plugin.metadata_model.MetadataModel.validate_token")
+    s3_touch = mocker.patch("src.plugin.aws.s3_touch", return_value=True)
+    s3_put = mocker.patch("src.plugin.aws.s3_put")
+    new_version = mocker.patch("src.plugin.metadata_model.MetadataModel.new_plugin_version", return_value={})
+
+    with set_global(app, 1234, 1234):
+        with app.test_client() as test_client:
+            result = test_client.post(
+                f"/{api_version}/plugin/test_plugin", data=zipped_bytes, headers={"Authorization": "Bearer 12345"}
+            )
+    assert result.status_code == 201
+    s3_put.assert_not_called()
+    s3_touch.assert_called_once_with(api_fixture.repo_bucket_name, hashlib.sha256(zipped_bytes).hexdigest(), "test_plugin")
+    assert new_version.call_args[0][2] == hashlib.sha256(zipped_bytes).hexdigest()
+
+
+def test_upload_idempotent_replay(mocker, api_fixture, api_version):
+    """
+    A retried upload with the same Idempotency-Key returns the stored
+    response without storing the plugin or revising it again
+    """
+
+    app = api_fixture.app
+    zipped_bytes = zipped_plugin()
+
+    record = mocker.Mock()
+    record.status = 201
+    record.body = '{"id": "test_plugin", "revisions": 1}'
+    mocker.patch("src.plugin.metadata_model.MetadataModel.validate_token")
+    mocker.patch("src.plugin.idempotency.stored_response", return_value=record)
+    s3_put = mocker.patch("src.plugin.aws.s3_put")
+    new_version = mocker.patch("src.plugin.metadata_model.MetadataModel.new_plugin_version")
+
+    with set_global(app, 1234, 1234):
+        with app.test_client() as test_client:
+            result = test_client.post(
+                f"/{api_version}/plugin/test_plugin",
+                data=zipped_bytes,
+                headers={"Authorization": "Bearer 12345", "Idempotency-Key": "build-42"},
+            )
+    assert result.status_code == 201
+    assert result.get_json() == {"id": "test_plugin", "revisions": 1}
+    assert result.headers["Idempotent-Replayed"] == "true"
+    s3_put.assert_not_called()
+    new_version.assert_not_called()
+
+
+def test_upload_idempotent_first_request(mocker, api_fixture, api_version):
+    """
+    The outcome of the first request made with a key is stored
+    """
+
+    app = api_fixture.app
+    zipped_bytes = zipped_plugin()
+
+    mocker.patch("src.plugin.metadata_model.MetadataModel.validate_token")
+    mocker.patch("src.plugin.idempotency.stored_response", return_value=None)
+    claim = mocker.patch("src.plugin.idempotency.claim", return_value=(mocker.sentinel.claim, None))
+    store_response = mocker.patch("src.plugin.idempotency.store_response")
+    release = mocker.patch("src.plugin.idempotency.release")
+    mocker.patch("src.plugin.aws.s3_touch", return_value=True)
+    mocker.patch("src.plugin.metadata_model.MetadataModel.new_plugin_version", return_value={"id": "test_plugin"})
+
+    with set_global(app, 1234, 1234):
+        with app.test_client() as test_client:
+            result = test_client.post(
+                f"/{api_version}/plugin/test_plugin",
+                data=zipped_bytes,
+                headers={"Authorization": "Bearer 12345", "Idempotency-Key": "build-42"},
+            )
+    assert result.status_code == 201
+    claim.assert_called_once_with("build-42", "test_plugin", "", mocker.ANY)
+    store_response.assert_called_once_with(mocker.sentinel.claim, mocker.ANY, 201)
+    assert json.loads(store_response.call_args[0][1]) == {"id": "test_plugin"}
+    release.assert_not_called()
+
+
+def test_upload_idempotent_failed_request(mocker, api_fixture, api_version):
+    """
+    The key claimed by a request that fails is released so it can be retried
+    """
+
+    app = api_fixture.app
+
+    mocker.patch("src.plugin.metadata_model.MetadataModel.validate_token")
+    mocker.patch("src.plugin.idempotency.stored_response", return_value=None)
+    mocker.patch("src.plugin.idempotency.claim", return_value=(mocker.sentinel.claim, None))
+    store_response = mocker.patch("src.plugin.idempotency.store_response")
+    release = mocker.patch("src.plugin.idempotency.release")
+
+    with set_global(app, 1234, 1234):
+        with app.test_client() as test_client:
+            result = test_client.post(
+                f"/{api_version}/plugin/test_plugin",
+                data=b"not a zipfile",
+                headers={"Authorization": "Bearer 12345", "Idempotency-Key": "build-42"},
+            )
+            # The claim does not outlive its request
+            test_client.get(f"/{api_version}/ping")
+    assert result.status_code == 400
+    store_response.assert_not_called()
+    release.assert_called_once_with(mocker.sentinel.claim)
+
+
+def test_upload_too_large(api_fixture, api_version, monkeypatch):
+    """
+    Request bodies over the maximum upload size are rejected before being read
+    """
+
+    app = api_fixture.app
+    monkeypatch.setitem(app.config, "MAX_CONTENT_LENGTH", 1024)
+
+    with set_global(app, 1234, 1234):
+        with app.test_client() as test_client:
+            result = test_client.post(
+                f"/{api_version}/plugin/test_plugin", data=b"0" * 2048, headers={"Authorization": "Bearer 12345"}
+            )
+    assert result.status_code == 413
+
+
+def test_upload_respond_async(mocker, api_fixture, api_version):
+    """
+    With a job queue configured, "Prefer: respond-async" returns 202
+    and a job status resource that can be polled
+    """
+
+    app = api_fixture.app
+    queue = jobs.SqliteQueue()
+    zipped_bytes = zipped_plugin()
+
+    mocker.patch("src.plugin.jobs.get_queue", return_value=queue)
+    mocker.patch("src.plugin.metadata_model.MetadataModel.validate_token")
+    mocker.patch("src.plugin.aws.s3_touch", return_value=True)
+    mocker.patch("src.plugin.metadata_model.MetadataModel.new_plugin_version", return_value={"id": "test_plugin"})
+
+    with set_global(app, 1234, 1234):
+        with app.test_client() as test_client:
+            result = test_client.post(
+                f"/{api_version}/plugin/test_plugin",
+                data=zipped_bytes,
+                headers={"Authorization": "Bearer 12345", "Prefer": "respond-async"},
+            )
+            assert result.status_code == 202
+            assert result.json["plugin"] == {"id": "test_plugin"}
+            assert result.headers["Location"] == result.json["status_url"]
+
+            status = test_client.get(result.headers["Location"])
+    assert status.status_code == 200
+    assert status.json["type"] == "verify_upload"
+    assert status.json["status"] == "queued"
+    message = json.loads(queue.receive_messages()[0]["Body"])
+    assert message["params"]["file_name"] == hashlib.sha256(zipped_bytes).hexdigest()
+
+
+def test_upload_queue_failure(mocker, api_fixture, api_version):
+    """
+    The upload is stored even if its job can not be queued, so a retry does not revise it again
+    """
+
+    app = api_fixture.app
+    queue = mocker.Mock()
+    queue.send_message.side_effect = RuntimeError("queue unavailable")
+
+    mocker.patch("src.plugin.jobs.get_queue", return_value=queue)
+    mocker.patch("src.plugin.metadata_model.MetadataModel.validate_token")
+    mocker.patch("src.plugin.aws.s3_touch", return_value=True)
+    mocker.patch("src.plugin.metadata_model.MetadataModel.new_plugin_version", return_value={"id": "test_plugin"})
+
+    with set_global(app, 1234, 1234):
+        with app.test_client() as test_client:
+            result = test_client.post(
+                f"/{api_version}/plugin/test_plugin",
+                data=zipped_plugin(),
+                headers={"Authorization": "Bearer 12345", "Prefer": "respond-async"},
+            )
+    assert result.status_code == 201
+    assert result.json == {"id": "test_plugin"}
+
+
+def test_get_job_not_found(mocker, api_fixture, api_version):
+    """
+    Unknown jobs are reported as not found
+    """
+
+    app = api_fixture.app
+    mocker.patch("src.plugin.jobs.get_queue", return_value=jobs.SqliteQueue())
+
+    with app.test_client() as test_client:
+        result = test_client.get(f"/{api_version}/job/unknown")
+    assert result.status_code == 404
+    assert result.json["message"] == "Job Not Found"
+
+
+def test_cold_start_imports():
+    """
+    Dependencies only some endpoints need are not imported at cold start
+    """
+
+    deferred = ["boto3", "packaging", "sqlite3", "cProfile", "pstats", "tracemalloc", "src.plugin.sampler"]
+    result = subprocess.run(
+        [sys.executable, "-c", f"import sys, src.plugin.api; print([m for m in {deferred} if m in sys.modules])"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip() == "[]"
+
+
+def test_sampler_started_by_first_request(mocker, monkeypatch, api_fixture, api_version):
+    """
+    Stack sampling starts with the first request rather than at import
+    """
+
+    app = api_fixture.app
+    monkeypatch.setenv("SAMPLER_HZ", "5")
+    start = mocker.patch("src.plugin.sampler.start")
+    api_fixture.start_sampler.cache_clear()
+    try:
+        with app.test_client() as test_client:
+            test_client.get(f"/{api_version}/plugins.xml?qgis=3")
+            test_client.get(f"/{api_version}/plugins.xml?qgis=3")
+    finally:
+        api_fixture.start_sampler.cache_clear()
+    start.assert_called_once_with()
+
+
+def test_cold_start_warm_up_failure():
+    """
+    The API starts even if warming up its AWS clients fails
+    """
+
+    code = (
+        "from src.plugin import aws\n"
+        "def warm_up(*args, **kwargs):\n"
+        "    raise RuntimeError('unreachable')\n"
+        "aws.warm_up = warm_up\n"
+        "import src.plugin.api\n"
+        "print(src.plugin.api.app.name)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], env={**os.environ, "AWS_WARM_UP": "connect"}, capture_output=True, text=True, check=True
+    )
+    assert result.stdout.splitlines()[-1] == "src.plugin.api"
+    assert "AwsWarmUpFailed" in result.stdout
+
+
+def test_upload_server_timing(mocker, api_fixture, api_version):
+    """
+    Span durations are returned in the Server-Timing header when enabled
+    """
+
+    app = api_fixture.app
+    mocker.patch("src.plugin.timing.SERVER_TIMING", True)
+    mocker.patch("src.plugin.metadata_model.MetadataModel.validate_token")
+    mocker.patch("src.plugin.aws.s3_touch", return_value=False)
+    mocker.patch("src.plugin.aws.s3_put")
+    mocker.patch("src.plugin.metadata_model.MetadataModel.new_plugin_version", return_value={})
+
+    with set_global(app, 1234, 1234):
+        with app.test_client() as test_client:
+            result = test_client.post(
+                f"/{api_version}/plugin/test_plugin", data=zipped_plugin(), headers={"Authorization": "Bearer 12345"}
+            )
+    assert result.status_code == 201
+    assert 'zip.inspect;desc="1";dur=' in result.headers["Server-Timing"]
+    assert "total;dur=" in result.headers["Server-Timing"]
+
+
+def test_request_profiled(mocker, api_fixture, api_version):
+    """
+    Requests carrying the profile secret are profiled and the profile uploaded
+    """
+
+    app = api_fixture.app
+    mocker.patch("src.plugin.profiler.PROFILE_SECRET", "secret")
+    mocker.patch("src.plugin.profiler.PROFILE_UPLOAD", True)
+    mocker.patch("src.plugin.profiler.PROFILE_BUCKET", "private")
+
+    # Only the profile is put, to the private bucket and without a Content-Disposition
+    with Stubber(aws.get_client("s3")) as stubber:
+        stubber.add_response("put_object", {}, {"Body": ANY, "Bucket": "private", "Key": ANY})
+        with app.test_client() as test_client:
+            result = test_client.get(f"/{api_version}/plugins.xml?qgis=3", headers={"X-Profile": "secret"})
+        stubber.assert_no_pending_responses()
+    assert result.headers["X-Profile-Key"].startswith("diagnostics/profiles/")
+
+
+def test_request_profiled_no_private_bucket(mocker, api_fixture, api_version):
+    """
+    Profiles are not uploaded if no private bucket is configured
+    """
+
+    app = api_fixture.app
+    mocker.patch("src.plugin.profiler.PROFILE_SECRET", "secret")
+    mocker.patch("src.plugin.profiler.PROFILE_UPLOAD", True)
+    mocker.patch("src.plugin.profiler.PROFILE_BUCKET", None)
+    s3_put = mocker.patch("src.plugin.aws.s3_put")
+
+    with app.test_client() as test_client:
+        result = test_client.get(f"/{api_version}/plugins.xml?qgis=3", headers={"X-Profile": "secret"})
+    assert "X-Profile-Key" not in result.headers
+    s3_put.assert_not_called()
+
+
+def test_request_not_profiled(mocker, api_fixture, api_version):
+    """
+    Requests without the profile secret are not profiled
+    """
+
+    app = api_fixture.app
+    mocker.patch("src.plugin.profiler.PROFILE_SECRET", "secret")
+    start = mocker.patch("src.plugin.profiler.start")
+
+    with app.test_client() as test_client:
+        result = test_client.get(f"/{api_version}/plugins.xml?qgis=3", headers={"X-Profile": "wrong"})
+    assert "X-Profile-Key" not in result.headers
+    start.assert_not_called()
+
+
+def test_request_memory_traced(mocker, api_fixture, api_version):
+    """
+    Peak traced memory and top allocation sites are logged when enabled
+    """
+
+    app = api_fixture.app
+    mocker.patch("src.plugin.api.MEMORY_TRACE", True)
+    log = mocker.patch("src.plugin.api.get_log")
+
+    try:
+        with app.test_client() as test_client:
+            test_client.get(f"/{api_version}/plugins.xml?qgis=3")
+    finally:
+        tracemalloc.stop()
+    request_metadata = [call for call in log.return_value.info.call_args_list if call.args[0] == "RequestMetadata"]
+    usage = request_metadata[0].kwargs["memory"]
+    assert usage["peak"] > 0
+    assert usage["maxRss"] > 0
+    assert len(usage["top"]) <= 5
+
+
+def test_memory_storage(mocker, api_fixture, api_version):
+    """
+    The API runs without AWS against the in memory stores
+    """
+
+    app = api_fixture.app
+    mocker.patch("src.plugin.storage.METADATA_STORE_URL", "memory://")
+    mocker.patch("src.plugin.storage.OBJECT_STORE_URL", "memory://")
+    mocker.patch.dict(storage._stores, clear=True)  # pylint: disable=protected-access
+    catalogue.seed(1)
+    headers = {"Authorization": f"Bearer {catalogue.TOKEN}"}
+    data = catalogue.plugin_zip("plugin_000000", "1.1.0")
+
+    with app.test_client() as test_client:
+        result = test_client.post(f"/{api_version}/plugin/plugin_000000", data=data, headers=headers)
+        assert result.status_code == 201, result.json
+        assert result.json["version"] == "1.1.0"
+        assert storage.get_object_store(None).get(result.json["file_name"]) == data
+        revisions = test_client.get(f"/{api_version}/plugin/plugin_000000/revision").json
+        assert [revision["item_version"] for revision in revisions] == ["000000", "000001", "000002"]
+        assert b"<version>1.1.0</version>" in test_client.get(f"/{api_version}/plugins.xml").data
+        result = test_client.delete(f"/{api_version}/plugin/plugin_000000", headers=headers)
+        assert "ended_at" in result.json
+
+
+def test_download(mocker, tmp_path, api_fixture, api_version):
+    """
+    Plugin files stored on the filesystem are downloaded from the API
+    with immutable caching, conditional and Range requests
+    """
+
+    app = api_fixture.app
+    mocker.patch("src.plugin.storage.OBJECT_STORE_URL", f"file://{tmp_path}")
+    mocker.patch.dict(storage._stores, clear=True)  # pylint: disable=protected-access
+    data = catalogue.plugin_zip("test_plugin")
+    file_name = hashlib.sha256(data).hexdigest()
+    storage.get_object_store(None).put(data, file_name, "test_plugin")
+
+    with app.test_client() as test_client:
+        result = test_client.get(f"/{api_version}/download/{file_name}")
+        assert result.data == data
+        assert result.mimetype == "application/zip"
+        assert result.headers["Content-Disposition"] == "attachment; filename=test_plugin.zip"
+        assert result.headers["ETag"] == f'"{file_name}"'
+        assert result.cache_control.immutable
+        assert result.cache_control.max_age == 365 * 24 * 60 * 60
+        result = test_client.get(f"/{api_version}/download/{file_name}", headers={"Range": "bytes=0-9"})
+        assert result.status_code == 206
+        assert result.data == data[:10]
+        result = test_client.get(f"/{api_version}/download/{file_name}", headers={"If-None-Match": f'"{file_name}"'})
+        assert result.status_code == 304
+        assert test_client.get(f"/{api_version}/download/missing").status_code == 404
+
+
+def test_download_not_served_from_s3(api_fixture, api_version):
+    """
+    Plugin files in S3 are not downloaded from the API
+    """
+
+    with api_fixture.app.test_client() as test_client:
+        result = test_client.get(f"/{api_version}/download/abc")
+    assert result.status_code == 404
+    assert result.json["message"] == "Plugin File Not Found"
+
+
+def test_qgis_plugin_xml_download_url(mocker, tmp_path, api_fixture, api_version):
+    """
+    With plugin files on the filesystem plugins.xml links to the API's downloads
+    """
+
+    app = api_fixture.app
+    mocker.patch("src.plugin.storage.OBJECT_STORE_URL", f"file://{tmp_path}")
+    mocker.patch("src.plugin.storage.METADATA_STORE_URL", "memory://")
+    mocker.patch.dict(storage._stores, clear=True)  # pylint: disable=protected-access
+    catalogue.seed(1)
+
+    with app.test_client() as test_client:
+        result = test_client.get(f"/{api_version}/plugins.xml")
+    assert b"<download_url>http://localhost/v1/download/plugin_000000.zip</download_url>" in result.data
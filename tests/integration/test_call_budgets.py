@@ -0,0 +1,74 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Per endpoint budgets of backend calls, made against local stand-ins,
+    to catch changes adding calls (e.g. N+1 queries) to hot endpoints.
+
+"""
+
+import pytest
+
+from benchmarks import catalogue
+from benchmarks.stand_ins import local_aws
+from tests.call_budget import Budget, assert_within_budget, count_backend_calls
+
+PLUGINS = 20
+TOKEN_HEADERS = {"Authorization": f"Bearer {catalogue.TOKEN}"}
+
+# name -> (method, path, budget) when warm
+BUDGETS = {
+    "plugins.xml": ("GET", "/v1/plugins.xml?qgis=3.34", Budget(dynamodb_reads=1, items_read=PLUGINS)),
+    "plugin": ("GET", "/v1/plugin/plugin_000000", Budget(dynamodb_reads=1, items_read=1)),
+    "revisions": ("GET", "/v1/plugin/plugin_000000/revision", Budget(dynamodb_reads=1)),
+    "plugins": ("GET", "/v1/plugin", Budget(dynamodb_reads=1, items_read=PLUGINS)),
+    # Token and version zero are separate queries of the plugin's partition
+    "upload": ("POST", "/v1/plugin/plugin_000000", Budget(dynamodb_reads=2, dynamodb_writes=2, s3_calls=2)),
+    "archive": ("DELETE", "/v1/plugin/plugin_000000", Budget(dynamodb_reads=2, dynamodb_writes=2)),
+}
+
+
+@pytest.fixture(name="local_client")
+def fixture_local_client(api_fixture):
+    """
+    Flask test client for the API backed by a seeded local stand-in
+    """
+
+    with local_aws():
+        catalogue.seed(PLUGINS)
+        yield api_fixture.app.test_client()
+
+
+@pytest.mark.parametrize("name", BUDGETS)
+def test_call_budget(local_client, name):
+    """
+    Warm requests make no more backend calls than their endpoint's budget
+    """
+
+    method, path, budget = BUDGETS[name]
+    data = catalogue.plugin_zip("plugin_000000", "2.0.0") if method == "POST" else None
+    local_client.get("/v1/plugins.xml")
+
+    with count_backend_calls() as call_log:
+        result = local_client.open(path, method=method, data=data, headers=TOKEN_HEADERS)
+    assert result.status_code < 300, result.json
+    assert_within_budget(call_log.last_request(), budget)
+
+
+def test_call_budget_exceeded(local_client):
+    """
+    Calls over budget fail the test
+    """
+
+    with count_backend_calls() as call_log:
+        local_client.get("/v1/plugin")
+    with pytest.raises(AssertionError, match="dynamodb_reads"):
+        assert_within_budget(call_log.last_request(), Budget(dynamodb_reads=0))
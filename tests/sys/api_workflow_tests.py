@@ -45,7 +45,7 @@ def test_post_plugin(config_fixture, stage=""):
     response = post_plugin(config_fixture["base_url"], stage, config_fixture["plugin_id"], plugin, config_fixture["secret"])
     content = json.loads(response.content)
 
-    exclude_from_checks = ["created_at", "file_name", "updated_at"]
+    exclude_from_checks = ["created_at", "file_name", "file_sha256", "manifest", "updated_at"]
     assert response.status_code == 201, response.content
     assert ignore_keys(content, exclude_from_checks) == ignore_keys(
         {
@@ -70,6 +70,8 @@ def test_post_plugin(config_fixture, stage=""):
     )
     assert content["created_at"] is not None
     assert content["file_name"] is not None
+    assert content["file_sha256"] == content["file_name"]
+    assert content["manifest"]["root_dir"] == config_fixture["plugin_id"]
     assert content["updated_at"] is not None
 
 
@@ -87,7 +89,7 @@ def test_get_plugins(config_fixture, stage=""):
 
     # check the test plugin is reported via the endpoint as expected
     assert response.status_code == 200, response.content
-    assert ignore_keys(test_plugin, ["created_at", "file_name", "updated_at"]) == ignore_keys(
+    assert ignore_keys(test_plugin, ["created_at", "file_name", "file_sha256", "manifest", "updated_at"]) == ignore_keys(
         {
             "about": "this is a test",
             "author_name": "Yossarian",
@@ -123,7 +125,7 @@ def test_revision_plugin(config_fixture, stage=""):
     response = post_plugin(config_fixture["base_url"], stage, config_fixture["plugin_id"], plugin, config_fixture["secret"])
     content = json.loads(response.content)
 
-    assert ignore_keys(content, ["created_at", "file_name", "updated_at"]) == ignore_keys(
+    assert ignore_keys(content, ["created_at", "file_name", "file_sha256", "manifest", "updated_at"]) == ignore_keys(
         {
             "about": "this is a test",
             "author_name": "Yossarian",
@@ -161,7 +163,8 @@ def test_retire_plugin(config_fixture, stage=""):
 
     # version 00000 should be enddated.
     assert content["ended_at"] is not None
-    assert ignore_keys(content, ["created_at", "file_name", "updated_at", "ended_at"]) == ignore_keys(
+    exclude_from_checks = ["created_at", "file_name", "file_sha256", "manifest", "updated_at", "ended_at"]
+    assert ignore_keys(content, exclude_from_checks) == ignore_keys(
         {
             "about": "this is a test",
             "author_name": "Yossarian",
@@ -211,7 +214,7 @@ def test_revive_plugin(config_fixture, stage=""):
 
     # check the test plugin is reported via the endpoint as expected
     assert get_response.status_code == 200
-    assert ignore_keys(test_plugin, ["created_at", "file_name", "updated_at"]) == ignore_keys(
+    assert ignore_keys(test_plugin, ["created_at", "file_name", "file_sha256", "manifest", "updated_at"]) == ignore_keys(
         {
             "about": "this is a test",
             "author_name": "Yossarian",
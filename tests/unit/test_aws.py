@@ -1 +1,126 @@
-# There are no tests for this module at this stage
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+"""
+
+import pytest
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber
+
+from src.plugin import aws
+from src.plugin.metadata_model import MetadataModel
+
+
+def test_s3_object_exists(mocker):
+    """
+    HeadObject succeeding means the object is stored
+    """
+
+    mocker.patch("botocore.client.BaseClient._make_api_call", return_value={"ContentLength": 10})
+    assert aws.s3_object_exists("dummy", "e3b0c44298fc1c149afbf4c8996fb924") is True
+
+
+def test_s3_object_exists_not_found(mocker):
+    """
+    A 404 from HeadObject means the object is not stored
+    """
+
+    mocker.patch(
+        "botocore.client.BaseClient._make_api_call",
+        side_effect=ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject"),
+    )
+    assert aws.s3_object_exists("dummy", "e3b0c44298fc1c149afbf4c8996fb924") is False
+
+
+def test_s3_object_exists_other_error(mocker):
+    """
+    Errors other than not found are not swallowed
+    """
+
+    mocker.patch(
+        "botocore.client.BaseClient._make_api_call",
+        side_effect=ClientError({"Error": {"Code": "403", "Message": "Forbidden"}}, "HeadObject"),
+    )
+    with pytest.raises(ClientError):
+        aws.s3_object_exists("dummy", "e3b0c44298fc1c149afbf4c8996fb924")
+
+
+def test_s3_put_without_content_disposition():
+    """
+    Objects other than plugin files are put without a Content-Disposition
+    """
+
+    with Stubber(aws.get_client("s3")) as stubber:
+        stubber.add_response("put_object", {}, {"Body": b"data", "Bucket": "dummy", "Key": "catalogue.snapshot"})
+        aws.s3_put(b"data", "dummy", "catalogue.snapshot")
+        stubber.assert_no_pending_responses()
+
+
+def test_s3_touch(s3_bucket_fixture):
+    """
+    Touching an object copies it onto itself with its content disposition
+    """
+
+    aws.s3_put(b"plugin", s3_bucket_fixture, "abc")
+    modified = aws.get_client("s3").head_object(Bucket=s3_bucket_fixture, Key="abc")["LastModified"]
+    assert aws.s3_touch(s3_bucket_fixture, "abc", "test_plugin")
+    head = aws.get_client("s3").head_object(Bucket=s3_bucket_fixture, Key="abc")
+    assert head["ContentDisposition"] == "test_plugin"
+    assert head["LastModified"] >= modified
+    assert aws.s3_get(s3_bucket_fixture, "abc") == b"plugin"
+    assert aws.s3_touch(s3_bucket_fixture, "abc")
+    assert aws.get_client("s3").head_object(Bucket=s3_bucket_fixture, Key="abc")["ContentDisposition"] == "test_plugin"
+    assert not aws.s3_touch(s3_bucket_fixture, "missing")
+
+
+def test_get_client_shared():
+    """
+    Clients are created once and reused with the configured settings
+    """
+
+    client = aws.get_client("s3")
+    assert aws.get_client("s3") is client
+    assert client.meta.config.max_pool_connections == aws.CLIENT_SETTINGS["max_pool_connections"]
+    assert client.meta.config.connect_timeout == aws.CLIENT_SETTINGS["connect_timeout"]
+    assert client.meta.config.read_timeout == aws.CLIENT_SETTINGS["read_timeout"]
+    assert client.meta.config.retries["mode"] == aws.CLIENT_SETTINGS["retry_mode"]
+
+
+@pytest.fixture(name="model_connection")
+def fixture_model_connection(mocker):
+    """
+    Connections created while warming up are discarded after the test
+    """
+
+    mocker.patch.object(MetadataModel, "_connection", None)
+    mocker.patch.object(MetadataModel.Meta, "region", "ap-southeast-2")
+
+
+@pytest.mark.usefixtures("model_connection")
+def test_warm_up_connect(mocker):
+    """
+    Warming up with connect opens connections to DynamoDB and S3
+    """
+
+    api_call = mocker.patch("botocore.client.BaseClient._make_api_call", return_value={"Table": {}})
+    aws.warm_up("dummy", [MetadataModel], connect=True)
+    assert sorted(call.args[0] for call in api_call.call_args_list) == ["DescribeTable", "HeadBucket"]
+
+
+@pytest.mark.usefixtures("model_connection")
+def test_warm_up_clients_only(mocker):
+    """
+    Warming up without connect makes no requests
+    """
+
+    api_call = mocker.patch("botocore.client.BaseClient._make_api_call")
+    aws.warm_up("dummy", [MetadataModel])
+    api_call.assert_not_called()
@@ -0,0 +1,117 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+"""
+
+import random
+import zipfile
+from io import BytesIO
+
+from benchmarks import catalogue, load, replay, run, synthetic
+from src.plugin import plugin_parser
+
+
+def test_parse_thresholds():
+    """
+    A bare fraction is the default threshold
+    """
+
+    assert run.parse_thresholds(["0.1", "xml_body=0.5"]) == {None: 0.1, "xml_body": 0.5}
+
+
+def test_compare_regression():
+    """
+    Benchmarks slower than their baseline by more than their threshold are regressions
+    """
+
+    baseline = {"xml_body[10]": {"median_ms": 10.0}, "upload[10]": {"median_ms": 10.0}}
+    results = {"xml_body[10]": {"median_ms": 14.0}, "upload[10]": {"median_ms": 14.0}, "new[10]": {"median_ms": 1.0}}
+    comparisons = {comparison["benchmark"]: comparison for comparison in run.compare(results, baseline, {"xml_body": 0.5})}
+    assert not comparisons["xml_body[10]"]["regression"]
+    assert comparisons["upload[10]"]["regression"]
+    assert "new[10]" not in comparisons
+
+
+def test_plugin_zip_valid():
+    """
+    Benchmark plugin files pass the plugin parser
+    """
+
+    with zipfile.ZipFile(BytesIO(catalogue.plugin_zip("benchmark_plugin"))) as plugin_zipfile:
+        manifest, metadata = plugin_parser.inspect_plugin(plugin_zipfile)
+    assert manifest["root_dir"] == "benchmark_plugin"
+    assert metadata["general"]["version"] == "1.0.0"
+
+
+def test_synthetic_plugin_file():
+    """
+    Synthetic plugin files pass the plugin parser and follow the version bounds
+    """
+
+    rng = random.Random(0)
+    distributions = synthetic.Distributions(zip_median=1024)
+    metadata = synthetic.plugin_metadata(rng, "synthetic_plugin", 12, distributions)
+    with zipfile.ZipFile(BytesIO(synthetic.plugin_file(rng, "synthetic_plugin", metadata, distributions))) as plugin_zipfile:
+        manifest, parsed = plugin_parser.inspect_plugin(plugin_zipfile)
+    assert manifest["file_count"] == distributions.files + 1
+    assert parsed["general"]["version"] == "1.2.0"
+    assert metadata["qgisMinimumVersion"] in dict(synthetic.QGIS_MINIMUM_VERSIONS)
+    assert metadata["qgisMaximumVersion"].split(".")[0] == metadata["qgisMinimumVersion"].split(".")[0]
+
+
+def test_load_summary():
+    """
+    Latency percentiles and error rates are reported per route
+    """
+
+    samples = {"xml": [(float(latency), 200) for latency in range(1, 101)] + [(500.0, 500)], "list": [(5.0, 404)]}
+    report = load.summarise(samples, elapsed=10)
+    assert report["xml"]["requests"] == 101
+    assert report["xml"]["p50_ms"] == 51.0
+    assert report["xml"]["p99_ms"] == 100.0
+    assert report["xml"]["max_ms"] == 500.0
+    assert report["xml"]["error_rate"] == round(1 / 101, 4)
+    assert report["list"]["client_error_rate"] == 1.0
+    assert report["list"]["throughput_rps"] == 0.1
+
+
+def test_replay_schedule():
+    """
+    Recorded read traffic is scheduled relative to its first request with plugin ids mapped
+    """
+
+    lines = [
+        '2024-01-01T00:00:01Z {"msg": "RequestMetadata", "time": 2000, "uri": "/v1/plugin/real", "method": "GET"}',
+        '{"msg": "RequestMetadata", "time": 1000, "uri": "/v1/plugins.xml", "method": "GET", "args": {"qgis": "3.34"}}',
+        '{"msg": "RequestMetadata", "time": 1500, "uri": "/v1/plugin/real", "method": "POST"}',
+        '{"msg": "CorrelationId", "time": 1000}',
+    ]
+    traffic = replay.read_traffic(replay.parse_records(lines))
+    requests = list(replay.schedule(traffic, speed=2, plugin_map=replay.PluginMap(["synthetic_000000"])))
+    assert requests == [
+        (0.0, "/v1/plugins.xml", ("GET", "/v1/plugins.xml?qgis=3.34", None, {})),
+        (0.5, "/v1/plugin/<plugin_id>", ("GET", "/v1/plugin/synthetic_000000", None, {})),
+    ]
+
+
+def test_replay_sampled():
+    """
+    Sampled events are replayed as the number of requests they represent
+    """
+
+    lines = [
+        '{"msg": "RequestMetadata", "time": 1000, "uri": "/v1/plugins.xml", "method": "GET", "sampleRate": 0.25}',
+        '{"msg": "RequestMetadata", "time": 2000, "uri": "/v1/plugins.xml", "method": "GET", "sampleRate": 0.5}',
+        '{"msg": "RequestMetadata", "time": 3000, "uri": "/v1/plugins.xml", "method": "GET", "sampleRate": 0.4}',
+        '{"msg": "RequestMetadata", "time": 3500, "uri": "/v1/plugins.xml", "method": "GET", "sampleRate": 0.4}',
+    ]
+    traffic = replay.read_traffic(replay.parse_records(lines))
+    assert [request[0] for request in traffic] == [1000, 1250, 1500, 1750, 2000, 2500, 3000, 3250, 3500, 3500, 3500]
@@ -0,0 +1,43 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+"""
+
+import botocore.session
+from flask import Flask
+
+from src.plugin import capacity
+
+
+def test_capacity_units():
+    """
+    Capacity units are summed for single and batch operations
+    """
+
+    assert capacity.capacity_units({"TableName": "table", "CapacityUnits": 0.5}) == 0.5
+    assert capacity.capacity_units([{"CapacityUnits": 1.0}, {"CapacityUnits": 2.0}]) == 3.0
+
+
+def test_consumed_capacity(mocker):
+    """
+    Units consumed by responses are accumulated as read or write request units
+    """
+
+    client = botocore.session.get_session().create_client("dynamodb", region_name="ap-southeast-2")
+    capacity.register(mocker.Mock(client=client))
+    with Flask(__name__).app_context():
+        for operation_name, units in (("Query", 0.5), ("Scan", 2.0), ("UpdateItem", 1.0), ("DescribeTable", 1.0)):
+            client.meta.events.emit(
+                f"after-call.dynamodb.{operation_name}",
+                parsed={"ConsumedCapacity": {"CapacityUnits": units}},
+                model=client.meta.service_model.operation_model(operation_name),
+            )
+        assert capacity.consumed_capacity() == {"read": 2.5, "write": 1.0}
@@ -0,0 +1,191 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pynamodb.exceptions import DeleteError, PutError
+
+from src.plugin import idempotency
+from src.plugin.error import DataError
+from src.plugin.idempotency import IdempotencyModel
+
+
+def stored_record(req_hash, expires_at=None):
+    """
+    Return a stored idempotency record
+    """
+
+    return IdempotencyModel(
+        "idempotency#test_plugin",
+        "key#",
+        request_hash=req_hash,
+        status=201,
+        body='{"id": "test_plugin"}',
+        expires_at=expires_at or datetime.now(timezone.utc) + timedelta(hours=1),
+    )
+
+
+def test_idempotency_key_not_supplied():
+    """
+    No header means the request is not idempotent
+    """
+
+    assert idempotency.idempotency_key({}) is None
+
+
+def test_idempotency_key_too_long():
+    """
+    Keys over the maximum length are rejected
+    """
+
+    with pytest.raises(DataError) as error:
+        idempotency.idempotency_key({"Idempotency-Key": "k" * 256})
+    assert "Invalid Idempotency-Key" in str(error.value)
+
+
+def test_request_hash():
+    """
+    Requests differing in any part hash differently
+    """
+
+    original = idempotency.request_hash("POST", "/v1/plugin/test", "", b"zip")
+    assert original == idempotency.request_hash("POST", "/v1/plugin/test", "", b"zip")
+    assert original != idempotency.request_hash("POST", "/v1/plugin/test", "dev", b"zip")
+    assert original != idempotency.request_hash("POST", "/v1/plugin/test", "", b"other zip")
+
+
+def test_stored_response_unused_key(mocker):
+    """
+    A key that has not been used returns no stored response
+    """
+
+    mocker.patch("src.plugin.idempotency.IdempotencyModel.get", side_effect=IdempotencyModel.DoesNotExist)
+    assert idempotency.stored_response("key", "test_plugin", "", "abc") is None
+
+
+def test_stored_response(mocker):
+    """
+    A key used with the same request returns the stored response
+    """
+
+    mocker.patch("src.plugin.idempotency.IdempotencyModel.get", return_value=stored_record("abc"))
+    record = idempotency.stored_response("key", "test_plugin", "", "abc")
+    assert record.status == 201
+    assert record.body == '{"id": "test_plugin"}'
+
+
+def test_stored_response_expired(mocker):
+    """
+    Expired records not yet removed by TTL are ignored
+    """
+
+    expired = stored_record("abc", datetime.now(timezone.utc) - timedelta(seconds=1))
+    mocker.patch("src.plugin.idempotency.IdempotencyModel.get", return_value=expired)
+    assert idempotency.stored_response("key", "test_plugin", "", "abc") is None
+
+
+def test_stored_response_different_request(mocker):
+    """
+    Reusing a key for a different request is an error
+    """
+
+    mocker.patch("src.plugin.idempotency.IdempotencyModel.get", return_value=stored_record("abc"))
+    with pytest.raises(DataError) as error:
+        idempotency.stored_response("key", "test_plugin", "", "def")
+    assert error.value.http_code == 422
+
+
+def test_stored_response_in_progress(mocker):
+    """
+    A duplicate of a request still being processed is refused
+    """
+
+    in_progress = stored_record("abc")
+    in_progress.status = idempotency.IN_PROGRESS
+    mocker.patch("src.plugin.idempotency.IdempotencyModel.get", return_value=in_progress)
+    with pytest.raises(DataError) as error:
+        idempotency.stored_response("key", "test_plugin", "", "abc")
+    assert error.value.http_code == 409
+
+
+def test_claim(mocker):
+    """
+    An unused key is claimed with an in progress record
+    """
+
+    save = mocker.patch("src.plugin.idempotency.IdempotencyModel.save")
+    claim, stored = idempotency.claim("key", "test_plugin", "", "abc")
+    save.assert_called_once()
+    assert stored is None
+    assert (claim.id, claim.item_version, claim.status) == ("idempotency#test_plugin", "key#", idempotency.IN_PROGRESS)
+
+
+def test_claim_concurrent_completed(mocker):
+    """
+    Losing the race to claim a key to a request that has completed replays its outcome
+    """
+
+    mocker.patch("src.plugin.idempotency.IdempotencyModel.save", side_effect=PutError("exists"))
+    mocker.patch("src.plugin.idempotency.IdempotencyModel.get", return_value=stored_record("abc"))
+    claim, stored = idempotency.claim("key", "test_plugin", "", "abc")
+    assert claim is None
+    assert stored.status == 201
+
+
+def test_claim_concurrent_in_progress(mocker):
+    """
+    Losing the race to claim a key to a request still in progress is a conflict
+    """
+
+    in_progress = stored_record("abc")
+    in_progress.status = idempotency.IN_PROGRESS
+    mocker.patch("src.plugin.idempotency.IdempotencyModel.save", side_effect=PutError("exists"))
+    mocker.patch("src.plugin.idempotency.IdempotencyModel.get", return_value=in_progress)
+    with pytest.raises(DataError) as error:
+        idempotency.claim("key", "test_plugin", "", "abc")
+    assert error.value.http_code == 409
+
+
+def test_store_response(mocker):
+    """
+    The outcome replaces the claim
+    """
+
+    save = mocker.patch("src.plugin.idempotency.IdempotencyModel.save")
+    claim = stored_record("abc")
+    claim.status = idempotency.IN_PROGRESS
+    idempotency.store_response(claim, '{"id": "test_plugin"}', 201)
+    save.assert_called_once()
+    assert (claim.status, claim.body) == (201, '{"id": "test_plugin"}')
+    assert claim.expires_at > datetime.now(timezone.utc) + timedelta(seconds=idempotency.IDEMPOTENCY_TTL - 60)
+
+
+def test_store_response_concurrent(mocker):
+    """
+    Losing the race to store an outcome is not an error
+    """
+
+    save = mocker.patch("src.plugin.idempotency.IdempotencyModel.save", side_effect=PutError("exists"))
+    idempotency.store_response(stored_record("abc"), "{}", 201)
+    save.assert_called_once()
+
+
+def test_release(mocker):
+    """
+    Releasing a claim deletes it. Failures are logged, not raised
+    """
+
+    delete = mocker.patch("src.plugin.idempotency.IdempotencyModel.delete", side_effect=DeleteError("gone"))
+    idempotency.release(stored_record("abc"))
+    delete.assert_called_once()
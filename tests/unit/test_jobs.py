@@ -0,0 +1,141 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+"""
+
+import json
+import zipfile
+from io import BytesIO
+
+import pytest
+
+from src.plugin import jobs, worker
+
+
+@pytest.fixture(name="queue_fixture")
+def fixture_queue():
+    """
+    In memory job queue with a test job registered
+    """
+
+    calls = []
+
+    @jobs.job_handler("test_job")
+    def test_job(**params):
+        if params.get("fail"):
+            raise ValueError("failed on purpose")
+        calls.append(params)
+
+    yield jobs.SqliteQueue(), calls
+    del jobs.JOB_HANDLERS["test_job"]
+
+
+def test_get_queue_not_configured():
+    """
+    No queue is used unless one is configured
+    """
+
+    assert jobs.get_queue() is None
+
+
+def test_get_queue():
+    """
+    Queues are created from their url once per process
+    """
+
+    assert isinstance(jobs.get_queue("sqlite://"), jobs.SqliteQueue)
+    assert jobs.get_queue("sqlite://") is jobs.get_queue("sqlite://")
+    assert isinstance(jobs.get_queue("https://sqs.ap-southeast-2.amazonaws.com/1/jobs"), jobs.SqsQueue)
+
+
+def test_sqlite_queue_visibility(queue_fixture):
+    """
+    Received messages are hidden from other receivers until deleted or timed out
+    """
+
+    queue, _ = queue_fixture
+    queue.send_message("body")
+    messages = queue.receive_messages(max_messages=10)
+    assert [message["Body"] for message in messages] == ["body"]
+    assert queue.receive_messages() == []
+
+    queue.visibility_timeout = 0
+    queue.delete_message(messages[0]["ReceiptHandle"])
+    assert queue.receive_messages() == []
+
+
+def test_enqueue_and_run(queue_fixture):
+    """
+    A queued job is run by the worker and its status recorded
+    """
+
+    queue, calls = queue_fixture
+    job = jobs.enqueue(queue, "test_job", "test_plugin", "dev", value=1)
+    assert queue.get_status(job["id"])["status"] == jobs.QUEUED
+
+    worker.poll(queue, once=True)
+    assert calls == [{"value": 1}]
+    status = queue.get_status(job["id"])
+    assert status["status"] == jobs.SUCCEEDED
+    assert status["plugin_id"] == "test_plugin"
+    assert status["stage"] == "dev"
+    assert queue.receive_messages() == []
+
+
+def test_run_failed_job(queue_fixture):
+    """
+    A failed job records its error and is left on the queue to be retried
+    """
+
+    queue, _ = queue_fixture
+    queue.visibility_timeout = 0
+    job = jobs.enqueue(queue, "test_job", fail=True)
+
+    message = queue.receive_messages()[0]
+    assert jobs.run_job(queue, message["Body"]) is False
+    status = queue.get_status(job["id"])
+    assert status["status"] == jobs.FAILED
+    assert status["error"] == "failed on purpose"
+    assert len(queue.receive_messages()) == 1
+
+
+def test_worker_handler(queue_fixture, mocker):
+    """
+    The Lambda handler reports failed messages so only they are retried
+    """
+
+    queue, _ = queue_fixture
+    mocker.patch("src.plugin.jobs.get_queue", return_value=queue)
+    event = {
+        "Records": [
+            {"messageId": "1", "body": json.dumps({"id": "a", "type": "test_job", "params": {}})},
+            {"messageId": "2", "body": json.dumps({"id": "b", "type": "test_job", "params": {"fail": True}})},
+        ]
+    }
+    assert worker.handler(event, None) == {"batchItemFailures": [{"itemIdentifier": "2"}]}
+
+
+def test_verify_upload(mocker):
+    """
+    The CRC of every entry of the stored plugin file is checked
+    """
+
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        archive.writestr("plugin/metadata.txt", "[general]\nname=plugin")
+        archive.writestr("plugin/testplugin.py", "print(hello word)")
+    s3_get = mocker.patch("src.plugin.aws.s3_get", return_value=buffer.getvalue())
+    jobs.verify_upload("bucket", "file")
+    s3_get.assert_called_once_with("bucket", "file")
+
+    s3_get.return_value = buffer.getvalue().replace(b"print(hello word)", b"print(hello wor!)")
+    with pytest.raises(ValueError):
+        jobs.verify_upload("bucket", "file")
@@ -0,0 +1,86 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+"""
+
+import pytest
+import structlog
+from flask import Flask
+
+from src.plugin import log
+
+
+def test_sample_events_dropped(mocker):
+    """
+    Sampled events are dropped for requests not sampled
+    """
+
+    mocker.patch("src.plugin.log.LOG_SAMPLE_RATE", 0)
+    with pytest.raises(structlog.DropEvent):
+        log.sample_events(structlog.get_logger(), "info", {"event": "RequestMetadata"})
+
+
+def test_sample_events_rate_recorded(mocker):
+    """
+    Sampled events that are kept record the rate they were sampled at
+    """
+
+    mocker.patch("src.plugin.log.LOG_SAMPLE_RATE", 0.5)
+    mocker.patch("src.plugin.log.random.random", return_value=0.1)
+    with Flask(__name__).app_context():
+        event_dict = log.sample_events(structlog.get_logger(), "info", {"event": "RequestMetadata"})
+    assert event_dict == {"event": "RequestMetadata", "sampleRate": 0.5}
+
+
+def test_sample_events_errors_kept(mocker):
+    """
+    Errors and events not sampled are always kept
+    """
+
+    mocker.patch("src.plugin.log.LOG_SAMPLE_RATE", 0)
+    assert log.sample_events(structlog.get_logger(), "error", {"event": "RequestMetadata"}) == {"event": "RequestMetadata"}
+    assert log.sample_events(structlog.get_logger(), "info", {"event": "PluginUploaded"}) == {"event": "PluginUploaded"}
+
+
+def test_add_default_keys():
+    """
+    Events are output in the pinojs format
+    """
+
+    event_dict = log.add_default_keys(structlog.get_logger(), "info", {"event": "Test"})
+    assert event_dict["level"] == 30
+    assert event_dict["msg"] == "Test"
+    assert event_dict["v"] == 1
+    assert isinstance(event_dict["time"], int)
+    assert "event" not in event_dict
+
+
+def test_serialize():
+    """
+    Events are rendered as compact JSON
+    """
+
+    assert log.serialize({"msg": "Test", "level": 30}) == '{"msg":"Test","level":30}'
+
+
+def test_read_events():
+    """
+    Events are read from exported log lines, with or without a prefix
+    """
+
+    lines = [
+        '{"msg": "StackSamples", "stacks": {"a": 1}}',
+        '2024-01-01T00:00:00Z {"msg": "StackSamples", "stacks": {"b": 2}}',
+        '{"msg": "RequestMetadata"}',
+        "START RequestId: 1",
+        "not json {",
+    ]
+    assert [event["stacks"] for event in log.read_events(lines, "StackSamples")] == [{"a": 1}, {"b": 2}]
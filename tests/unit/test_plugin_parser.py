@@ -11,8 +11,11 @@
 ################################################################################
 """
 
+import os
+import struct
 import tempfile
 import zipfile
+from io import BytesIO
 
 import pytest
 
@@ -85,3 +88,216 @@ def test_metadata_contents():
     assert result["general"]["name"] == "plugin"
     assert result["general"]["qgisMinimumVersion"] == "4.0"
     assert result["general"]["version"] == "0.1"
+
+
+def test_metadata_contents_not_interpolated():
+    """
+    Percent signs in metadata free text are returned verbatim
+    """
+    with tempfile.TemporaryFile() as tmp:
+        with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("plugin/metadata.txt", "[general]\nname=plugin\nabout=100% faster %(name)s")
+            result = plugin_parser.metadata_contents(archive, "plugin/metadata.txt")
+    assert result["general"]["about"] == "100% faster %(name)s"
+
+
+def test_inspect_plugin():
+    """
+    Test the manifest built from the zipfile's central directory
+    """
+
+    with tempfile.SpooledTemporaryFile() as tmp:
+        with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("plugin/metadata.txt", "[general]\nname=plugin\nicon=icons/icon.png")
+            archive.writestr("plugin/testplugin.py", "print(hello word)" * 100)
+            archive.writestr("plugin/icons/icon.png", "png")
+            manifest, metadata = plugin_parser.inspect_plugin(archive)
+            infolist = archive.infolist()
+    assert metadata["general"]["name"] == "plugin"
+    assert manifest == {
+        "root_dir": "plugin",
+        "metadata_path": "plugin/metadata.txt",
+        "file_count": 3,
+        "compressed_size": sum(info.compress_size for info in infolist),
+        "uncompressed_size": sum(info.file_size for info in infolist),
+        "icon_path": "plugin/icons/icon.png",
+    }
+
+
+def test_inspect_plugin_missing_icon():
+    """
+    An icon referenced by metadata.txt but absent from the zipfile is not recorded
+    """
+
+    with tempfile.SpooledTemporaryFile() as tmp:
+        with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("plugin/metadata.txt", "[general]\nname=plugin\nicon=icon.png")
+            manifest, _ = plugin_parser.inspect_plugin(archive)
+    assert manifest["icon_path"] is None
+
+
+def test_verify_crc():
+    """
+    Entries whose content does not match their CRC are reported
+    """
+
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        archive.writestr("plugin/metadata.txt", "[general]\nname=plugin")
+        archive.writestr("plugin/testplugin.py", "print(hello word)")
+    with zipfile.ZipFile(buffer) as archive:
+        assert plugin_parser.verify_crc(archive, archive.infolist(), plugin_parser.LIMITS)
+    corrupted = buffer.getvalue().replace(b"print(hello word)", b"print(hello wor!)")
+
+    with zipfile.ZipFile(BytesIO(corrupted)) as archive:
+        assert not plugin_parser.verify_crc(archive, archive.infolist(), plugin_parser.LIMITS)
+
+
+def corrupt_deflate(data, name):
+    """
+    Make the deflate data of a zipfile entry invalid, leaving its headers intact
+    """
+
+    with zipfile.ZipFile(BytesIO(data)) as archive:
+        info = archive.getinfo(name)
+    # Local file header: 30 bytes, then the name and extra field lengths at 26 and 28
+    name_length, extra_length = struct.unpack("<HH", data[info.header_offset + 26 : info.header_offset + 30])
+    start = info.header_offset + 30 + name_length + extra_length
+    # A final block of the reserved type 3 is invalid
+    return data[:start] + b"\xff" + data[start + 1 :]
+
+
+def test_verify_crc_corrupt_deflate():
+    """
+    Entries whose compressed data is corrupt are reported, not raised
+    """
+
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("plugin/metadata.txt", "[general]\nname=plugin")
+        archive.writestr("plugin/testplugin.py", "print(hello word)\n" * 100)
+    corrupted = corrupt_deflate(buffer.getvalue(), "plugin/testplugin.py")
+
+    with zipfile.ZipFile(BytesIO(corrupted)) as archive:
+        assert not plugin_parser.verify_crc(archive, archive.infolist(), plugin_parser.LIMITS)
+
+
+def test_inspect_plugin_corrupt_entry():
+    """
+    Only metadata.txt is decompressed when inspecting a plugin,
+    so corrupt data in other entries is left to verify_crc
+    """
+
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("plugin/metadata.txt", "[general]\nname=plugin")
+        archive.writestr("plugin/testplugin.py", "print(hello word)\n" * 100)
+    corrupted = corrupt_deflate(buffer.getvalue(), "plugin/testplugin.py")
+
+    with zipfile.ZipFile(BytesIO(corrupted)) as archive:
+        manifest, metadata = plugin_parser.inspect_plugin(archive)
+    assert manifest["file_count"] == 2
+    assert metadata["general"]["name"] == "plugin"
+
+
+def test_inspect_plugin_corrupt_metadata():
+    """
+    A corrupt metadata.txt is a data error
+    """
+
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("plugin/metadata.txt", "[general]\nname=plugin\n" * 10)
+    corrupted = corrupt_deflate(buffer.getvalue(), "plugin/metadata.txt")
+
+    with zipfile.ZipFile(BytesIO(corrupted)) as archive:
+        with pytest.raises(DataError) as error:
+            plugin_parser.inspect_plugin(archive)
+    assert "corrupt" in str(error.value)
+
+
+def test_inspect_plugin_no_md():
+    """
+    Missing metadata.txt is reported before root dir errors
+    """
+
+    with tempfile.SpooledTemporaryFile() as tmp:
+        with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("plugin/testplugin.py", "print(hello word)")
+            archive.writestr("other/testplugin.py", "print(hello word)")
+            with pytest.raises(DataError) as error:
+                plugin_parser.inspect_plugin(archive)
+    assert "No metadata.txt file found in plugin directory" in str(error.value)
+
+
+def pathological_zipfile(entries):
+    """
+    Build an in memory zipfile from (name, data) pairs
+    """
+
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("plugin/metadata.txt", "[general]\nname=plugin")
+        for name, data in entries:
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return zipfile.ZipFile(buffer)
+
+
+def test_inspect_plugin_too_many_entries():
+    """
+    Zipfiles with more entries than allowed are rejected
+    """
+
+    archive = pathological_zipfile((f"plugin/{i}.py", "") for i in range(20))
+    with pytest.raises(DataError) as error:
+        plugin_parser.inspect_plugin(archive, limits={"max_entries": 10})
+    assert "Plugin file contains too many files" in str(error.value)
+
+
+def test_inspect_plugin_compression_ratio():
+    """
+    A highly compressed entry (zip bomb) is rejected before it is decompressed
+    """
+
+    archive = pathological_zipfile([("plugin/bomb.bin", b"\0" * (8 * 1024 * 1024))])
+    with pytest.raises(DataError) as error:
+        plugin_parser.inspect_plugin(archive)
+    assert "plugin/bomb.bin exceeds the maximum compression ratio" in str(error.value)
+
+
+def test_inspect_plugin_uncompressed_size():
+    """
+    Zipfiles whose total uncompressed size is over the limit are rejected
+    """
+
+    archive = pathological_zipfile((f"plugin/{i}.bin", os.urandom(1024)) for i in range(10))
+    with pytest.raises(DataError) as error:
+        plugin_parser.inspect_plugin(archive, limits={"max_uncompressed_size": 5 * 1024})
+    assert "Plugin file exceeds the maximum uncompressed size" in str(error.value)
+
+
+def test_inspect_plugin_metadata_size():
+    """
+    Oversized metadata.txt files are rejected
+    """
+
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("plugin/metadata.txt", "[general]\nname=plugin\nabout=" + "a" * 2048)
+    with zipfile.ZipFile(buffer) as archive:
+        with pytest.raises(DataError) as error:
+            plugin_parser.inspect_plugin(archive, limits={"max_metadata_size": 1024})
+    assert "metadata.txt exceeds the maximum size" in str(error.value)
+
+
+def test_read_entry_capped():
+    """
+    Reads stop once the byte cap is exceeded, whatever the central directory claims
+    """
+
+    archive = pathological_zipfile([("plugin/data.bin", os.urandom(4 * plugin_parser.READ_CHUNK_SIZE))])
+    chunks = plugin_parser.read_entry(archive, "plugin/data.bin", plugin_parser.READ_CHUNK_SIZE)
+    assert len(next(chunks)) == plugin_parser.READ_CHUNK_SIZE
+    with pytest.raises(DataError):
+        next(chunks)
@@ -171,3 +171,12 @@ def test_generate_xml_body_filter_revisions_eq_zero(mocker):
 
     result = plugin_xml.generate_xml_body(repo_bucket_name, aws_region, "0.0.0", plugin_stage)
     assert result == expected.encode()
+
+
+def test_generate_download_url_served_by_api():
+    """
+    Downloads served by the API are linked to from its base url
+    """
+
+    result = plugin_xml.generate_download_url("test", "ap-southeast-2", "abc", "https://plugins.example.com/v1/download")
+    assert result == "https://plugins.example.com/v1/download/abc"
@@ -0,0 +1,187 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from src.plugin import read_model, refresher, snapshot, storage
+from src.plugin.metadata_model import MetadataModel
+
+
+def version_zero(plugin_id, qgis_minimum_version, qgis_maximum_version, updated_at, plugin_stage=""):
+    """
+    Version zero record of a plugin with one revision
+    """
+
+    return MetadataModel(
+        id=plugin_id,
+        item_version=f"000000{plugin_stage}",
+        stage=plugin_stage or None,
+        revisions=1,
+        created_at=updated_at,
+        updated_at=updated_at,
+        name=plugin_id,
+        qgis_minimum_version=qgis_minimum_version,
+        qgis_maximum_version=qgis_maximum_version,
+        version="1.0.0",
+        file_name=plugin_id,
+    )
+
+
+@pytest.fixture(name="read_model_store")
+def fixture_read_model_store(tmp_path):
+    """
+    Read model over a memory store of plugins for different QGIS versions
+    """
+
+    store = storage.MemoryStore()
+    updated_at = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    store.put_records(
+        [
+            version_zero("qgis2", "2.0", "2.99", updated_at),
+            version_zero("qgis3", "3.0", "3.99", updated_at),
+            version_zero("qgis3_10", "3.10", "3.99", updated_at),
+            version_zero("dev_plugin", "3.0", "3.99", updated_at, "dev"),
+            MetadataModel(id="new_plugin", item_version="000000", revisions=0),
+            MetadataModel(id="qgis3", item_version="metadata", secret="secret"),
+        ]
+    )
+    return read_model.ReadModelStore(store, str(tmp_path / "read_model.sqlite"), refresh_seconds=3600)
+
+
+@pytest.mark.parametrize(
+    "version, key", [("3.34.1", 3034001), ("3.10", 3010000), ("3", None), ("3.1000", None), ("3.0rc1", None), (None, None)]
+)
+def test_version_key(version, key):
+    """
+    Keys order major.minor[.patch] versions
+    """
+
+    assert read_model.version_key(version) == key
+
+
+def test_version_zeros(read_model_store):
+    """
+    Only catalogue records of the stage are listed
+    """
+
+    assert [record["id"] for record in read_model_store.all_version_zeros("")] == ["new_plugin", "qgis2", "qgis3", "qgis3_10"]
+    assert [record["id"] for record in read_model_store.all_version_zeros("dev")] == ["dev_plugin"]
+
+
+@pytest.mark.parametrize(
+    "qgis_version, plugin_ids",
+    [("0.0.0", ["qgis2", "qgis3", "qgis3_10"]), ("3.4", ["qgis3"]), ("3.16.1", ["qgis3", "qgis3_10"]), ("2.18", ["qgis2"])],
+)
+def test_version_zeros_qgis_version(read_model_store, qgis_version, plugin_ids):
+    """
+    Plugins are filtered by QGIS version in SQL
+    """
+
+    assert [record["id"] for record in read_model_store.all_version_zeros("", qgis_version)] == plugin_ids
+
+
+def test_version_zeros_consistent(read_model_store, mocker):
+    """
+    Consistent listings are read from the wrapped store rather than the read model
+    """
+
+    all_version_zeros = mocker.spy(read_model_store.store, "all_version_zeros")
+    assert len(list(read_model_store.all_version_zeros("", consistent=True))) == 4
+    all_version_zeros.assert_called_once_with("", None, True)
+
+
+def test_refresh_replaces_stages(read_model_store, mocker):
+    """
+    A refresh, once due, replaces each stage's version zeros so updates and deletions are applied
+    """
+
+    read_model_store.fresh()
+    all_version_zeros = mocker.spy(read_model_store.store, "all_version_zeros")
+    later = datetime.now(timezone.utc) + timedelta(minutes=5)
+    read_model_store.store.put_records([version_zero("qgis3", "3.0", "3.4", later)])
+    read_model_store.store.delete_records([("qgis3_10", "000000")])
+    assert [record["id"] for record in read_model_store.all_version_zeros("", "3.16")] == ["qgis3", "qgis3_10"]
+    all_version_zeros.assert_not_called()
+
+    read_model_store.refresh_seconds = 0
+    assert not list(read_model_store.all_version_zeros("", "3.16"))
+    assert [record["id"] for record in read_model_store.all_version_zeros("")] == ["new_plugin", "qgis2", "qgis3"]
+
+
+def test_refresh_from_snapshot(read_model_store, tmp_path, mocker):
+    """
+    A read model over the catalogue snapshot is refreshed without scanning the store
+    """
+
+    store = read_model_store.store
+    snapshot_store = snapshot.SnapshotStore(store, str(tmp_path / "catalogue.snapshot"))
+    snapshot_store.refresh()
+    scan = mocker.spy(store, "scan")
+    refreshed = read_model.ReadModelStore(snapshot_store, str(tmp_path / "refreshed.sqlite"))
+    assert [record["id"] for record in refreshed.all_version_zeros("dev")] == ["dev_plugin"]
+    scan.assert_not_called()
+
+
+def test_reads_own_writes(read_model_store, metadata_fixture):
+    """
+    Writes made through the read model are listed before the next refresh
+    """
+
+    read_model_store.fresh()
+    result = read_model_store.new_plugin_version(metadata_fixture, "new_plugin", "abc", "")
+    assert result["revisions"] == 1
+    assert "new_plugin" in [record["id"] for record in read_model_store.all_version_zeros("", "3.16")]
+    assert [version["item_version"] for version in read_model_store.plugin_all_versions("new_plugin", "")] == [
+        "000000",
+        "000001",
+    ]
+    read_model_store.archive_plugin("qgis3", "")
+    assert [record["id"] for record in read_model_store.all_version_zeros("") if "ended_at" in record] == ["qgis3"]
+
+
+def test_plugin_all_versions_from_store(read_model_store, metadata_fixture):
+    """
+    Revisions are read from the wrapped store, so deleted revisions are not listed
+    """
+
+    read_model_store.new_plugin_version(metadata_fixture, "new_plugin", "abc", "")
+    read_model_store.store.delete_records([("new_plugin", "000001")])
+    assert [version["item_version"] for version in read_model_store.plugin_all_versions("new_plugin", "")] == ["000000"]
+
+
+def test_get_metadata_store_read_model(mocker, tmp_path):
+    """
+    The configured store is wrapped when a read model path is set
+    """
+
+    mocker.patch("src.plugin.read_model.READ_MODEL_PATH", str(tmp_path / "read_model.sqlite"))
+    mocker.patch.dict(storage._stores, clear=True)  # pylint: disable=protected-access
+    store = storage.get_metadata_store("memory://")
+    assert isinstance(store, read_model.ReadModelStore)
+    assert isinstance(store.store, storage.MemoryStore)
+
+
+def test_get_metadata_store_read_model_snapshot(mocker, tmp_path):
+    """
+    With a snapshot configured too the read model is refreshed from the snapshot
+    """
+
+    mocker.patch("src.plugin.read_model.READ_MODEL_PATH", str(tmp_path / "read_model.sqlite"))
+    mocker.patch("src.plugin.snapshot.CATALOGUE_SNAPSHOT_PATH", str(tmp_path / "catalogue.snapshot"))
+    mocker.patch.dict(storage._stores, clear=True)  # pylint: disable=protected-access
+    store = storage.get_metadata_store("memory://")
+    assert isinstance(store, read_model.ReadModelStore)
+    assert isinstance(store.store, snapshot.SnapshotStore)
+    assert refresher.snapshot_store(store) is store.store
@@ -0,0 +1,187 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+"""
+
+import hashlib
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from benchmarks import catalogue
+from src.plugin import retention, revision_archive, storage
+from src.plugin.metadata_model import format_item_version
+
+NOW = datetime.now(timezone.utc)
+
+
+def file_name(index):
+    return hashlib.sha256(str(index).encode()).hexdigest()
+
+
+def plugin(plugin_id, plugin_stage, revisions, age_days):
+    """
+    Version zero and revisions of a plugin, revision n uploaded
+    age_days before the next and using plugin file n
+    """
+
+    records = [catalogue.version_zero(plugin_id, plugin_stage, revisions=revisions, file_name=file_name(revisions))]
+    for number in range(1, revisions + 1):
+        updated_at = NOW - timedelta(days=age_days * (revisions - number))
+        records.append(
+            catalogue.version_zero(
+                plugin_id,
+                plugin_stage,
+                revisions=number,
+                item_version=format_item_version(plugin_stage, str(number)),
+                updated_at=updated_at,
+                file_name=file_name(number),
+            )
+        )
+    return records
+
+
+@pytest.fixture(name="store")
+def fixture_store():
+    """
+    Memory store of dev and prd plugins with twelve weekly revisions
+    """
+
+    store = storage.MemoryStore()
+    store.put_records(plugin("dev_plugin", "dev", 12, 7) + plugin("prd_plugin", "", 12, 7))
+    return store
+
+
+def item_versions(records):
+    return [record["item_version"] for record in records]
+
+
+def test_retained(store):
+    """
+    Dev revisions outside the latest and older than the retention are not listed
+    """
+
+    versions = store.plugin_all_versions("dev_plugin", "dev")
+    kept = retention.retained(versions, "dev", keep=3, days=30)
+    # Revisions 10 to 12 are the latest, 9 to 7 are under 30 days old
+    assert item_versions(kept) == ["000000dev"] + [format_item_version("dev", str(n)) for n in range(8, 13)]
+    assert retention.retained(store.plugin_all_versions("prd_plugin", ""), "", keep=3, days=30) == store.plugin_all_versions(
+        "prd_plugin", ""
+    )
+
+
+def test_expire_revision(store):
+    """
+    The revision pushed out of the latest revisions is given an expiry
+    """
+
+    version_zero = store.plugin_version_zero("dev_plugin", "dev")
+    expires_at = retention.expire_revision(store, version_zero, keep=10, days=30)
+    revision = store.get_record("dev_plugin", "000002dev")
+    assert datetime.fromisoformat(revision["expires_at"]) == expires_at
+    # Uploaded 70 days ago so expires now rather than in the past
+    assert expires_at - NOW < timedelta(minutes=1)
+    assert retention.expire_revision(store, version_zero, keep=10, days=30) is None
+
+    expires_at = retention.expire_revision(store, version_zero, keep=1, days=30)
+    assert expires_at - NOW == pytest.approx(timedelta(days=23), abs=timedelta(minutes=1))
+    assert retention.expire_revision(store, store.plugin_version_zero("prd_plugin", ""), keep=1) is None
+
+
+def test_expire_revisions_and_purge(store):
+    """
+    The cleanup expires revisions written before the policy applied and purges expired records
+    """
+
+    assert retention.expire_revisions(store, keep=10, days=30) == 2
+    assert store.purge_expired(NOW + timedelta(minutes=1)) == 2
+    assert len(store.plugin_all_versions("dev_plugin", "dev")) == 11
+    assert len(store.plugin_all_versions("prd_plugin", "")) == 13
+
+
+def test_delete_unreferenced_files(store):
+    """
+    Only plugin files no record or archived revision references are deleted
+    """
+
+    object_store = storage.MemoryObjectStore()
+    archive_store = storage.MemoryObjectStore()
+    for number in range(1, 13):
+        object_store.put(b"plugin", file_name(number))
+    object_store.put(b"orphan", file_name("orphan"))
+    object_store.put(b"not a plugin file", "index.html")
+    revision_archive.compact_plugin(store, archive_store, "prd_plugin", "", keep=1)
+    retention.expire_revisions(store, keep=10, days=30)
+    store.purge_expired(NOW + timedelta(minutes=1))
+
+    # Files of dev revisions 1 and 2 are still referenced by prd revisions archived
+    assert retention.delete_unreferenced_files(store, object_store, archive_store, grace=0, dry_run=True) == [
+        file_name("orphan")
+    ]
+    # Recently stored files may belong to an upload in progress
+    assert not retention.delete_unreferenced_files(store, object_store, archive_store)
+    object_store.objects[file_name("orphan")] = (b"orphan", None, time.time() - 60)
+    assert retention.delete_unreferenced_files(store, object_store, archive_store, grace=30) == [file_name("orphan")]
+    assert not object_store.exists(file_name("orphan"))
+    assert object_store.exists("index.html")
+
+
+def test_dev_archive_references_and_prune():
+    """
+    Archived dev revisions the retention policy has expired are not
+    references, and are pruned from the archive
+    """
+
+    store = storage.MemoryStore()
+    store.put_records(plugin("dev_plugin", "dev", 12, 7))
+    object_store = storage.MemoryObjectStore()
+    revision_archive.compact_plugin(store, object_store, "dev_plugin", "dev", keep=1)
+    references = retention.referenced_files(store, object_store)
+    # Revisions 1 and 2 are outside the latest 10 and over 30 days old
+    assert file_name(1) not in references and file_name(2) not in references
+    assert file_name(3) in references
+
+    assert retention.prune_archives(store, object_store) == 2
+    archived = revision_archive.read_archive(object_store, "dev_plugin", "dev")
+    assert item_versions(archived) == [format_item_version("dev", str(n)) for n in range(3, 12)]
+    assert retention.prune_archives(store, object_store) == 0
+
+
+def test_delete_unreferenced_files_touched(store, mocker):
+    """
+    A file touched by an upload after it was listed is not deleted
+    """
+
+    object_store = storage.MemoryObjectStore()
+    object_store.objects[file_name("orphan")] = (b"orphan", None, time.time() - 60)
+
+    def upload_during_read(store, archive_store):  # pylint: disable=unused-argument
+        object_store.touch(file_name("orphan"), "orphan")
+        return set()
+
+    mocker.patch("src.plugin.retention.referenced_files", side_effect=upload_during_read)
+    assert not retention.delete_unreferenced_files(store, object_store, storage.MemoryObjectStore(), grace=30)
+    assert object_store.exists(file_name("orphan"))
+
+
+def test_handler_buckets(mocker):
+    """
+    Plugin files are cleaned up in the repository bucket and archives in the private bucket
+    """
+
+    mocker.patch("src.plugin.retention.RETENTION_BUCKET", "repo")
+    mocker.patch("src.plugin.revision_archive.REVISION_ARCHIVE_BUCKET", "private")
+    mocker.patch("src.plugin.storage.get_object_store", side_effect=lambda bucket: bucket)
+    mocker.patch("src.plugin.storage.get_metadata_store")
+    clean_up = mocker.patch("src.plugin.retention.clean_up")
+    retention.handler({}, None)
+    assert clean_up.call_args.args[1:] == ("repo", "private")
@@ -0,0 +1,104 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+"""
+
+import gzip
+import json
+
+import pytest
+
+from benchmarks import catalogue
+from src.plugin import aws, revision_archive, storage
+from src.plugin.metadata_model import format_item_version
+
+
+@pytest.fixture(name="store")
+def fixture_store():
+    """
+    Memory store of a dev plugin with five revisions and a plugin with one
+    """
+
+    store = storage.MemoryStore()
+    store.put_records(
+        [catalogue.version_zero("busy", "dev", revisions=5)]
+        + [catalogue.version_zero("busy", "dev", item_version=format_item_version("dev", str(n))) for n in range(1, 6)]
+        + [catalogue.version_zero("quiet"), catalogue.version_zero("quiet", item_version=format_item_version("", "1"))]
+    )
+    return store
+
+
+def item_versions(records):
+    return [record["item_version"] for record in records]
+
+
+def test_compact(store):
+    """
+    All but the latest revisions are moved to the archive
+    """
+
+    object_store = storage.MemoryObjectStore()
+    # Dev revisions expire rather than being archived unless the stage is given
+    assert revision_archive.compact(store, object_store, keep=2) == 0
+    assert revision_archive.compact(store, object_store, keep=2, stages=("", "dev")) == 3
+    assert item_versions(store.plugin_all_versions("busy", "dev")) == ["000000dev", "000004dev", "000005dev"]
+    assert len(store.plugin_all_versions("quiet", "")) == 2
+    lines = gzip.decompress(object_store.get("revisions/dev/busy.jsonl.gz")).splitlines()
+    assert [json.loads(line)["item_version"] for line in lines] == ["000001dev", "000002dev", "000003dev"]
+    assert not object_store.exists("revisions/prd/quiet.jsonl.gz")
+
+
+def test_compact_appends(store):
+    """
+    Later compactions add to the archive
+    """
+
+    object_store = storage.MemoryObjectStore()
+    revision_archive.compact_plugin(store, object_store, "busy", "dev", keep=4)
+    revision_archive.compact_plugin(store, object_store, "busy", "dev", keep=1)
+    assert item_versions(revision_archive.read_archive(object_store, "busy", "dev")) == [
+        "000001dev",
+        "000002dev",
+        "000003dev",
+        "000004dev",
+    ]
+    assert revision_archive.compact_plugin(store, object_store, "busy", "dev", keep=1) == 0
+
+
+def test_plugin_all_versions(store, mocker):
+    """
+    Revisions are read across both tiers, and the archive only when revisions are missing
+    """
+
+    object_store = storage.MemoryObjectStore()
+    exists = mocker.spy(object_store, "exists")
+    expected = item_versions(store.plugin_all_versions("busy", "dev"))
+    assert item_versions(revision_archive.plugin_all_versions(store, object_store, "busy", "dev")) == expected
+    exists.assert_not_called()
+
+    revision_archive.compact_plugin(store, object_store, "busy", "dev", keep=2)
+    exists.reset_mock()
+    assert item_versions(revision_archive.plugin_all_versions(store, object_store, "busy", "dev")) == expected
+    exists.assert_called_once()
+
+
+def test_archive_s3(store, s3_bucket_fixture):
+    """
+    Archives are written to and read back from S3 as gzipped JSON lines
+    """
+
+    object_store = storage.S3ObjectStore(s3_bucket_fixture)
+    revisions = store.plugin_all_versions("busy", "dev")[1:]
+    revision_archive.write_archive(object_store, "busy", "dev", revisions)
+    lines = gzip.decompress(aws.s3_get(s3_bucket_fixture, "revisions/dev/busy.jsonl.gz")).splitlines()
+    assert [json.loads(line) for line in lines] == revisions
+    assert revision_archive.read_archive(object_store, "busy", "dev") == revisions
+    assert revision_archive.read_archive(object_store, "quiet", "") == []
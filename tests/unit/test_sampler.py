@@ -0,0 +1,77 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+"""
+
+import sys
+import threading
+
+from src.plugin import sampler
+
+
+def wait_for(event):
+    """
+    Frame for the sampler to find
+    """
+
+    event.wait()
+
+
+def test_collapse():
+    """
+    Stacks are collapsed root first
+    """
+
+    stack = sampler.collapse(sys._getframe())  # pylint: disable=protected-access
+    assert stack.endswith(f"{__name__}:test_collapse")
+
+
+def test_sample_aggregated(mocker):
+    """
+    Stacks of other threads running included code are counted and flushed
+    """
+
+    log = mocker.patch("src.plugin.sampler.get_log")
+    stack_sampler = sampler.StackSampler(10, include=__name__.rsplit(".", 1)[0])
+    event = threading.Event()
+    thread = threading.Thread(target=wait_for, args=(event,))
+    thread.start()
+    try:
+        stack_sampler.sample()
+        stack_sampler.sample()
+    finally:
+        event.set()
+        thread.join()
+
+    assert stack_sampler.stacks.total() == 2
+    [(stack, count)] = stack_sampler.stacks.items()
+    assert f"{__name__}:wait_for;threading:wait" in stack
+    assert count == 2
+    stack_sampler.flush()
+    assert log.return_value.info.call_args[1]["samples"] == 2
+    assert not stack_sampler.stacks
+
+
+def test_sample_max_stacks():
+    """
+    Stacks beyond the maximum are counted as other
+    """
+
+    stack_sampler = sampler.StackSampler(10, max_stacks=0, include=__name__.rsplit(".", 1)[0])
+    event = threading.Event()
+    thread = threading.Thread(target=wait_for, args=(event,))
+    thread.start()
+    try:
+        stack_sampler.sample()
+    finally:
+        event.set()
+        thread.join()
+    assert stack_sampler.stacks == {sampler.OTHER: 1}
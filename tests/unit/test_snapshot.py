@@ -0,0 +1,293 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+"""
+
+import time
+
+import pytest
+
+from benchmarks import catalogue
+from src.plugin import aws, refresher, snapshot, storage
+
+
+@pytest.fixture(name="snapshot_store")
+def fixture_snapshot_store(tmp_path):
+    """
+    Snapshot store wrapping a memory store of three plugins
+    """
+
+    store = storage.MemoryStore()
+    store.put_records(catalogue.version_zero(plugin_id) for plugin_id in ("a", "b", "c"))
+    return snapshot.SnapshotStore(store, str(tmp_path / "catalogue.snapshot"))
+
+
+def test_write_and_read(tmp_path):
+    """
+    Records are read back per stage in the order written
+    """
+
+    path = str(tmp_path / "catalogue.snapshot")
+    records = [
+        {"id": "a", "about": "ä" * 100, "revisions": 2, "ended_at": None},
+        {"id": "b", "manifest": {"file_count": 1}, "experimental": False, "score": 0.5},
+    ]
+    snapshot.write(path, {"": records, "dev": []})
+    catalogue_snapshot = snapshot.Snapshot(path)
+    assert list(catalogue_snapshot.records("")) == records
+    assert not list(catalogue_snapshot.records("dev"))
+    assert not list(catalogue_snapshot.records("unknown"))
+    assert catalogue_snapshot.age() < 10
+
+
+def test_strings_are_interned(tmp_path):
+    """
+    Repeated strings are stored once
+    """
+
+    path = tmp_path / "catalogue.snapshot"
+    snapshot.write(str(path), {"": [{"id": str(index), "about": "x" * 1000} for index in range(10)]})
+    assert path.stat().st_size < 2000
+
+
+def test_qgis_version_filter(tmp_path):
+    """
+    Records are filtered on their version columns
+    """
+
+    path = str(tmp_path / "catalogue.snapshot")
+    records = [
+        {"id": "qgis2", "revisions": 1, "qgis_minimum_version": "2.0", "qgis_maximum_version": "2.99"},
+        {"id": "qgis3_10", "revisions": 1, "qgis_minimum_version": "3.10", "qgis_maximum_version": "3.99"},
+        {"id": "new", "revisions": 0},
+    ]
+    snapshot.write(path, {"": records})
+    catalogue_snapshot = snapshot.Snapshot(path)
+    assert [record["id"] for record in catalogue_snapshot.records("", "3.16")] == ["qgis3_10"]
+    assert [record["id"] for record in catalogue_snapshot.records("", "3.4")] == []
+    assert [record["id"] for record in catalogue_snapshot.records("", "0.0.0")] == ["qgis2", "qgis3_10"]
+    assert len(list(catalogue_snapshot.records(""))) == 3
+
+
+def test_not_a_snapshot(tmp_path):
+    """
+    Other files are rejected
+    """
+
+    path = tmp_path / "catalogue.snapshot"
+    path.write_bytes(b"not a snapshot")
+    with pytest.raises(ValueError):
+        snapshot.Snapshot(str(path))
+
+
+def test_current_remaps_replaced_snapshot(tmp_path):
+    """
+    Readers map the latest snapshot once the refresher replaces it
+    """
+
+    path = str(tmp_path / "catalogue.snapshot")
+    assert snapshot.current(path) is None
+    snapshot.write(path, {"": [{"id": "a"}]})
+    first = snapshot.current(path)
+    assert snapshot.current(path) is first
+    snapshot.write(path, {"": [{"id": "b"}]})
+    assert [record["id"] for record in snapshot.current(path).records("")] == ["b"]
+
+
+def test_snapshot_store(snapshot_store, mocker):
+    """
+    Listings are served from the snapshot once written
+    """
+
+    scan = mocker.spy(snapshot_store.store, "scan")
+    assert len(list(snapshot_store.all_version_zeros(""))) == 3
+    assert scan.call_count == 1
+
+    refresher.refresh(snapshot_store, once=True)
+    scan.reset_mock()
+    assert sorted(record["id"] for record in snapshot_store.all_version_zeros("")) == ["a", "b", "c"]
+    scan.assert_not_called()
+
+
+def test_snapshot_store_stale(snapshot_store):
+    """
+    Writes mark the snapshot stale for the refresher
+    """
+
+    snapshot_store.refresh()
+    assert not snapshot_store.stale()
+    snapshot_store.archive_plugin("a", "")
+    assert snapshot_store.stale()
+    snapshot_store.refresh()
+    assert not snapshot_store.stale()
+    assert [record["id"] for record in snapshot_store.all_version_zeros("") if "ended_at" in record] == ["a"]
+
+
+def test_snapshot_store_too_old(snapshot_store, mocker):
+    """
+    Snapshots older than their max age are not used
+    """
+
+    snapshot_store.refresh()
+    snapshot_store.max_age = 60
+    mocker.patch("src.plugin.snapshot.time.time", return_value=time.time() + 120)
+    scan = mocker.spy(snapshot_store.store, "scan")
+    assert len(list(snapshot_store.all_version_zeros(""))) == 3
+    assert scan.call_count == 1
+
+
+def test_get_metadata_store_snapshot(mocker, tmp_path):
+    """
+    The configured store is wrapped when a snapshot path is set
+    """
+
+    mocker.patch("src.plugin.snapshot.CATALOGUE_SNAPSHOT_PATH", str(tmp_path / "catalogue.snapshot"))
+    mocker.patch.dict(storage._stores, clear=True)  # pylint: disable=protected-access
+    store = storage.get_metadata_store("memory://")
+    assert isinstance(store, snapshot.SnapshotStore)
+    assert isinstance(store.store, storage.MemoryStore)
+
+
+def published(bucket, tmp_path):
+    """
+    Header and prd version zero records of the snapshot in S3
+    """
+
+    path = str(tmp_path / "published.snapshot")
+    snapshot.download(path, bucket, "catalogue/catalogue.snapshot")
+    published_snapshot = snapshot.Snapshot(path)
+    return published_snapshot.header, {record["id"]: record for record in published_snapshot.records("")}
+
+
+def test_snapshot_store_s3(tmp_path, s3_bucket_fixture, mocker):
+    """
+    Writes patch the snapshot in S3 without a scan and new containers start from it
+    """
+
+    store = storage.MemoryStore()
+    store.put_records(catalogue.version_zero(plugin_id) for plugin_id in ("a", "b"))
+    writer = snapshot.SnapshotStore(
+        store, str(tmp_path / "writer.snapshot"), bucket=s3_bucket_fixture, key="catalogue/catalogue.snapshot"
+    )
+    writer.refresh()
+    all_version_zeros = mocker.spy(store, "all_version_zeros")
+    writer.archive_plugin("a", "")
+    all_version_zeros.assert_not_called()
+
+    empty = storage.MemoryStore()
+    scan = mocker.spy(empty, "scan")
+    reader = snapshot.SnapshotStore(
+        empty, str(tmp_path / "reader.snapshot"), bucket=s3_bucket_fixture, key="catalogue/catalogue.snapshot"
+    )
+    assert [record["id"] for record in reader.all_version_zeros("") if "ended_at" in record] == ["a"]
+    assert len(list(reader.all_version_zeros(""))) == 2
+    scan.assert_not_called()
+
+
+def test_snapshot_store_s3_not_published(tmp_path, s3_bucket_fixture):
+    """
+    The first container publishes the snapshot if there is none in S3
+    """
+
+    store = storage.MemoryStore()
+    store.put_records([catalogue.version_zero("a")])
+    reader = snapshot.SnapshotStore(
+        store, str(tmp_path / "catalogue.snapshot"), bucket=s3_bucket_fixture, key="catalogue/catalogue.snapshot"
+    )
+    assert len(list(reader.all_version_zeros(""))) == 1
+    assert list(published(s3_bucket_fixture, tmp_path)[1]) == ["a"]
+
+
+def test_written_not_published(tmp_path, s3_bucket_fixture, mocker):
+    """
+    Writes do not scan the store to publish a first snapshot
+    """
+
+    store = storage.MemoryStore()
+    store.put_records([catalogue.version_zero("a")])
+    writer = snapshot.SnapshotStore(
+        store, str(tmp_path / "catalogue.snapshot"), bucket=s3_bucket_fixture, key="catalogue/catalogue.snapshot"
+    )
+    all_version_zeros = mocker.spy(store, "all_version_zeros")
+    writer.archive_plugin("a", "")
+    all_version_zeros.assert_not_called()
+    assert not aws.s3_list(s3_bucket_fixture, "catalogue/")
+
+
+def test_merge():
+    """
+    Of two versions of a plugin's version zero the later updated is kept
+    """
+
+    records = [{"id": "a", "updated_at": "2024-01-02T00:00:00+00:00"}, {"id": "b", "updated_at": "2024-01-01T00:00:00+00:00"}]
+    updates = [
+        {"id": "a", "updated_at": "2024-01-01T00:00:00+00:00"},
+        {"id": "b", "updated_at": "2024-01-03T00:00:00+00:00"},
+        {"id": "c"},
+    ]
+    assert snapshot.merge(records, updates) == [records[0], updates[1], updates[2]]
+
+
+def test_publish_retries_conflict(tmp_path, s3_bucket_fixture, mocker):
+    """
+    A patch is retried on the snapshot a concurrent write put
+    """
+
+    key = "catalogue/catalogue.snapshot"
+    snapshot.publish(str(tmp_path / "first.snapshot"), s3_bucket_fixture, key, {"": [{"id": "a"}]}, scanned_at=100)
+    s3_put_if = aws.s3_put_if
+
+    def concurrent_write(*args):
+        if put.call_count == 1:
+            snapshot.publish(str(tmp_path / "concurrent.snapshot"), s3_bucket_fixture, key, {"": [{"id": "b"}]})
+        s3_put_if(*args)
+
+    put = mocker.patch("src.plugin.aws.s3_put_if", side_effect=concurrent_write)
+    assert snapshot.publish(str(tmp_path / "catalogue.snapshot"), s3_bucket_fixture, key, {"dev": [{"id": "c"}]})
+    assert put.call_count == 3
+    header, records = published(s3_bucket_fixture, tmp_path)
+    assert sorted(records) == ["a", "b"]
+    assert header["stages"]["dev"]["count"] == 1
+    assert header["scanned_at"] == 100
+
+
+def test_refresh_keeps_later_patch(tmp_path, s3_bucket_fixture):
+    """
+    A rebuild does not undo a write patched in since its scan
+    """
+
+    store = storage.MemoryStore()
+    store.put_records([catalogue.version_zero("a")])
+    key = "catalogue/catalogue.snapshot"
+    later = {"id": "a", "updated_at": "9999-01-01T00:00:00+00:00"}
+    snapshot.publish(str(tmp_path / "patch.snapshot"), s3_bucket_fixture, key, {"": [later]}, scanned_at=100)
+    rebuild = snapshot.SnapshotStore(store, str(tmp_path / "catalogue.snapshot"), bucket=s3_bucket_fixture, key=key)
+    rebuild.refresh()
+    header, records = published(s3_bucket_fixture, tmp_path)
+    assert records["a"] == later
+    assert header["scanned_at"] > time.time() - 60
+
+
+def test_refresher_handler(tmp_path, s3_bucket_fixture, mocker):
+    """
+    The scheduled rebuild publishes the snapshot if one is shared through S3
+    """
+
+    store = storage.MemoryStore()
+    store.put_records([catalogue.version_zero("a")])
+    get_metadata_store = mocker.patch("src.plugin.storage.get_metadata_store", return_value=store)
+    assert refresher.handler({}, None) == {"size": None}
+
+    get_metadata_store.return_value = snapshot.SnapshotStore(
+        store, str(tmp_path / "catalogue.snapshot"), bucket=s3_bucket_fixture, key="catalogue/catalogue.snapshot"
+    )
+    assert refresher.handler({}, None)["size"] > 0
+    assert list(published(s3_bucket_fixture, tmp_path)[1]) == ["a"]
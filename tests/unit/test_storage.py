@@ -0,0 +1,229 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from src.plugin import storage
+from src.plugin.error import DataError
+
+
+def test_encode_datetimes_utc():
+    """
+    Datetimes are encoded in UTC and, as with PynamoDB, naive datetimes are taken to be UTC
+    """
+
+    assert storage.encode(
+        {"naive": datetime(2020, 1, 1), "nzst": datetime(2020, 1, 1, 12, tzinfo=timezone(timedelta(hours=12)))}
+    ) == {
+        "naive": "2020-01-01T00:00:00+00:00",
+        "nzst": "2020-01-01T00:00:00+00:00",
+    }
+
+
+def test_plugin_version_zero(metadata_store):
+    """
+    Records are returned as the DynamoDB store returns them
+    """
+
+    version_zero = metadata_store.plugin_version_zero("test_plugin", "")
+    assert version_zero["created_at"] == "2020-01-01T00:00:00+00:00"
+    assert version_zero["revisions"] == 1
+    assert "ended_at" not in version_zero
+    with pytest.raises(DataError, match="Plugin Not Found"):
+        metadata_store.plugin_version_zero("test_plugin", "dev")
+
+
+def test_all_version_zeros(metadata_store):
+    """
+    Only the stage's version zeros are listed
+    """
+
+    assert [record["id"] for record in metadata_store.all_version_zeros("")] == ["test_plugin"]
+    assert [record["id"] for record in metadata_store.all_version_zeros("dev")] == ["new_plugin"]
+
+
+def test_new_plugin_version(metadata_store, metadata_fixture):
+    """
+    Version zero is updated and stored as the next revision
+    """
+
+    result = metadata_store.new_plugin_version(
+        metadata_fixture, "test_plugin", "def", "", {"file_sha256": "def", "manifest": {"file_count": 1}}
+    )
+    assert result["revisions"] == 2
+    assert result["version"] == "1.1.0"
+    assert result["qgis_maximum_version"] == "3.99"
+    assert result["file_sha256"] == "def"
+    assert result["manifest"] == {"file_count": 1}
+    assert result["created_at"] == "2020-01-01T00:00:00+00:00"
+    versions = metadata_store.plugin_all_versions("test_plugin", "")
+    assert [version["item_version"] for version in versions] == ["000000", "000002"]
+    assert versions[1] == {**result, "item_version": "000002"}
+
+
+def test_archive_plugin(metadata_store):
+    """
+    Archiving ends version zero and stores the next revision
+    """
+
+    result = metadata_store.archive_plugin("new_plugin", "dev")
+    assert result["revisions"] == 1
+    assert "ended_at" in result
+    assert [version["item_version"] for version in metadata_store.plugin_all_versions("new_plugin", "dev")] == [
+        "000000dev",
+        "000001dev",
+    ]
+
+
+def test_delete_records(metadata_store):
+    """
+    Records are deleted by key
+    """
+
+    metadata_store.archive_plugin("new_plugin", "dev")
+    assert metadata_store.delete_records([("new_plugin", "000001dev"), ("new_plugin", "000002dev")]) == 2
+    assert [version["item_version"] for version in metadata_store.plugin_all_versions("new_plugin", "dev")] == ["000000dev"]
+
+
+def test_validate_token(metadata_store):
+    """
+    Tokens are checked against the plugin's secret
+    """
+
+    metadata_store.validate_token("secret", "test_plugin", "")
+    with pytest.raises(DataError, match="Invalid token"):
+        metadata_store.validate_token("not the secret", "test_plugin", "")
+    with pytest.raises(DataError, match="Plugin Not Found"):
+        metadata_store.validate_token("secret", "new_plugin", "dev")
+
+
+@pytest.mark.parametrize("object_store", [storage.MemoryObjectStore(), storage.SqliteObjectStore()])
+def test_object_store(object_store):
+    """
+    Objects are stored and retrieved by name
+    """
+
+    assert not object_store.exists("abc")
+    object_store.put(b"plugin", "abc", "test_plugin")
+    assert object_store.exists("abc")
+    assert object_store.get("abc") == b"plugin"
+
+
+@pytest.mark.parametrize("object_store", [storage.MemoryObjectStore(), storage.SqliteObjectStore(), "filesystem"])
+def test_object_store_names_and_delete(object_store, tmp_path):
+    """
+    Objects are listed by prefix and deleted by name
+    """
+
+    if object_store == "filesystem":
+        object_store = storage.FilesystemObjectStore(str(tmp_path))
+    object_store.put(b"plugin", "abc")
+    object_store.put(b"archive", "revisions/dev/abc.jsonl.gz")
+    assert sorted(name for name, _ in object_store.names()) == ["abc", "revisions/dev/abc.jsonl.gz"]
+    assert [name for name, _ in object_store.names("revisions/")] == ["revisions/dev/abc.jsonl.gz"]
+    object_store.delete("abc")
+    object_store.delete("abc")
+    assert not object_store.exists("abc")
+
+
+@pytest.mark.parametrize("object_store", [storage.MemoryObjectStore(), storage.SqliteObjectStore(), "filesystem"])
+def test_object_store_touch(object_store, tmp_path):
+    """
+    Touching a stored object refreshes its modification time, where stored
+    """
+
+    if object_store == "filesystem":
+        object_store = storage.FilesystemObjectStore(str(tmp_path))
+    object_store.put(b"plugin", "abc")
+    if isinstance(object_store, storage.FilesystemObjectStore):
+        os.utime(tmp_path / "abc", (0, 0))
+    elif isinstance(object_store, storage.MemoryObjectStore):
+        object_store.objects["abc"] = (b"plugin", None, 0)
+    (_, modified), *_ = object_store.names("abc")
+    assert object_store.touch("abc", "test_plugin")
+    (_, touched), *_ = object_store.names("abc")
+    assert touched is None or touched > modified
+    assert object_store.get("abc") == b"plugin"
+    assert not object_store.touch("def")
+
+
+def test_object_store_touch_keeps_content_disposition(tmp_path):
+    """
+    Touching an object without a content disposition keeps the one it was stored with
+    """
+
+    memory_store = storage.MemoryObjectStore()
+    sqlite_store = storage.SqliteObjectStore()
+    filesystem_store = storage.FilesystemObjectStore(str(tmp_path))
+    for object_store in (memory_store, sqlite_store, filesystem_store):
+        object_store.put(b"plugin", "abc", "test_plugin")
+        assert object_store.touch("abc")
+    assert memory_store.objects["abc"][1] == "test_plugin"
+    # pylint: disable-next=protected-access
+    assert sqlite_store._connection.execute("SELECT content_disposition FROM objects").fetchone() == ("test_plugin",)
+    assert filesystem_store.content_disposition("abc") == "test_plugin"
+
+
+def test_s3_object_store(mocker):
+    """
+    The S3 store puts plugin files in the bucket
+    """
+
+    s3_put = mocker.patch("src.plugin.aws.s3_put")
+    storage.S3ObjectStore("bucket").put(b"plugin", "abc", "test_plugin")
+    s3_put.assert_called_once_with(b"plugin", "bucket", "abc", "test_plugin")
+
+
+def test_get_metadata_store():
+    """
+    Stores are created from their url once per process
+    """
+
+    assert isinstance(storage.get_metadata_store(), storage.DynamoDBStore)
+    assert isinstance(storage.get_metadata_store("memory://"), storage.MemoryStore)
+    assert storage.get_metadata_store("sqlite://") is storage.get_metadata_store("sqlite://")
+    with pytest.raises(ValueError):
+        storage.get_metadata_store("postgresql://")
+
+
+def test_get_object_store():
+    """
+    Plugin files are stored in the bucket unless a store is configured
+    """
+
+    assert storage.get_object_store("bucket").bucket == "bucket"
+    assert isinstance(storage.get_object_store("bucket", "memory://"), storage.MemoryObjectStore)
+
+
+def test_filesystem_object_store(tmp_path):
+    """
+    Objects are stored as files under the root
+    """
+
+    object_store = storage.FilesystemObjectStore(str(tmp_path))
+    object_store.put(b"plugin", "abc", "test_plugin")
+    assert (tmp_path / "abc").read_bytes() == b"plugin"
+    assert object_store.content_disposition("abc") == "test_plugin"
+    assert [name for name, _ in object_store.names()] == ["abc"]
+    assert object_store.path(".content-disposition/abc") is None
+    assert object_store.get("abc") == b"plugin"
+    assert object_store.path("abc") == str(tmp_path / "abc")
+    assert object_store.path("../abc") is None
+    assert not object_store.exists("def")
+    with pytest.raises(ValueError):
+        object_store.put(b"plugin", "../abc")
+    object_store.delete("abc")
+    assert not (tmp_path / ".content-disposition" / "abc").exists()
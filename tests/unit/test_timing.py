@@ -0,0 +1,62 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+"""
+
+from flask import Flask
+
+from src.plugin import timing
+
+
+def test_spans_accumulated():
+    """
+    Durations of spans with the same name are summed per request
+    """
+
+    with Flask(__name__).app_context():
+        timing.record("s3.put", 1.5)
+        timing.record("s3.put", 2.5)
+        with timing.span("zip.inspect"):
+            pass
+        spans = timing.spans()
+    assert spans["s3.put"] == {"count": 2, "duration": 4.0}
+    assert spans["zip.inspect"]["count"] == 1
+
+
+def test_spans_outside_request(mocker):
+    """
+    Spans outside of a request are discarded
+    """
+
+    mocker.patch("src.plugin.timing.has_app_context", return_value=False)
+    timing.record("s3.put", 1.5)
+    assert not timing.spans()
+
+
+def test_dynamodb_spans():
+    """
+    Each DynamoDB request is timed by operation
+    """
+
+    with Flask(__name__).app_context():
+        timing.dynamodb_started(None, "Query", "table", "1234")
+        timing.dynamodb_finished(None, "Query", "table", "1234")
+        assert timing.spans()["dynamodb.Query"]["count"] == 1
+
+
+def test_server_timing():
+    """
+    Spans are formatted as Server-Timing metrics
+    """
+
+    with Flask(__name__).app_context():
+        timing.record("s3.put", 1.5)
+        assert timing.server_timing(10) == 's3.put;desc="1";dur=1.5, total;dur=10'
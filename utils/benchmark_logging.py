@@ -0,0 +1,81 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Benchmark of the per request logging overhead (the CorrelationId and
+    RequestMetadata events) for each log sample rate.
+
+    Usage:
+        python -m utils.benchmark_logging --requests 20000
+
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import time
+
+import structlog
+
+from src.plugin import api, log
+
+LAMBDA_ENV = {
+    "AWS_LAMBDA_FUNCTION_NAME": "benchmark",
+    "AWS_LAMBDA_FUNCTION_MEMORY_SIZE": "0",
+    "AWS_LAMBDA_FUNCTION_VERSION": "0",
+    "AWS_LAMBDA_LOG_STREAM_NAME": "benchmark",
+    "AWS_REGION": "benchmark",
+}
+
+
+def per_request_us(requests, sample_rate):
+    """
+    Time the logging of simulated requests
+    :param requests: number of requests
+    :type requests: int
+    :param sample_rate: LOG_SAMPLE_RATE
+    :type sample_rate: float
+    :returns: mean logging time per request (μs)
+    :rtype: float
+    """
+
+    log.LOG_SAMPLE_RATE = sample_rate
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        log.configure()
+        structlog.configure(logger_factory=structlog.PrintLoggerFactory(devnull))
+        response = api.app.response_class()
+        elapsed = 0.0
+        for _ in range(requests):
+            with api.app.test_request_context("/v1/plugin"):
+                start = time.perf_counter()
+                api.before_request()
+                api.after_request(response)
+                elapsed += time.perf_counter() - start
+    return elapsed / requests * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per request logging overhead")
+    parser.add_argument("--requests", type=int, default=10000, help="simulated requests per configuration")
+    parser.add_argument("--sample-rates", type=float, nargs="+", default=[1, 0.1], help="LOG_SAMPLE_RATE values")
+    args = parser.parse_args()
+
+    os.environ.update({key: value for key, value in LAMBDA_ENV.items() if key not in os.environ})
+    report = {}
+    with contextlib.redirect_stdout(None):
+        for sample_rate in args.sample_rates:
+            report[f"sample_rate={sample_rate}"] = round(per_request_us(args.requests, sample_rate), 1)
+    print(json.dumps({"per_request_us": report}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Script merging the StackSamples events of exported API logs (JSON lines,
+    e.g. from CloudWatch) into collapsed stacks, one "<stack> <count>"
+    per line, as taken by flamegraph.pl and speedscope.
+
+    Usage:
+        python -m utils.collapse_stacks api-logs.jsonl > stacks.txt
+        flamegraph.pl stacks.txt > plugins.svg
+
+"""
+
+import argparse
+import sys
+from collections import Counter
+
+from src.plugin.log import read_events
+
+
+def merge_stacks(lines):
+    """
+    Merge the stacks of all StackSamples events
+    :param lines: log lines
+    :type lines: iterable
+    :returns: collapsed stack -> samples
+    :rtype: collections.Counter
+    """
+
+    stacks: Counter[str] = Counter()
+    for event in read_events(lines, "StackSamples"):
+        stacks.update(event["stacks"])
+    return stacks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge StackSamples log events into collapsed stacks")
+    parser.add_argument("logs", nargs="*", help="log files. Defaults to stdin")
+    args = parser.parse_args()
+
+    stacks: Counter[str] = Counter()
+    for path in args.logs or ["-"]:
+        if path == "-":
+            stacks.update(merge_stacks(sys.stdin))
+            continue
+        with open(path, encoding="utf-8") as logs:
+            stacks.update(merge_stacks(logs))
+    for stack, count in stacks.most_common():
+        print(f"{stack} {count}")
+
+
+if __name__ == "__main__":
+    main()
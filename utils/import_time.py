@@ -0,0 +1,95 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Script for reporting the cold start import cost of the API
+    via python -X importtime.
+
+    Each run imports the module in a fresh python process. The median over all
+    runs is reported for the total and for each of the most expensive top
+    level packages. With --max-ms the script fails if the total exceeds the
+    budget so regressions are visible in CI.
+
+    Usage:
+        python utils/import_time.py --runs 5 --top 15 --max-ms 600
+
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+
+def import_times(module):
+    """
+    Import a module in a fresh python process
+    :param module: module to import
+    :type module: str
+    :returns: total import time (μs) and self time (μs) per top level package
+    :rtype: tuple
+    """
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=root,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total = 0
+    packages: defaultdict[str, int] = defaultdict(int)
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        name = name.strip()
+        packages[name.split(".")[0]] += int(self_us)
+        if name == module:
+            total = int(cumulative_us)
+    return total, packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the cold start import cost of the API")
+    parser.add_argument("--module", default="src.plugin.api", help="module to import")
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes to time")
+    parser.add_argument("--top", type=int, default=15, help="number of packages to report")
+    parser.add_argument("--max-ms", type=float, help="fail if the median total exceeds this budget")
+    args = parser.parse_args()
+
+    totals = []
+    packages = defaultdict(list)
+    for _ in range(args.runs):
+        total, run_packages = import_times(args.module)
+        totals.append(total)
+        for name, self_us in run_packages.items():
+            packages[name].append(self_us)
+
+    total_ms = statistics.median(totals) / 1000
+    package_ms = {name: statistics.median(times) / 1000 for name, times in packages.items()}
+    report = {
+        "module": args.module,
+        "total_ms": round(total_ms, 1),
+        "packages_ms": {name: round(ms, 1) for name, ms in sorted(package_ms.items(), key=lambda item: -item[1])[: args.top]},
+    }
+    print(json.dumps(report, indent=2))
+
+    if args.max_ms is not None and total_ms > args.max_ms:
+        sys.exit(f"Import of {args.module} took {total_ms:.1f} ms, over the {args.max_ms} ms budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Script for measuring cold and warm request latency with and without
+    AWS client warm-up (the AWS_WARM_UP environment variable).
+
+    Each run starts a fresh python process (a cold container), imports the API,
+    then times the first (cold) request and subsequent (warm) requests via the
+    flask test client. Requests are made against the AWS resources configured
+    in the environment (or local stand-ins via AWS_ENDPOINT_URL), so requires:
+        * REPO_BUCKET_NAME
+        * PLUGINS_TABLE_NAME
+        * AWS_REGION
+        * AWS credentials
+
+    Usage:
+        python utils/measure_latency.py --runs 5 --path /v1/health
+
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROBE = """
+import json, os, sys, time
+start = time.perf_counter()
+from src.plugin import api
+imported = time.perf_counter()
+client = api.app.test_client()
+timings = []
+for _ in range(int(sys.argv[2]) + 1):
+    request_start = time.perf_counter()
+    response = client.get(sys.argv[1])
+    timings.append((time.perf_counter() - request_start) * 1000)
+print(json.dumps({
+    "status": response.status_code,
+    "import_ms": (imported - start) * 1000,
+    "cold_ms": timings[0],
+    "warm_ms": timings[1:],
+}))
+"""
+
+LAMBDA_ENV = {
+    "AWS_LAMBDA_FUNCTION_NAME": "measure_latency",
+    "AWS_LAMBDA_FUNCTION_MEMORY_SIZE": "0",
+    "AWS_LAMBDA_FUNCTION_VERSION": "0",
+    "AWS_LAMBDA_LOG_STREAM_NAME": "measure_latency",
+}
+
+
+def run(warm_up, path, warm_requests):
+    """
+    Time one cold container
+    :param warm_up: AWS_WARM_UP value ("" for none)
+    :type warm_up: str
+    :param path: API path to request
+    :type path: str
+    :param warm_requests: number of warm requests to make
+    :type warm_requests: int
+    :returns: timings
+    :rtype: dict
+    """
+
+    env = {**LAMBDA_ENV, **os.environ, "AWS_WARM_UP": warm_up}
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output(
+        [sys.executable, "-c", PROBE, path, str(warm_requests)], env=env, cwd=root, stderr=subprocess.DEVNULL
+    )
+    return json.loads(output.splitlines()[-1])
+
+
+def summarise(results):
+    """
+    Summarise the timings of all runs for a warm-up mode
+    """
+
+    warm = [timing for result in results for timing in result["warm_ms"]]
+    return {
+        "statuses": sorted(set(result["status"] for result in results)),
+        "import_ms": statistics.median(result["import_ms"] for result in results),
+        "cold_ms": statistics.median(result["cold_ms"] for result in results),
+        "cold_total_ms": statistics.median(result["import_ms"] + result["cold_ms"] for result in results),
+        "warm_ms": statistics.median(warm) if warm else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold and warm request latency")
+    parser.add_argument("--runs", type=int, default=5, help="cold containers per warm-up mode")
+    parser.add_argument("--warm-requests", type=int, default=10, help="warm requests per container")
+    parser.add_argument("--path", default="/v1/health", help="API path to request")
+    parser.add_argument("--modes", nargs="+", default=["", "clients", "connect"], help="AWS_WARM_UP values to compare")
+    args = parser.parse_args()
+
+    report = {}
+    for mode in args.modes:
+        results = [run(mode, args.path, args.warm_requests) for _ in range(args.runs)]
+        report[mode or "none"] = summarise(results)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+################################################################################
+#
+#  LINZ QGIS plugin repository,
+#  Crown copyright (c) 2020, Land Information New Zealand on behalf of
+#  the New Zealand Government.
+#
+#  This file is released under the MIT licence. See the LICENCE file found
+#  in the top-level directory of this distribution for more information.
+#
+################################################################################
+
+    Script replaying representative requests with memory tracing enabled
+    and recommending a Lambda memory size.
+
+    Each request is made in a fresh python process (a cold container) so its
+    maximum resident set size is its own.
+
+    By default requests are made against SQLite stand-ins for the table and
+    bucket, seeded with a catalogue of --plugins plugins and a secret for
+    --plugin-id, so nothing is uploaded anywhere. Requests are only made
+    against the AWS resources configured in the environment (REPO_BUCKET_NAME,
+    PLUGINS_TABLE_NAME, AWS_REGION and AWS credentials) with --live, naming
+    their STAGE. Live uploads revise the plugin so require its secret. The
+    memory used by the AWS clients is only measured with --live.
+
+    Usage:
+        python -m utils.recommend_memory \\
+            --get "/v1/plugins.xml?qgis=3.34" --get /v1/plugin \\
+            --upload <largest plugin file> --plugin-id <plugin id> [--live <stage> --token <secret>]
+
+"""
+
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks import catalogue
+from benchmarks.stand_ins import BUCKET_NAME, LOCAL_ENV
+from src.plugin import storage
+
+# Lambda memory sizes are set in MB. 128 MB is the minimum
+LAMBDA_MIN_MB = 128
+LAMBDA_STEP_MB = 64
+MB = 1024 * 1024
+
+PROBE = """
+import json, sys
+from unittest import mock
+from src.plugin import api
+method, path, data_path, token = sys.argv[1:5]
+data = open(data_path, "rb").read() if data_path else None
+headers = {"Authorization": f"Bearer {token}"} if token else {}
+client = api.app.test_client()
+with mock.patch("src.plugin.api.get_log") as log:
+    response = client.open(path, method=method, data=data, headers=headers)
+[usage] = [c.kwargs["memory"] for c in log.return_value.info.call_args_list if c.args[0] == "RequestMetadata"]
+print(json.dumps({"status": response.status_code, **usage}))
+"""
+
+LAMBDA_ENV = {
+    "AWS_LAMBDA_FUNCTION_NAME": "recommend_memory",
+    "AWS_LAMBDA_FUNCTION_MEMORY_SIZE": "0",
+    "AWS_LAMBDA_FUNCTION_VERSION": "0",
+    "AWS_LAMBDA_LOG_STREAM_NAME": "recommend_memory",
+}
+
+
+def stand_in_env(directory, plugins, upload_plugin_id=None, plugin_stage=""):
+    """
+    Create seeded SQLite stand-ins for the table and bucket
+    :param directory: directory the stand-ins are created in
+    :type directory: str
+    :param plugins: number of plugins in the catalogue
+    :type plugins: int
+    :param upload_plugin_id: plugin given a secret (catalogue.TOKEN) for uploads
+    :type upload_plugin_id: str
+    :param plugin_stage: the stage of the plugins (e.g. dev)
+    :type plugin_stage: str
+    :returns: environment of the API using the stand-ins
+    :rtype: dict
+    """
+
+    metadata_url = f"{storage.SQLITE_PREFIX}/{os.path.join(directory, 'metadata.sqlite')}"
+    object_url = f"{storage.SQLITE_PREFIX}/{os.path.join(directory, 'objects.sqlite')}"
+    storage.METADATA_STORE_URL = metadata_url
+    plugin_ids = catalogue.seed(plugins, plugin_stage)
+    # Seeded plugins already have the secret
+    if upload_plugin_id and upload_plugin_id not in plugin_ids:
+        catalogue.batch_put(
+            [
+                catalogue.version_zero(upload_plugin_id, plugin_stage, revisions=0),
+                catalogue.token_record(upload_plugin_id, plugin_stage),
+            ]
+        )
+    # Fake credentials so no request can reach AWS
+    return {
+        **LOCAL_ENV,
+        "METADATA_STORE_URL": metadata_url,
+        "OBJECT_STORE_URL": object_url,
+        "REPO_BUCKET_NAME": BUCKET_NAME,
+    }
+
+
+def measure(method, path, data_path=None, token=None, env=None):
+    """
+    Make a request with memory tracing in a fresh process
+    :param method: HTTP method
+    :type method: str
+    :param path: API path
+    :type path: str
+    :param data_path: path of a file to send as the request body
+    :type data_path: str
+    :param token: plugin secret
+    :type token: str
+    :param env: environment overriding that of this process (e.g. stand_in_env)
+    :type env: dict
+    :returns: response status, peak traced memory and max rss (bytes)
+    :rtype: dict
+    """
+
+    env = {**LAMBDA_ENV, **os.environ, **(env or {}), "MEMORY_TRACE": "true", "MEMORY_TOP": "0"}
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output(
+        [sys.executable, "-c", PROBE, method, path, data_path or "", token or ""], env=env, cwd=root
+    )
+    return json.loads(output.splitlines()[-1])
+
+
+def recommend(max_rss, headroom):
+    """
+    Recommend a Lambda memory size
+    :param max_rss: largest maximum resident set size of any request (bytes)
+    :type max_rss: int
+    :param headroom: fraction added for larger inputs and fragmentation
+    :type headroom: float
+    :returns: memory size (MB)
+    :rtype: int
+    """
+
+    needed_mb = max_rss * (1 + headroom) / MB
+    return max(LAMBDA_MIN_MB, math.ceil(needed_mb / LAMBDA_STEP_MB) * LAMBDA_STEP_MB)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recommend a Lambda memory size from representative requests")
+    parser.add_argument("--get", action="append", default=[], help="API path to GET. Can be repeated")
+    parser.add_argument("--upload", action="append", default=[], help="plugin file to upload. Can be repeated")
+    parser.add_argument("--plugin-id", help="plugin id uploads are made to")
+    parser.add_argument("--stage", default="", help="plugin stage (e.g. dev)")
+    parser.add_argument("--plugins", type=int, default=200, help="plugins in the stand-in catalogue")
+    parser.add_argument("--live", metavar="STAGE", help="use the AWS resources configured for this deployment stage")
+    parser.add_argument("--token", help="plugin secret for live uploads")
+    parser.add_argument("--headroom", type=float, default=0.5, help="fraction added to the largest max rss")
+    args = parser.parse_args()
+
+    if args.live and args.live != os.environ.get("STAGE"):
+        parser.error(f"--live {args.live} does not match the configured STAGE ({os.environ.get('STAGE')})")
+    if args.upload and not args.plugin_id:
+        parser.error("--upload requires --plugin-id")
+    if args.upload and args.live and not args.token:
+        parser.error("live uploads require --token")
+    stage = f"?stage={args.stage}" if args.stage else ""
+    requests = [("GET", path, None) for path in args.get]
+    requests += [("POST", f"/v1/plugin/{args.plugin_id}{stage}", path) for path in args.upload]
+    if not requests:
+        parser.error("at least one --get or --upload is required")
+
+    with tempfile.TemporaryDirectory() as directory:
+        env, token = None, args.token
+        if not args.live:
+            env, token = stand_in_env(directory, args.plugins, args.plugin_id, args.stage), catalogue.TOKEN
+        results = []
+        for method, path, data_path in requests:
+            usage = measure(method, path, data_path, token, env)
+            results.append(
+                {
+                    "request": f"{method} {path}" + (f" ({os.path.basename(data_path)})" if data_path else ""),
+                    "status": usage["status"],
+                    "peak_mb": round(usage["peak"] / MB, 1),
+                    "max_rss_mb": round(usage["maxRss"] / MB, 1),
+                }
+            )
+    max_rss = max(result["max_rss_mb"] for result in results) * MB
+    print(json.dumps({"requests": results, "recommended_memory_mb": recommend(max_rss, args.headroom)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()